@@ -0,0 +1,432 @@
+"""
+The agent loop shared by every backend.
+
+A backend (see assistant.BACKENDS) only has to turn a user message into a
+reply; asking for the next command, running it, compacting its output and
+deciding when the task is done all happen here, once.
+
+The loop runs on asyncio: the LLM call runs on a thread, command output is
+read through the event loop and history/output-log writes go to background
+writers, so disk I/O overlaps the next request instead of sitting between
+steps. run_task() and execute_command_stream() are blocking wrappers for
+callers without an event loop.
+"""
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from colorama import init as colorama_init, Fore
+
+from context_window import ContextWindow, TASK_PREFIX
+from dns_resolver import rewrite_hostnames
+from history_index import history_recall
+from history_store import HistoryStore
+from llm_stream import CODE_BLOCK_RE, token_printer
+from output_compactor import compact_output, estimate_tokens
+from probe_cache import MUTATING_RE, get_probe_cache, label as label_cached
+from shell_worker import ShellWorker, get_worker
+import tracing
+
+colorama_init(autoreset=True)
+
+HISTORY_FILE = os.path.expanduser("~/.shell_history.jsonl")  # shared by every ChatBackend
+LEGACY_HISTORY_FILE = os.path.expanduser("~/.shell_history.json")  # imported once if present
+HISTORY_TAIL = 50  # past messages read at startup; the token budget decides how many are sent
+STREAM = True  # print tokens live and stop generating once the bash block closes
+
+# One LLM call per step: the reply judges the last output and carries the next command
+FIRST_STEP_PROMPT = (
+    "\nProvide next bash command in a code block. Independent commands (e.g. checks of several hosts) "
+    "may go one per line in a block whose first line is '# parallel'; they then run at the same time, "
+    "each in a new shell that only sees exported variables."
+)
+NEXT_STEP_PROMPT = (
+    "\nStart with one line saying whether the output shows success or failure. "
+    "Then reply 'TASK COMPLETE' if the task is done, otherwise give the next bash command in a code block."
+)
+NO_COMMAND_PROMPT = (
+    "ERROR: You must output exactly one bash command inside a 'bash' "
+    "code block with no placeholders."
+)
+MAX_EMPTY_RETRIES = 3
+PARALLEL_EXEC = True     # run independent lines of one bash block at the same time
+PARALLEL_MAX = 8         # commands of one block running at once
+PERSISTENT_SHELL = True  # run every command in one long-lived bash (cd/export carry over); False forks a shell per command
+
+# A block is parallel when the model marks it (```bash parallel, or this as its first line),
+# or when every line starts with one of these tools
+PARALLEL_MARKER_RE = re.compile(r"#\s*parallel", re.IGNORECASE)
+PARALLEL_AUTO_RE = re.compile(
+    r"(sudo\s+)?(timeout\s+\S+\s+)?(ping|curl|wget|dig|nslookup|host|whois|traceroute|tracepath|nmap|nc|ncat|"
+    r"ssh-keyscan|whatweb|sslscan)\b"
+)
+# Lines that read or change state other lines could depend on
+STATEFUL_RE = re.compile(r"(^|[;&|(]\s*)((cd|pushd|popd|export|unset|source|alias|set|read|exec)\b|\.\s)|^\w+=|[<>]|\\$|\|\s*$")
+DISCARD_RE = re.compile(r"\d?>>?\s*(/dev/null|&\d)")
+VARIABLE_RE = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+# Set by bash itself in every shell, exported or not
+BASH_VARIABLES = {"BASH", "BASHPID", "BASH_VERSION", "EPOCHREALTIME", "EPOCHSECONDS", "EUID", "GROUPS", "HOSTNAME",
+                  "HOSTTYPE", "IFS", "LINENO", "MACHTYPE", "OSTYPE", "PPID", "PWD", "RANDOM", "SECONDS", "SRANDOM",
+                  "UID"}
+
+# Commands have no terminal to ask for a password on, so sudo gets -n: it fails at once with
+# "a password is required" instead of "a terminal is required" (or a hang)
+SUDO_RE = re.compile(r"(^|[;&|(]\s*|\bxargs\s+)sudo(?=\s)(?!\s+-\w*[nSA])")
+SUDO_PASSWORD_HINT = ("[sudo needs a password here, and commands run without a terminal, so it cannot ask for one. "
+                      "Do it without sudo if you can; otherwise the user has to allow passwordless sudo.]")
+
+# Execution limits: wall-clock seconds, seconds without output, bytes of output kept.
+# The first COMMAND_LIMITS pattern matching the command overrides DEFAULT_LIMITS.
+DEFAULT_LIMITS = {"timeout": 300, "idle_timeout": 120, "max_bytes": 1 << 20}
+COMMAND_LIMITS = [
+    (r"\btail\s+-[a-zA-Z]*[fF]|\bwatch\b|\b(h?top|journalctl\s+-f)\b", {"timeout": 15}),
+    (r"^\s*(sudo\s+)?(apt|apt-get|dnf|yum|pip3?|npm|docker|make|cargo)\b", {"timeout": 1800, "idle_timeout": 600}),
+    (r"\b(nmap|masscan|gobuster|nikto|hydra|sqlmap)\b", {"timeout": 900, "idle_timeout": 300}),
+]
+
+
+class BaseBackend:
+    """
+    Subclasses implement chat(); everything else has a sensible default.
+    chat() returns (reply, None) on success and (None, error) when the
+    backend has given up, which ends the task.
+    """
+    name = ""
+    stream = True               # replies are echoed token by token through on_token
+    output_token_budget = 1000  # command output is compacted to this before it is sent back
+    rewrite_hosts = True        # replace hostnames with IPs before executing
+    next_step_prompt = NEXT_STEP_PROMPT
+
+    def chat(self, message, on_token=None):
+        raise NotImplementedError
+
+    def first_message(self, task):
+        return TASK_PREFIX + task + FIRST_STEP_PROMPT
+
+    def handle_reply(self, reply):
+        """Return a message to send straight back (e.g. tool lookups), or None to go on."""
+        return None
+
+    def review_output(self, cmd, output):
+        """Build the next user message from a command and its output."""
+        return f"Command: {cmd}\nOutput:\n{compact_output(output, self.output_token_budget)}" + self.next_step_prompt
+
+    def close(self):
+        pass
+
+
+class ChatBackend(BaseBackend):
+    """
+    A backend that keeps the shared chat history: every message is appended
+    to HISTORY_FILE and the model gets a ContextWindow of the newest ones
+    that fit the backend's token budget, plus recalled older turns.
+    """
+
+    def open_history(self, system_prompt, token_budget):
+        self.history_store = HistoryStore(HISTORY_FILE, legacy_path=LEGACY_HISTORY_FILE)
+        # Only the tail is ever sent to the model, so only the tail is read
+        self.chat_history = ContextWindow(system_prompt, token_budget, self.history_store.load_tail(HISTORY_TAIL),
+                                          recall=history_recall(self.history_store))
+
+    def window(self):
+        """System prompt + newest messages that fit the token budget (kept up to date on append)."""
+        return self.chat_history.messages()
+
+    def save_history(self, *messages):
+        # Append-only: saving a turn costs the same however long the history is
+        try:
+            for msg in messages:
+                self.history_store.append(msg)
+        except Exception as e:
+            print(Fore.RED + f"[ERROR] Failed to save history: {e}")
+
+
+# ─── COMMAND EXECUTION ───────────────────────────────────────────────────────
+def noninteractive_sudo(cmd):
+    return SUDO_RE.sub(r"\1sudo -n", cmd)
+
+def check_sudo():
+    """Warn when sudo would need a password, which commands can't type; returns whether sudo works."""
+    if os.geteuid() == 0 or not shutil.which("sudo"):
+        return True
+    try:
+        # Same conditions as the commands: no terminal, no stdin
+        ok = subprocess.run(["sudo", "-n", "true"], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=True, timeout=5).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        ok = False
+    if not ok:
+        print(Fore.YELLOW + "[WARN] sudo needs a password, and commands run without a terminal, so every command "
+                            "using sudo will fail. Allow passwordless sudo for this user (NOPASSWD in sudoers) "
+                            "or run the assistant as root.")
+    return ok
+
+def preprocess_cmd(cmd):
+    # Replace hostnames with IPs; lookups run concurrently with a deadline and are cached for the session
+    return rewrite_hostnames(cmd)
+
+def command_limits(cmd, timeout=None):
+    limits = dict(DEFAULT_LIMITS)
+    for pattern, overrides in COMMAND_LIMITS:
+        if re.search(pattern, cmd):
+            limits.update(overrides)
+            break
+    if timeout is not None:
+        limits["timeout"] = timeout
+    return limits
+
+async def run_command(cmd, rewrite_hosts=True, timeout=None, worker=None, echo=True):
+    """
+    Run one command and return (output, exit_code, limit). Runs in `worker`
+    if one is given, otherwise in the persistent shell. A cached read-only
+    probe comes back labelled with exit code 0. When a limit killed the
+    command, the output says so.
+    """
+    # Add -c 4 to ping commands if not present to prevent indefinite execution
+    if cmd.startswith('ping ') and '-c' not in cmd and '-n' not in cmd:
+        cmd += ' -c 4'
+    own_worker = worker is None and not PERSISTENT_SHELL
+    if worker is None:
+        worker = get_worker() if PERSISTENT_SHELL else ShellWorker()
+    probes, probe_cmd, context = get_probe_cache(), cmd, worker.context()
+    cached = probes.get(cmd, context) if probes else None
+    if cached:
+        # A read-only probe that already ran with nothing changed since: skip it
+        print(Fore.GREEN + f"💻 Cached Command: {cmd}\n")
+        if echo:
+            print(Fore.WHITE + cached[0])
+        tracing.record("exec", 0.0, cmd=cmd[:200], cached=True)
+        if own_worker:
+            worker.close()
+        return label_cached(cached[0], cached[1]).strip(), 0, None
+    if rewrite_hosts:
+        # Lookups block for at most DNS_TIMEOUT; keep them off the event loop
+        with tracing.span("dns"):
+            cmd = await asyncio.to_thread(preprocess_cmd, cmd)
+    cmd = noninteractive_sudo(cmd)
+    print(Fore.GREEN + f"💻 Executing Command: {cmd}\n")
+    on_output = (lambda text: print(Fore.WHITE + text, end='')) if echo else None
+    try:
+        with tracing.span("exec", cmd=cmd[:200]) as sp:
+            out, code, limit = await worker.run_async(cmd, on_output=on_output, **command_limits(cmd, timeout))
+            sp.update(bytes=len(out.encode()), exit_code=code, limit=limit)
+    finally:
+        if own_worker:
+            worker.close()
+    if probes:
+        probes.record(probe_cmd, out, code, limit, context)
+    if code and "sudo: a password is required" in out:
+        out += "\n" + SUDO_PASSWORD_HINT
+    if limit:
+        # Tell the model the output is partial and why, so it can pick a bounded variant
+        print(Fore.YELLOW + f"\n[WARN] Command killed: it {limit}.")
+        out += (f"\n[Command killed: it {limit}. Output above is partial. "
+                f"The shell was restarted in {worker.cwd}; exported variables were reset.]")
+    return out.strip(), code, limit
+
+async def execute_command_async(cmd, rewrite_hosts=True, timeout=None):
+    out, code, limit = await run_command(cmd, rewrite_hosts, timeout)
+    if code and not limit:
+        out += f"\n(exit code {code})"
+    return out.strip()
+
+async def shell_environment():
+    """Exported variables of the persistent shell (None without one, or if they can't be read)."""
+    if not PERSISTENT_SHELL:
+        return None
+    return await get_worker().environment()
+
+def missing_variables(cmds, env):
+    """
+    Variables the lines use that a fresh shell started with `env` would not
+    have, i.e. plain (unexported) variables of the persistent shell.
+    Text in single quotes (awk programs and the like) is not expanded and is skipped.
+    """
+    used = {name for cmd in cmds for name in VARIABLE_RE.findall(re.sub(r"'[^']*'", "", cmd))}
+    return sorted(used - set(env or ()) - BASH_VARIABLES)
+
+async def execute_parallel_async(cmds, rewrite_hosts=True, timeout=None, env=None):
+    """
+    Run independent commands concurrently, at most PARALLEL_MAX at a time.
+    Each runs in its own shell started in the persistent shell's directory
+    with `env` (its exported variables, see shell_environment()). Output is
+    captured per command and returned in the original order with exit
+    codes, so the step takes as long as the slowest command.
+    """
+    print(Fore.GREEN + f"⚡ Running {len(cmds)} independent commands in parallel\n")
+    cwd = get_worker().cwd if PERSISTENT_SHELL else None
+    gate = asyncio.Semaphore(PARALLEL_MAX)
+
+    async def one(i, cmd):
+        async with gate:
+            worker = ShellWorker(cwd=cwd, env=env)
+            try:
+                out, code, limit = await run_command(cmd, rewrite_hosts, timeout, worker=worker, echo=False)
+            finally:
+                worker.close()
+        header = f"[{i}/{len(cmds)}] $ {cmd}  ({'killed' if limit else f'exit code {code}'})"
+        print(Fore.WHITE + f"{header}\n{out}\n")
+        return f"{header}\n{out}"
+
+    with tracing.span("parallel", commands=len(cmds)):
+        results = await asyncio.gather(*(one(i, cmd) for i, cmd in enumerate(cmds, 1)))
+    return "\n\n".join(results)
+
+def execute_command_stream(cmd, rewrite_hosts=True, timeout=None):
+    return asyncio.run(execute_command_async(cmd, rewrite_hosts, timeout))
+
+def command_lines(text):
+    """
+    The command lines of the reply's ```bash block (or of the whole reply if
+    there is none), skipping comments and NOTE: lines. Returns (lines,
+    marked_parallel): marked by the fence (```bash parallel) or by a
+    '# parallel' first line.
+    """
+    m = CODE_BLOCK_RE.search(text)
+    block = m.group("body") if m else text
+    lines, marked = [], bool(m and m.group("info"))
+    for line in block.splitlines():
+        stripped = line.strip().lstrip('$').strip()
+        if not lines and PARALLEL_MARKER_RE.fullmatch(stripped):
+            marked = True
+            continue
+        if not stripped or stripped.startswith('#') or stripped.upper().startswith('NOTE:'):
+            continue
+        lines.append(stripped)
+    return lines, marked
+
+def extract_command(text):
+    """Pull the bash command out of the reply, its lines chained with &&."""
+    return ' && '.join(command_lines(text)[0])
+
+def parallel_commands(text):
+    """
+    The block's lines if they may run concurrently, else None. They may when
+    the block is marked parallel (```bash parallel, or '# parallel' as its
+    first line) or when every line starts with a network/scan tool from
+    PARALLEL_AUTO_RE. Either way no line may touch shared shell state (cd,
+    export, assignments, redirects into files, continued lines) or change
+    the system.
+    """
+    lines, marked = command_lines(text)
+    if not PARALLEL_EXEC or len(lines) < 2:
+        return None
+    for line in lines:
+        bare = DISCARD_RE.sub("", line)
+        if STATEFUL_RE.search(bare) or MUTATING_RE.search(bare):
+            return None
+        if not marked and not PARALLEL_AUTO_RE.match(line):
+            return None
+    return lines
+
+def is_task_complete(reply):
+    return re.search(r"TASK COMPLETE", reply, re.IGNORECASE) is not None
+
+
+# ─── MAIN LOOP ───────────────────────────────────────────────────────────────
+def in_thread(fn, *args, **kwargs):
+    """
+    Await fn(*args, **kwargs) running on a daemon thread. Unlike
+    asyncio.to_thread, an interrupted call (Ctrl-C mid-stream) doesn't keep
+    the process alive until the backend returns.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def target():
+        try:
+            result, error = fn(*args, **kwargs), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # loop already closed after an interrupt
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+async def run_task_async(backend, task):
+    print(Fore.BLUE + f"🎯 Task: {task}\n")
+    await asyncio.to_thread(check_sudo)
+    user_msg = backend.first_message(task)
+    empty_retries = 0
+    step = 0
+    try:
+        while True:
+            step += 1
+            tracing.set_step(step)
+            printer = token_printer("🧠 LLM Response:", Fore.MAGENTA) if backend.stream else None
+            started, first_token = time.monotonic(), []
+
+            def on_token(chunk):
+                if not first_token:
+                    first_token.append(time.monotonic())
+                    tracing.record("ttft", first_token[0] - started)
+                printer(chunk)
+
+            with tracing.span("llm", backend=backend.name) as sp:
+                reply, error = await in_thread(backend.chat, user_msg, on_token=on_token if printer else None)
+                sp["reply_tokens"] = estimate_tokens(reply or "")
+            if error:
+                print(Fore.RED + f"\n[ERROR] {backend.name}: {error}")
+                return False
+            print("\n" if backend.stream else Fore.MAGENTA + "🧠 LLM Response:\n" + reply + "\n")
+
+            with tracing.span("tools"):
+                follow_up = await in_thread(backend.handle_reply, reply)
+            if follow_up:
+                user_msg = follow_up
+                continue
+            if is_task_complete(reply):
+                print(Fore.GREEN + "✅ Task complete.")
+                return True
+
+            cmd = extract_command(reply)
+            if not cmd:
+                empty_retries += 1
+                if empty_retries >= MAX_EMPTY_RETRIES:
+                    print(Fore.RED + "[ERROR] No command extracted. Giving up.")
+                    return False
+                user_msg = NO_COMMAND_PROMPT
+                continue
+            empty_retries = 0
+
+            parallel = parallel_commands(reply)
+            env = await shell_environment() if parallel else None
+            if parallel and PERSISTENT_SHELL and missing_variables(parallel, env):
+                # A new shell would expand them to nothing; the chained lines see them
+                print(Fore.YELLOW + "[INFO] Lines use unexported shell variables "
+                      f"({', '.join(missing_variables(parallel, env))}); running them in order")
+                parallel = None
+            if parallel:
+                cmd = "\n".join(parallel)
+                out = await execute_parallel_async(parallel, rewrite_hosts=backend.rewrite_hosts, env=env)
+            else:
+                out = await execute_command_async(cmd, rewrite_hosts=backend.rewrite_hosts)
+            with tracing.span("compact") as sp:
+                user_msg = backend.review_output(cmd, out)
+                sp["tokens"] = estimate_tokens(user_msg)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print(Fore.YELLOW + "\nInterrupted by user.")
+        return False
+    finally:
+        backend.close()
+
+def run_task(backend, task):
+    try:
+        return asyncio.run(run_task_async(backend, task))
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nInterrupted by user.")
+        return False
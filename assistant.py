@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Single entry point for every backend:
+
+    python3 -m assistant [--no-cache] [--stats] <backend> "task description"
+    python3 -m assistant [--jobs N] --batch tasks.txt [backend]   (see batch.py)
+    python3 -m assistant --list
+
+Backends are registered by name against the module that implements them
+and are only imported once selected, so starting the tool never pays for
+openai, bs4 or duckduckgo_search unless that backend is actually used (and
+the backends themselves import their client libraries on first call).
+"""
+import importlib
+import os
+import sys
+
+# name -> "module:attribute" of a BaseBackend subclass
+BACKENDS = {
+    "openai": "chatgpt:ChatGPTBackend",
+    "openrouter": "openrouter:OpenRouterBackend",
+    "ollama-chat": "ollama:OllamaChatBackend",
+    "ollama-generate": "deepseek_shell:OllamaGenerateBackend",
+    "duckai": "duckai:DuckAIBackend",
+}
+DEFAULT_BACKEND = "openai"
+
+
+def register_backend(name, target):
+    """Plug in another backend, e.g. register_backend("mine", "my_module:MyBackend")."""
+    BACKENDS[name] = target
+
+
+def load_backend(name):
+    module_name, _, attr = BACKENDS[name].partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "--list":
+        print("\n".join(sorted(BACKENDS)))
+        return 0
+    stats = False
+    batch = None
+    jobs = None
+    while argv and argv[0] in ("--no-cache", "--stats", "--batch", "--jobs"):
+        flag, argv = argv[0], argv[1:]
+        if flag == "--no-cache":
+            import response_cache
+            response_cache.BYPASS = True
+            os.environ["ASSISTANT_NO_CACHE"] = "1"   # inherited by batch tasks
+        elif flag == "--stats":
+            import tracing
+            tracing.enable(keep_spans=True)
+            stats = True
+        elif not argv:
+            print(f"[ERROR] {flag} needs a value")
+            return 1
+        elif flag == "--batch":
+            batch, argv = argv[0], argv[1:]
+        elif not argv[0].isdigit() or int(argv[0]) < 1:
+            print(f"[ERROR] --jobs needs a positive number, got {argv[0]!r}")
+            return 1
+        else:
+            jobs, argv = int(argv[0]), argv[1:]
+    if argv and argv[0] in BACKENDS:
+        name, argv = argv[0], argv[1:]
+    else:
+        name = DEFAULT_BACKEND
+    if batch is not None:
+        return run_batch_mode(batch, name, jobs, ["--stats"] if stats else [])
+    if not argv:
+        print(f"Usage: python3 -m assistant [--no-cache] [--stats] [{'|'.join(sorted(BACKENDS))}] \"task description\"")
+        print(f"       python3 -m assistant [--jobs N] --batch <tasks file|-> [{'|'.join(sorted(BACKENDS))}]")
+        return 1
+
+    from agent import run_task
+    import probe_cache
+    import response_cache
+    backend = load_backend(name)()
+    ok = run_task(backend, " ".join(argv))
+    response_cache.report_stats()
+    probe_cache.report_stats()
+    if stats:
+        import tracing
+        tracing.flush()
+        print(tracing.summarize())
+        print(f"[INFO] Trace written to {tracing.trace_path()}")
+    return 0 if ok else 1
+
+
+def run_batch_mode(path, default_backend, jobs, extra_args):
+    import batch
+    try:
+        tasks = batch.read_tasks(path, default_backend, BACKENDS)
+    except OSError as e:
+        print(f"[ERROR] Cannot read tasks: {e}")
+        return 1
+    if not tasks:
+        print("[ERROR] No tasks to run")
+        return 1
+    items = batch.run_batch(tasks, jobs or batch.JOBS, extra_args)
+    print(batch.format_results(items))
+    return 0 if all(item.status == "ok" for item in items) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
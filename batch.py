@@ -0,0 +1,201 @@
+"""
+Batch mode: run many independent tasks at once.
+
+    python3 -m assistant --batch tasks.txt [--jobs N] [backend]
+    cat tasks.txt | python3 -m assistant --batch - [backend]
+
+The task file has one task per line; blank lines and lines starting with
+'#' are skipped, and a line may start with "<backend>: " to override the
+backend for that task. Each task runs as its own `python3 -m assistant`
+process so nothing is shared by accident: it gets its own working
+directory under BATCH_DIR/<run>/ and its own history.jsonl (see
+history_store.HISTORY_PATH) and output.log there. At most JOBS tasks
+run at a time, and at most BACKEND_CONCURRENCY[backend] of them per
+backend, so a local Ollama is not asked for ten generations at once. The
+run ends with a result table, also saved as results.json in the run
+directory.
+"""
+import json
+import os
+import queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from colorama import Fore
+
+BATCH_DIR = os.path.expanduser("~/.shell_batches")
+JOBS = 4                    # tasks running at the same time
+TASK_TIMEOUT = 3600         # seconds before a task is killed
+# Tasks per backend running at the same time (local models serve one generation at a time)
+BACKEND_CONCURRENCY = {
+    "openai": 4,
+    "openrouter": 2,        # free-tier quota is per account, not per process
+    "duckai": 1,
+    "ollama-chat": 1,
+    "ollama-generate": 1,
+}
+DEFAULT_CONCURRENCY = 2
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMAND_MARKER = "Executing Command:"
+
+
+def parse_tasks(lines, default_backend, backends):
+    """[(backend, task), ...] from task-file lines."""
+    tasks = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        name, sep, rest = line.partition(":")
+        if sep and name.strip() in backends and rest.strip():
+            tasks.append((name.strip(), rest.strip()))
+        else:
+            tasks.append((default_backend, line))
+    return tasks
+
+
+def read_tasks(path, default_backend, backends):
+    if path == "-":
+        return parse_tasks(sys.stdin, default_backend, backends)
+    with open(path, encoding="utf-8") as f:
+        return parse_tasks(f, default_backend, backends)
+
+
+def slug(text, limit=40):
+    return re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-").lower()[:limit] or "task"
+
+
+class BatchTask:
+    def __init__(self, index, backend, task, run_dir):
+        self.index = index
+        self.backend = backend
+        self.task = task
+        self.name = f"{index:02d}-{slug(task)}"
+        self.workdir = os.path.join(run_dir, self.name)
+        self.log_path = os.path.join(self.workdir, "output.log")
+        self.history_path = os.path.join(self.workdir, "history.jsonl")
+        self.status = "pending"
+        self.commands = 0
+        self.seconds = 0.0
+        self.proc = None
+        self.cancelled = False      # killed on purpose (Ctrl-C), not failed
+        self.thread = None
+
+    def run(self, extra_args=(), env=None):
+        os.makedirs(self.workdir, exist_ok=True)
+        env = dict(os.environ if env is None else env)
+        env["ASSISTANT_HISTORY_FILE"] = self.history_path
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+        start = time.monotonic()
+        with open(self.log_path, "w", encoding="utf-8") as log:
+            proc = subprocess.Popen([sys.executable, "-m", "assistant", *extra_args, self.backend, self.task],
+                                    cwd=self.workdir, env=env, stdin=subprocess.DEVNULL,
+                                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            self.proc = proc
+            try:
+                code = proc.wait(timeout=TASK_TIMEOUT)
+                self.status = "interrupted" if self.cancelled else "ok" if code == 0 else "failed"
+            except subprocess.TimeoutExpired:
+                self.kill()
+                self.status = "timeout"
+        self.seconds = time.monotonic() - start
+        self.commands = self._count_commands()
+
+    def cancel(self):
+        """Stop a running task for good; run() then reports it as interrupted."""
+        self.cancelled = True
+        self.status = "interrupted"
+        self.kill()
+
+    def kill(self):
+        proc = self.proc
+        if proc and proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            proc.wait()
+
+    def to_dict(self):
+        return {"index": self.index, "backend": self.backend, "task": self.task, "status": self.status,
+                "commands": self.commands, "seconds": round(self.seconds, 1),
+                "workdir": self.workdir, "log": self.log_path, "history": self.history_path}
+
+    def _count_commands(self):
+        try:
+            with open(self.log_path, encoding="utf-8", errors="replace") as f:
+                return sum(line.count(COMMAND_MARKER) for line in f)
+        except OSError:
+            return 0
+
+
+def run_batch(tasks, jobs=JOBS, extra_args=()):
+    """Run [(backend, task), ...] and return the finished BatchTasks in input order."""
+    run_dir = os.path.join(BATCH_DIR, time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+    items = [BatchTask(i, backend, task, run_dir) for i, (backend, task) in enumerate(tasks, 1)]
+    pending = list(items)
+    running = {}                # backend -> tasks in flight
+    done = queue.Queue()
+    total = len(items)
+    print(Fore.CYAN + f"[INFO] Running {total} tasks ({jobs} at a time) in {run_dir}")
+
+    def worker(item):
+        try:
+            item.run(extra_args)
+        except Exception as e:
+            item.status = f"error: {e}"
+        done.put(item)
+
+    def start_ready():
+        # First pending task whose backend still has room, in file order
+        for item in list(pending):
+            if sum(running.values()) >= jobs:
+                return
+            cap = BACKEND_CONCURRENCY.get(item.backend, DEFAULT_CONCURRENCY)
+            if running.get(item.backend, 0) >= cap:
+                continue
+            pending.remove(item)
+            running[item.backend] = running.get(item.backend, 0) + 1
+            item.status = "running"
+            print(Fore.BLUE + f"[INFO] [{item.index}/{total}] {item.backend}: {item.task}")
+            item.thread = threading.Thread(target=worker, args=(item,), daemon=True)
+            item.thread.start()
+
+    try:
+        start_ready()
+        while sum(running.values()):
+            item = done.get()
+            running[item.backend] -= 1
+            color = Fore.GREEN if item.status == "ok" else Fore.RED
+            print(color + f"[INFO] [{item.index}/{total}] {item.status} after {item.seconds:.0f}s "
+                          f"({item.commands} commands), log: {item.log_path}")
+            start_ready()
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nInterrupted, stopping running tasks...")
+        stopped = [item for item in items if item.status == "running"]
+        for item in stopped:
+            item.cancel()
+        for item in stopped:
+            # Let run() record the time and command count before results.json is written
+            item.thread.join(timeout=5)
+
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, "results.json"), "w") as f:
+        json.dump([item.to_dict() for item in items], f, indent=2)
+    return items
+
+
+def format_results(items):
+    lines = [f"{'#':>3}  {'backend':<16}{'status':<12}{'cmds':>5}{'time':>8}  task"]
+    for item in items:
+        task = item.task if len(item.task) <= 50 else item.task[:47] + "..."
+        lines.append(f"{item.index:>3}  {item.backend:<16}{item.status:<12}{item.commands:>5}"
+                     f"{item.seconds:>7.0f}s  {task}")
+    ok = sum(1 for item in items if item.status == "ok")
+    lines.append(f"{ok}/{len(items)} tasks completed")
+    return "\n".join(lines)
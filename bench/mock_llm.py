@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local mock of every LLM API the backends talk to, for benchmarks.
+
+    OpenAI / OpenRouter   POST /v1/chat/completions  (JSON or SSE)
+    Ollama                POST /api/chat, POST /api/generate  (JSON or NDJSON)
+    Duck.ai               GET /duckchat/v1/status, POST /duckchat/v1/chat  (SSE)
+
+Replies come from a script: the n-th answered request gets the n-th reply,
+whatever the backend or endpoint. Each reply waits LATENCY seconds before
+its first byte and then streams word by word at TOKEN_RATE words per
+second. Every RATE_LIMIT_EVERY-th request is answered with a 429 instead
+(Retry-After: RETRY_AFTER) and does not use up a reply. All of this is set
+per run with POST /script; GET /stats returns how many requests were served
+and how many seconds a client spent waiting on the simulated model (up to
+the closing fence of the bash block, where the backends stop reading), so
+a benchmark can subtract the model time from its own.
+
+    python3 bench/mock_llm.py [port]
+"""
+import json
+import re
+import sys
+import threading
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_stream import CODE_BLOCK_RE  # noqa: E402
+
+PORT = 8765
+LATENCY = 0.05              # seconds before the first byte of a reply
+TOKEN_RATE = 400            # streamed words per second (0 = all at once)
+RATE_LIMIT_EVERY = 0        # answer every n-th request with a 429 (0 = never)
+RETRY_AFTER = "0.2"         # Retry-After header sent with injected 429s
+DEFAULT_REPLY = "TASK COMPLETE"
+
+WORD_RE = re.compile(r"\s*\S+\s*|\s+")
+
+
+class MockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, replies=(), latency=LATENCY, token_rate=TOKEN_RATE,
+              rate_limit_every=RATE_LIMIT_EVERY, retry_after=RETRY_AFTER, chat_api=True):
+        with self.lock:
+            self.replies = list(replies)
+            self.latency = latency
+            self.token_rate = token_rate
+            self.rate_limit_every = rate_limit_every
+            self.retry_after = retry_after
+            self.chat_api = chat_api        # False: /api/chat 404s like an old Ollama build
+            self.requests = 0
+            self.served = 0
+            self.rate_limited = 0
+            self.model_seconds = 0.0
+
+    def next_reply(self):
+        """The reply for this request, or None if it should get a 429."""
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return None
+            reply = self.replies[self.served] if self.served < len(self.replies) else DEFAULT_REPLY
+            self.served += 1
+            return reply
+
+    def waited(self, seconds):
+        with self.lock:
+            self.model_seconds += seconds
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "served": self.served,
+                    "rate_limited": self.rate_limited, "model_seconds": round(self.model_seconds, 4)}
+
+
+def chunks(text):
+    # Words with their trailing whitespace, so the chunks join back into the text
+    return WORD_RE.findall(text)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    # ─── ROUTING ─────────────────────────────────────────────────────────────
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._json(200, self.state.stats())
+        if self.path.startswith("/duckchat/v1/status"):
+            return self._json(200, {"status": "0"}, {"x-vqd-4": "mock-vqd"})
+        self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == "/script":
+            self.state.reset(**body)
+            return self._json(200, {"ok": True})
+        if self.path == "/v1/chat/completions":
+            return self._reply(body, "sse", lambda text: {"choices": [{"delta": {"content": text}}]},
+                               lambda text: {"choices": [{"message": {"role": "assistant", "content": text}}]})
+        if self.path == "/api/chat":
+            if not self.state.chat_api:
+                return self._json(404, {"error": "404 page not found"})
+            return self._reply(body, "ndjson",
+                               lambda text: {"message": {"role": "assistant", "content": text}, "done": False},
+                               lambda text: {"message": {"role": "assistant", "content": text}, "done": True})
+        if self.path == "/api/generate":
+            return self._reply(body, "ndjson", lambda text: {"response": text, "done": False},
+                               lambda text: {"response": text, "done": True})
+        if self.path.startswith("/duckchat/v1/chat"):
+            body["stream"] = True
+            return self._reply(body, "sse", lambda text: {"message": text}, None, {"x-vqd-4": "mock-vqd"})
+        self._json(404, {"error": "not found"})
+
+    # ─── RESPONSES ───────────────────────────────────────────────────────────
+    def _reply(self, body, framing, piece, whole, headers=None):
+        state = self.state
+        reply = state.next_reply()
+        if reply is None:
+            return self._json(429, {"error": {"message": "rate limited", "code": 429}},
+                              {"Retry-After": state.retry_after})
+        start = time.monotonic()
+        model_time = None
+        time.sleep(state.latency)
+        try:
+            if not body.get("stream", False):
+                return self._json(200, whole(reply), headers)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream" if framing == "sse" else "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            sent = ""
+            for word in chunks(reply):
+                self._chunk(self._frame(framing, piece(word)))
+                sent += word
+                if model_time is None and "`" in word and CODE_BLOCK_RE.search(sent):
+                    # The client hangs up here; later words only cost the mock
+                    model_time = time.monotonic() - start
+                if state.token_rate:
+                    time.sleep(1.0 / state.token_rate)
+            if framing == "sse":
+                self._chunk("data: [DONE]\n\n")
+            elif whole:
+                self._chunk(self._frame(framing, whole("")))
+            self._chunk("")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            state.waited(time.monotonic() - start if model_time is None else model_time)
+
+    @staticmethod
+    def _frame(framing, obj):
+        return f"data: {json.dumps(obj)}\n\n" if framing == "sse" else json.dumps(obj) + "\n"
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status, obj, headers=None):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+
+def start_server(port=PORT):
+    """Start the mock on a background thread; returns (server, state). Port 0 picks a free one."""
+    state = MockState()
+    handler = type("MockHandler", (Handler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    server, _ = start_server(port)
+    print(f"[INFO] Mock LLM listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the agent loop against bench/mock_llm.py.
+
+Every backend is driven through every task in bench/fixtures.json (or the
+backends a task lists, e.g. only rate-limited APIs get 429s), each
+run in a fresh child process with HOME and the working directory pointed
+at a scratch directory (so history, caches and traces start empty) and
+the backend's API URL pointed at the mock. Rate limits, the response cache
+and hedging are turned off so every run sends the same scripted requests.
+
+Per run it reports:
+
+  steps/s        agent steps per second of wall time
+  overhead ms    wall time per step minus the time spent waiting on the
+                 mock model and in rate-limit backoff: the loop, parsing,
+                 command execution, compaction and persistence
+  startup ms     imports and backend construction before the first step
+  peak RSS       of the child process
+  history        bytes written to history/session files and writes made
+
+Results are appended to bench/results.jsonl and each run is compared with
+the median of the previous HISTORY_RUNS runs of the same backend and task;
+the script exits 1 if overhead or peak RSS regressed.
+
+    python3 bench/run_bench.py [--backend NAME ...] [--fixture NAME ...] [--repeat N] [--no-save]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from mock_llm import start_server  # noqa: E402
+
+FIXTURES_FILE = os.path.join(BENCH_DIR, "fixtures.json")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.jsonl")
+REPEAT = 3                  # runs per backend and task; the median is reported
+HISTORY_RUNS = 5            # earlier results the current run is compared with
+REGRESSION_FACTOR = 1.5     # overhead this many times the baseline is a regression...
+REGRESSION_FLOOR_MS = 5.0   # ...if it is also at least this much slower per step
+RSS_FACTOR = 1.25           # peak RSS growth treated as a regression
+CHILD_TIMEOUT = 300         # seconds before a stuck run is killed
+
+# label -> (backend name in assistant.BACKENDS, mock settings)
+TARGETS = {
+    "openai": ("openai", {}),
+    "openrouter": ("openrouter", {}),
+    "ollama-chat": ("ollama-chat", {}),
+    "ollama-generate": ("ollama-generate", {}),
+    "ollama-generate/legacy": ("ollama-generate", {"chat_api": False}),
+    "duckai": ("duckai", {}),
+}
+
+# backend -> {module: {constant: value}}, "{base}" is the mock's URL
+ENDPOINTS = {
+    "openai": {"chatgpt": {"OPENAI_BASE_URL": "{base}/v1", "OPENAI_API_KEY": "mock"}},
+    "openrouter": {"openrouter": {"OPENROUTER_API_URL": "{base}/v1/chat/completions", "HEDGE_REQUESTS": False}},
+    "ollama-chat": {"ollama": {"OLLAMA_API_URL": "{base}/api/chat"}},
+    "ollama-generate": {"deepseek_shell": {"OLLAMA_API_URL": "{base}/api/chat",
+                                           "OLLAMA_GENERATE_URL": "{base}/api/generate"}},
+    "duckai": {"duckai": {"STATUS_URL": "{base}/duckchat/v1/status", "CHAT_URL": "{base}/duckchat/v1/chat"}},
+}
+HISTORY_FILES = (".shell_history", "session.json", "session_archive.jsonl", "notepad.txt")
+
+COLUMNS = [("steps/s", "steps_per_sec", "{:.1f}"), ("overhead ms", "overhead_ms", "{:.1f}"),
+           ("startup ms", "startup_ms", "{:.0f}"), ("peak RSS MB", "peak_rss_mb", "{:.1f}"),
+           ("history KB", "history_kb", "{:.1f}"), ("writes", "history_writes", "{:.0f}")]
+
+
+def load_fixtures(path=FIXTURES_FILE):
+    with open(path) as f:
+        fixtures = json.load(f)
+    for fixture in fixtures:
+        replies = []
+        for reply in fixture["replies"]:
+            if isinstance(reply, dict):
+                replies += [reply["reply"].replace("{n}", str(n)) for n in range(1, reply["times"] + 1)]
+            else:
+                replies.append(reply)
+        fixture["replies"] = replies
+    return fixtures
+
+
+# ─── CHILD ───────────────────────────────────────────────────────────────────
+def run_child(spec_json, out_path):
+    """One task on one backend, inside the scratch HOME set up by the parent."""
+    t0 = time.perf_counter()
+    spec = json.loads(spec_json)
+    import importlib
+    import rate_limiter
+    import response_cache
+    import tracing
+    from agent import run_task
+    from assistant import load_backend
+
+    base = f"http://127.0.0.1:{spec['port']}"
+    for module_name, constants in ENDPOINTS[spec["backend"]].items():
+        module = importlib.import_module(module_name)
+        for name, value in constants.items():
+            setattr(module, name, value.replace("{base}", base) if isinstance(value, str) else value)
+    for name in rate_limiter.RATE_LIMITS:
+        rate_limiter.RATE_LIMITS[name] = None
+    response_cache.BYPASS = True
+    tracing.enable(keep_spans=True)
+
+    result = {}
+    try:
+        backend = load_backend(spec["backend"])()
+        if spec["backend"] == "openai":
+            backend.client  # the openai package is optional; fail here rather than mid-task
+    except ImportError as e:
+        result["skipped"] = f"missing dependency: {e.name}"
+    else:
+        startup = time.perf_counter() - t0
+        start = time.perf_counter()
+        ok = run_task(backend, spec["task"])
+        store = getattr(backend, "history_store", None)
+        if store is not None:
+            store.flush()
+        spans = tracing._spans
+        result.update(
+            ok=ok,
+            wall=time.perf_counter() - start,
+            startup=startup,
+            steps=sum(1 for s in spans if s["name"] == "llm"),
+            backoff=sum(s["ms"] for s in spans if s["name"] == "backoff") / 1000,
+            history_writes=sum(1 for s in spans if s["name"] == "history_write"),
+            history_bytes=sum(os.path.getsize(os.path.join(root, f))
+                              for root, _, files in os.walk(".") for f in files
+                              if f.startswith(HISTORY_FILES)),
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+    with open(out_path, "w") as f:
+        json.dump(result, f)
+
+
+# ─── PARENT ──────────────────────────────────────────────────────────────────
+def run_one(label, fixture, server, state, verbose=False):
+    backend, mock = TARGETS[label]
+    state.reset(replies=fixture["replies"], **{**fixture.get("mock", {}), **mock})
+    scratch = tempfile.mkdtemp(prefix="bench-")
+    out_path = os.path.join(scratch, "result.json")
+    spec = {"backend": backend, "task": fixture["task"], "port": server.server_port}
+    env = dict(os.environ, HOME=scratch, PYTHONPATH=REPO_DIR)
+    env.pop("ASSISTANT_NO_CACHE", None)
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec), out_path],
+                       cwd=scratch, env=env, timeout=CHILD_TIMEOUT,
+                       stdout=None if verbose else subprocess.DEVNULL,
+                       stderr=None if verbose else subprocess.DEVNULL)
+        with open(out_path) as f:
+            result = json.load(f)
+    except (subprocess.TimeoutExpired, OSError, ValueError) as e:
+        return {"error": str(e) or type(e).__name__}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if "skipped" in result:
+        return result
+    mock_stats = state.stats()
+    steps = max(result["steps"], 1)
+    return {
+        "ok": result["ok"],
+        "steps": result["steps"],
+        "steps_per_sec": result["steps"] / result["wall"],
+        "overhead_ms": (result["wall"] - mock_stats["model_seconds"] - result["backoff"]) * 1000 / steps,
+        "model_ms": mock_stats["model_seconds"] * 1000 / steps,
+        "backoff_s": result["backoff"],
+        "rate_limited": mock_stats["rate_limited"],
+        "startup_ms": result["startup"] * 1000,
+        "peak_rss_mb": result["peak_rss_kb"] / 1024,
+        "history_kb": result["history_bytes"] / 1024,
+        "history_writes": result["history_writes"],
+    }
+
+
+def median_result(runs):
+    good = [r for r in runs if "error" not in r and "skipped" not in r]
+    if not good:
+        return runs[0]
+    merged = {k: statistics.median(r[k] for r in good) for k in good[0] if k != "ok"}
+    merged["ok"] = all(r["ok"] for r in good)
+    return merged
+
+
+def previous_results(path=RESULTS_FILE):
+    history = {}
+    if not os.path.exists(path):
+        return history
+    with open(path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            history.setdefault((row["target"], row["fixture"]), []).append(row)
+    return history
+
+
+def regressions(row, earlier):
+    """Regressions of row against the median of the earlier runs, as text."""
+    earlier = [r for r in earlier[-HISTORY_RUNS:] if "overhead_ms" in r]
+    if not earlier or "overhead_ms" not in row:
+        return []
+    found = []
+    overhead = statistics.median(r["overhead_ms"] for r in earlier)
+    if row["overhead_ms"] > overhead * REGRESSION_FACTOR and row["overhead_ms"] - overhead > REGRESSION_FLOOR_MS:
+        found.append(f"overhead {overhead:.1f} -> {row['overhead_ms']:.1f} ms/step")
+    rss = statistics.median(r["peak_rss_mb"] for r in earlier)
+    if row["peak_rss_mb"] > rss * RSS_FACTOR:
+        found.append(f"peak RSS {rss:.1f} -> {row['peak_rss_mb']:.1f} MB")
+    return found
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against a mock LLM server.")
+    parser.add_argument("--backend", action="append", choices=sorted(TARGETS), help="repeatable; default: all")
+    parser.add_argument("--fixture", action="append", help="repeatable; default: all")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--no-save", action="store_true", help="don't append to bench/results.jsonl")
+    parser.add_argument("--verbose", action="store_true", help="show the agent's own output")
+    args = parser.parse_args(argv)
+
+    fixtures = [f for f in load_fixtures() if not args.fixture or f["name"] in args.fixture]
+    server, state = start_server(0)
+    history = previous_results()
+    commit, stamp = git_commit(), time.time()
+    rows, failed = [], []
+
+    print(f"{'backend':<24}{'task':<18}" + "".join(f"{title:>13}" for title, _, _ in COLUMNS))
+    for label in args.backend or TARGETS:
+        for fixture in fixtures:
+            if "backends" in fixture and TARGETS[label][0] not in fixture["backends"]:
+                continue
+            result = median_result([run_one(label, fixture, server, state, args.verbose)
+                                    for _ in range(args.repeat)])
+            line = f"{label:<24}{fixture['name']:<18}"
+            if "skipped" in result or "error" in result:
+                print(line + f"  {result.get('skipped') or 'error: ' + result['error']}")
+                if "error" in result:
+                    failed.append(f"{label}/{fixture['name']}: {result['error']}")
+                continue
+            print(line + "".join(f"{fmt.format(result[key]):>13}" for _, key, fmt in COLUMNS)
+                  + ("" if result["ok"] else "  (task failed)"))
+            if not result["ok"]:
+                failed.append(f"{label}/{fixture['name']}: task did not complete")
+            row = {"ts": stamp, "commit": commit, "target": label, "fixture": fixture["name"], **result}
+            for problem in regressions(row, history.get((label, fixture["name"]), [])):
+                failed.append(f"{label}/{fixture['name']}: {problem}")
+            rows.append(row)
+    server.shutdown()
+
+    if rows and not args.no_save:
+        with open(RESULTS_FILE, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        print(f"\n[INFO] Results appended to {RESULTS_FILE}")
+    for problem in failed:
+        print(f"[WARN] {problem}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        sys.exit(main())
@@ -1,27 +1,20 @@
 #!/usr/bin/env python3
-import subprocess
 import sys
-import re
-import socket
-import os
-import json
-import time
-from colorama import init as colorama_init, Fore, Style
-from openai import OpenAI, OpenAIError, RateLimitError
+from colorama import Fore
+from agent import STREAM, ChatBackend
+from llm_stream import stream_reply
+from rate_limiter import MAX_BACKOFF, get_limiter
+from response_cache import cached_completion
 
-colorama_init(autoreset=True)
-
-HISTORY_FILE = os.path.expanduser("~/.shell_history.json")
 OPENAI_API_KEY = "[redacted]"
+OPENAI_BASE_URL = None  # None means api.openai.com (or $OPENAI_BASE_URL); point at any compatible server
 MODEL_NAME = "gpt-4o-mini"
 TEMPERATURE = 0.2
 MAX_TOKENS = 500
-MAX_HISTORY_LENGTH = 10
-MAX_RETRIES = 3
+CONTEXT_TOKEN_BUDGET = 8000  # prompt tokens sent per call (newest messages first)
+OUTPUT_TOKEN_BUDGET = 1500  # command output sent back to the model is compacted to this
 RETRY_DELAY = 60
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-
 system_prompt = (
     "You are a terminal assistant running inside a secure sandbox environment. "
     "You have full sudo privileges and are allowed to install packages. "
@@ -29,104 +22,86 @@ system_prompt = (
     "After executing, review output and propose next command. Stop when you state 'TASK COMPLETE'."
 )
 
-def load_history():
-    try:
-        history = json.load(open(HISTORY_FILE))
-    except:
-        history = []
-    # Ensure system prompt is first
-    if not history or history[0].get('role') != 'system':
-        history.insert(0, {"role": "system", "content": system_prompt})
-    return history
-
-chat_history = load_history()
+def create_completion(client, msgs, stream=False):
+    """(response headers, completion or stream); the headers carry the x-ratelimit-* quota."""
+    raw = client.chat.completions.with_raw_response.create(
+        model=MODEL_NAME,
+        messages=msgs,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+        timeout=RETRY_DELAY,
+        stream=stream
+    )
+    return raw.headers, raw.parse()
 
-def trim_history(history):
-    base = [history[0]]
-    return base + history[-MAX_HISTORY_LENGTH:]
+def stream_completion(stream):
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Closing the stream early cancels the rest of the generation
+        stream.close()
 
-def preprocess_cmd(cmd):
-    for host in set(re.findall(r"\b([A-Za-z0-9._-]+\.[A-Za-z]{2,})\b", cmd)):
-        try:
-            ip = socket.gethostbyname(host)
-            cmd = cmd.replace(host, ip)
-        except:
-            pass
-    return cmd
+class ChatGPTBackend(ChatBackend):
+    name = "openai"
+    stream = STREAM
+    output_token_budget = OUTPUT_TOKEN_BUDGET
 
-def execute_command_stream(cmd):
-    # Add -c 4 to ping commands if not present to prevent indefinite execution
-    if cmd.startswith('ping ') and '-c' not in cmd and '-n' not in cmd:
-        cmd += ' -c 4'
-    cmd = preprocess_cmd(cmd)
-    print(Fore.GREEN + f"💻 Executing Command: {cmd}\n")
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    lines = []
-    for line in proc.stdout:
-        print(Fore.WHITE + line, end='')
-        lines.append(line)
-    proc.wait()
-    return ''.join(lines).strip()
+    def __init__(self):
+        self.open_history(system_prompt, CONTEXT_TOKEN_BUDGET)
+        self._client = None
 
-def save_history(history):
-    try:
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(history, f, indent=2)
-    except Exception as e:
-        print(Fore.RED + f"[ERROR] Failed to save history: {e}")
+    @property
+    def client(self):
+        # openai is only imported once the first request is made
+        if self._client is None:
+            from openai import OpenAI
+            # Retries and 429 backoff are handled by rate_limiter, not by the SDK
+            self._client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+        return self._client
 
-def chat_with_llm(message):
-    chat_history.append({"role": "user", "content": message})
-    save_history(chat_history)
-    msgs = trim_history(chat_history)
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            resp = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=msgs,
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS,
-                timeout=RETRY_DELAY
-            )
-            reply = resp.choices[0].message.content.strip()
-            chat_history.append({"role": "assistant", "content": reply})
-            save_history(chat_history)
-            return reply
-        except RateLimitError as e:
-            err_msg = getattr(e, "args", [None])[0]
-            print(Fore.RED + f"[ERROR] Rate limit exceeded: {err_msg}")
-            print(Fore.RED + "Exiting script due to rate limit. Please wait and try again later.")
-            sys.exit(1)
-        except OpenAIError as e:
-            print(Fore.RED + f"[ERROR] OpenAI API error: {e}")
-            break
-        except Exception as e:
-            print(Fore.RED + f"[ERROR] Unexpected: {e}")
-            break
-    print(Fore.CYAN + "[INFO] All retries failed. TASK COMPLETE.")
-    return "TASK COMPLETE"
+    def chat(self, message, on_token=None):
+        self.chat_history.append({"role": "user", "content": message})
+        self.save_history(self.chat_history[-1])
+        msgs = self.window()
+        reply, error = cached_completion(self.name, MODEL_NAME, TEMPERATURE, msgs,
+                                         lambda: self._complete(msgs, on_token), on_token)
+        if error:
+            return None, error
+        self.chat_history.append({"role": "assistant", "content": reply})
+        self.save_history(self.chat_history[-1])
+        return reply, None
 
-def extract_command(text):
-    m = re.search(r"```bash\s*(.*?)\s*```", text, re.DOTALL)
-    block = m.group(1) if m else text
-    parts = [l.strip().lstrip('$').strip() for l in block.splitlines() if l.strip()]
-    return ' && '.join(parts)
+    def _complete(self, msgs, on_token):
+        from openai import OpenAIError, RateLimitError
+        limiter = get_limiter(self.name, MODEL_NAME)
+        # Only 429s loop; the limiter gives up once MAX_BACKOFF seconds of backoff have gone by
+        while True:
+            limiter.acquire()
+            try:
+                headers, resp = create_completion(self.client, msgs, stream=STREAM)
+                if STREAM:
+                    reply, _ = stream_reply(stream_completion(resp), on_token)
+                    limiter.succeeded(headers)
+                    return reply.strip(), None
+                limiter.succeeded(headers)
+                return resp.choices[0].message.content.strip(), None
+            except RateLimitError as e:
+                # Wait (Retry-After or jittered backoff) and try again
+                delay = limiter.rate_limited(getattr(getattr(e, "response", None), "headers", None))
+                if delay is None:
+                    err_msg = getattr(e, "args", [None])[0]
+                    return None, f"Rate limit exceeded: {err_msg}. Still limited after {MAX_BACKOFF:.0f}s of backoff."
+                print(Fore.YELLOW + f"[WARN] Rate limited. Retrying in {delay:.1f}s...")
+            except OpenAIError as e:
+                print(Fore.RED + f"[ERROR] OpenAI API error: {e}")
+                break
+            except Exception as e:
+                print(Fore.RED + f"[ERROR] Unexpected: {e}")
+                break
+        return None, "All retries failed."
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(Fore.RED + "Usage: python3 Ai.py \"task description\"")
-        sys.exit(1)
-    task = " ".join(sys.argv[1:])
-    print(Fore.BLUE + f"🎯 Task: {task}\n")
-    user_msg = task
-    while True:
-        llm = chat_with_llm(user_msg + "\nProvide next bash command in a code block.")
-        print(Fore.MAGENTA + "🧠 LLM Response:\n" + llm + "\n")
-        cmd = extract_command(llm)
-        out = execute_command_stream(cmd)
-        user_msg = f"Command: {cmd}\nOutput:\n{out}"
-        follow = chat_with_llm(user_msg + "\nProvide next bash command or 'TASK COMPLETE'.")
-        print(Fore.MAGENTA + "🤖 Follow-Up:\n" + follow + "\n")
-        if re.search(r"TASK COMPLETE", follow, re.IGNORECASE):
-            print(Fore.GREEN + "✅ Task complete.")
-            break
+    from assistant import main
+    sys.exit(main(["openai"] + sys.argv[1:]))
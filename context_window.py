@@ -0,0 +1,107 @@
+"""
+Token-aware context window for the chat backends.
+
+Each message's token estimate is computed once, when it is appended, and
+kept in a running prefix sum. The window is the longest run of newest
+messages whose total fits the model's budget (after the system prompt), so
+appending a message only moves the window start forward: O(1) amortized per
+turn, with no re-tokenizing of the whole transcript.
+
+With a `recall` function (history_index.history_recall) the newest user
+message is sent with the most relevant turns from earlier sessions in
+front of it (closed by RECALL_END). Their tokens come out of the same budget, capped at
+RECALL_SHARE of it, so the window shrinks by that much instead of growing.
+"""
+from bisect import bisect_left
+
+from output_compactor import estimate_tokens
+
+DEFAULT_TOKEN_BUDGET = 4000
+MESSAGE_OVERHEAD = 4  # role/separator tokens each chat message costs
+RECALL_SHARE = 0.2    # at most this share of the budget goes to recalled turns
+TASK_PREFIX = "Task: "                      # starts the first user turn of every task
+RECALL_END = "[end of recalled context]\n\n"  # closes text recalled in front of a user turn
+
+
+def message_tokens(msg):
+    return estimate_tokens(msg.get("content") or "") + MESSAGE_OVERHEAD
+
+
+def with_recall(recalled, content):
+    """content with recalled text (past turns, notes) in front of it, if there is any."""
+    return recalled + RECALL_END + content if recalled else content
+
+
+def strip_recall(content):
+    """Undo with_recall()."""
+    _, sep, rest = content.partition(RECALL_END)
+    return rest if sep else content
+
+
+class ContextWindow:
+    def __init__(self, system_prompt, budget=DEFAULT_TOKEN_BUDGET, messages=(), recall=None):
+        self.system = {"role": "system", "content": system_prompt}
+        self.system_tokens = message_tokens(self.system)
+        self.budget = budget
+        self._messages = []
+        self._prefix = [0]  # _prefix[i] = tokens in _messages[:i]
+        self._start = 0
+        self.recall = recall  # recall(query, seen, budget) -> text, or None
+        self._recalled = (None, "")  # (message count, text) of the last recall
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg):
+        self._messages.append(msg)
+        self._prefix.append(self._prefix[-1] + message_tokens(msg))
+        limit = self.budget - self.system_tokens
+        end = len(self._messages)
+        # Always keep the newest message, even if it alone is over budget
+        while self._start < end - 1 and self._prefix[end] - self._prefix[self._start] > limit:
+            self._start += 1
+
+    def set_budget(self, budget):
+        """Switch to another model's budget; the window may grow back as well as shrink."""
+        self.budget = budget
+        if not self._messages:
+            return
+        limit = self.budget - self.system_tokens
+        start = bisect_left(self._prefix, self._prefix[-1] - limit)
+        self._start = min(start, len(self._messages) - 1)
+
+    def messages(self):
+        """System prompt plus the newest messages that fit the budget."""
+        extra = self._recall()
+        if not extra:
+            return [self.system] + self._messages[self._start:]
+        limit = self.budget - self.system_tokens - estimate_tokens(extra)
+        start = max(self._start, bisect_left(self._prefix, self._prefix[-1] - limit))
+        window = self._messages[min(start, len(self._messages) - 1):]
+        window[-1] = {**window[-1], "content": with_recall(extra, window[-1]["content"])}
+        return [self.system] + window
+
+    @property
+    def window_tokens(self):
+        return self.system_tokens + self._prefix[-1] - self._prefix[self._start]
+
+    def _recall(self):
+        # Once per new message; openrouter asks for several windows per step
+        if self.recall is None or not self._messages or self._messages[-1].get("role") != "user":
+            return ""
+        count = len(self._messages)
+        if self._recalled[0] != count:
+            last = self._messages[-1]
+            seen = [m.get("content") or "" for m in self._messages[self._start:] if m.get("role") == "user"]
+            budget = int(self.budget * RECALL_SHARE)
+            self._recalled = (count, self.recall(last.get("content") or "", seen, budget))
+        return self._recalled[1]
+
+    # List-like access so the loops can keep using history[-1] etc.
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
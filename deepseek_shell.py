@@ -1,25 +1,35 @@
 #!/usr/bin/env python3
-import subprocess
-import requests
+import http_transport
 import sys
 import re
 import os
 import json
-from bs4 import BeautifulSoup
-from duckduckgo_search import DDGS
+import sqlite3
+from agent import BaseBackend
+from context_window import TASK_PREFIX, with_recall
+from llm_stream import iter_ndjson, stream_reply
+from notes_store import NotesStore
+from output_compactor import compact_output
+from research_cache import local_tool_page, lookup_many, normalize_query
+from response_cache import cached_completion
+from session_memory import SESSION_TOKEN_LIMIT, SessionFacts, compact_session
 
 # ─── CONFIG ─────────────────────────────────────────────────────────────────
 OLLAMA_MODEL    = "deepseek-coder-v2:latest"
-OLLAMA_API_URL  = "http://localhost:11434/api/generate"
+OLLAMA_API_URL  = "http://localhost:11434/api/chat"
+OLLAMA_GENERATE_URL = "http://localhost:11434/api/generate"  # fallback for Ollama builds without /api/chat
+KEEP_ALIVE      = "30m"  # keep the model, and the KV cache of the conversation so far, loaded between turns
+NUM_CTX         = 8192   # large enough that Ollama never truncates the front of the prompt (which breaks the prefix)
+TEMPERATURE     = 0.3    # above response_cache.MAX_TEMPERATURE, so replies are not cached
 NOTES_FILE      = 'notepad.txt'
+NOTES_DB        = 'notes.sqlite3'  # indexed copy of the notes; the relevant ones are fed back each turn
 SESSION_FILE    = 'session.json'
-MAX_EMPTY_RETRIES = 3
+SESSION_ARCHIVE = 'session_archive.jsonl'  # raw turns folded out of the session summary
+OUTPUT_TOKEN_BUDGET = 1000  # command output sent back to the model is compacted to this
+STREAM          = True   # print tokens live and stop generating once the bash block closes
+STEP_PROMPT     = "\nProvide the next bash command in a markdown code block labeled 'bash'."
 
-# Ensure notes file exists
-if not os.path.exists(NOTES_FILE):
-    open(NOTES_FILE, 'w').close()
-
-# ─── SYSTEM PROMPT & CHAT HISTORY ─────────────────────────────────────────────
+# ─── SYSTEM PROMPT ───────────────────────────────────────────────────────────
 system_prompt = (
     "You are a terminal assistant running inside a secure sandbox environment. "
     "You have sudo privileges and full session memory. "
@@ -31,203 +41,233 @@ system_prompt = (
     "4. Then propose the next tool or command to use in the same strict format.\n"
     "5. Repeat until you confirm a specific vulnerability. Only then respond with 'TASK COMPLETE' in a bash code block.\n"
     "6. If you need tool documentation, respond with TOOL_PAGE: <toolname>.\n"
-    "7. If you need general info, use WEB_SEARCH: <query>.\n"
+    "7. If you need general info, use WEB_SEARCH: <query>. Several TOOL_PAGE:/WEB_SEARCH: lines may be sent in one reply.\n"
     "8. Do not include any plain text commands outside the code block or any extra markdown."
 )
 
-# If session.json exists, load it; otherwise, start fresh with only the system prompt
-if os.path.exists(SESSION_FILE):
-    with open(SESSION_FILE, 'r') as f:
-        data = json.load(f)
-        chat_history = data.get('chat_history',
-                                [{"role": "system", "content": system_prompt}])
-else:
-    chat_history = [{"role": "system", "content": system_prompt}]
-
-# ─── COMMAND EXECUTION ───────────────────────────────────────────────────────
-def execute_command_stream(cmd: str, timeout: int = None) -> str:
-    print(f"💻 Executing Command (live output): {cmd}\n")
-    proc = subprocess.Popen(cmd, shell=True,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT,
-                            text=True)
-    output_lines = []
-    try:
-        for line in proc.stdout:
-            print(line, end='')
-            output_lines.append(line)
-        proc.wait(timeout=timeout)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        output_lines.append("\nCommand timed out.\n")
-    return ''.join(output_lines).strip()
-
-# ─── LLM INTERACTION ─────────────────────────────────────────────────────────
-def chat_with_llm(message: str) -> str:
-    chat_history.append({"role": "user", "content": message})
-    prompt = "".join(f"{m['role']}: {m['content']}\n" for m in chat_history)
-    resp = requests.post(
-        OLLAMA_API_URL,
-        json={"model": OLLAMA_MODEL,
-              "prompt": prompt,
-              "stream": False,
-              "temperature": 0.3},
-        timeout=120
-    )
-    data = resp.json()
-    text = data.get("response") or data.get("choices", [{}])[0].get("text", "")
-    reply = text.strip()
-    chat_history.append({"role": "assistant", "content": reply})
-    return reply
+COMMAND_FAILURE_PATTERNS = [r"command not found", r"not found"]
 
 # ─── HELPERS ─────────────────────────────────────────────────────────────────
-def extract_command(text: str) -> str:
-    """
-    Pull out exactly one bash command from the LLM's reply,
-    expecting it to be in a ```bash ... ``` code block.
-    """
-    m = re.search(r"```bash\s*(.*?)\s*```", text, re.DOTALL)
-    block = m.group(1) if m else text
-    lines = []
-    for line in block.splitlines():
-        stripped = line.strip().lstrip('$').strip()
-        # Skip empty lines, comments, or NOTE: lines
-        if not stripped or stripped.startswith('#') or stripped.upper().startswith('NOTE:'):
-            continue
-        lines.append(stripped)
-    # Join multiple lines into a single command chain with &&
-    return ' && '.join(lines)
-
-def parse_and_store_notes(text: str):
+def parse_and_store_notes(text: str, store=None):
     """
-    Look for lines in LLM output that begin with NOTE:
-    append those lines to NOTES_FILE.
+    Collect the NOTE: lines of one LLM reply, index the new ones in `store`
+    (near-duplicates of earlier notes are dropped) and append those to
+    NOTES_FILE in one write.
     """
-    for line in text.splitlines():
-        if line.strip().upper().startswith('NOTE:'):
-            with open(NOTES_FILE, 'a') as f:
-                f.write(line.strip() + '\n')
+    notes = [line.strip() for line in text.splitlines() if line.strip().upper().startswith('NOTE:')]
+    if not notes:
+        return
+    if store is not None:
+        notes = ["NOTE: " + note for note in store.add_many(notes)]
+    if notes:
+        with open(NOTES_FILE, 'a') as f:
+            f.write("\n".join(notes) + "\n")
 
-def fetch_kali_tool_page(toolname: str) -> str:
+def recall_notes(store, message, history):
+    """The notes relevant to `message` that the model can't already see, as a preamble."""
+    if store is None:
+        return ""
+    seen = "\n".join(m["content"] for m in history)
+    notes = store.relevant(message, seen=seen)
+    if not notes:
+        return ""
+    return "Relevant notes from earlier:\n" + "\n".join(f"- {note}" for note in notes) + "\n"
+
+def parse_kali_tool_page(html: str, toolname: str, url: str) -> str:
     """
-    Fetch the Kali Tools webpage for <toolname> and return
-    its H1 title + a short snippet of the description.
+    Return the page's H1 title + a short snippet of the description.
     """
-    url = f"https://www.kali.org/tools/{toolname}"
-    print(f"🌐 Fetching Kali tool page: {url}")
-    resp = requests.get(url, timeout=10)
-    if resp.status_code != 200:
-        return f"Could not fetch tool info for {toolname} (status {resp.status_code})"
-    soup = BeautifulSoup(resp.text, "html.parser")
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
     title = soup.find("h1").get_text(strip=True) if soup.find("h1") else toolname
     # Grab only the first 500 characters of the main description
     desc_div = soup.find("div", class_="post-content")
     desc = desc_div.get_text(strip=True)[:500] if desc_div else ""
     return f"{title} — {desc}\nMore: {url}"
 
-def fetch_web_results(query: str) -> str:
+def download_kali_tool_page(toolname: str) -> str:
+    """
+    Read <toolname>'s Kali Tools page from TOOL_PAGES_DIR if it is there,
+    otherwise fetch it from kali.org; raises if neither works.
+    """
+    url = f"https://www.kali.org/tools/{toolname}"
+    local = local_tool_page(toolname)
+    if local:
+        path, text = local
+        return text.strip() if path.endswith(".txt") else parse_kali_tool_page(text, toolname, url)
+    print(f"🌐 Fetching Kali tool page: {url}")
+    resp = http_transport.get(url, timeout=10)
+    if resp.status_code != 200:
+        raise RuntimeError(f"could not fetch tool info for {toolname} (status {resp.status_code})")
+    return parse_kali_tool_page(resp.text, toolname, url)
+
+def search_web(query: str) -> str:
     """
     Use duckduckgo-search (pip install duckduckgo-search) to fetch
     top 5 result titles+URLs for <query>.
     """
+    from duckduckgo_search import DDGS
     results = []
     with DDGS() as ddgs:
         for r in ddgs.text(query, max_results=5):
             title = r.get('title')
             href = r.get('href')
             results.append(f"- {title} ({href})")
-    return "\n".join(results) if results else "No results found."
+    # Empty when nothing was found; research_cache doesn't store that
+    return "\n".join(results)
+
+def research_requests(reply: str) -> list:
+    """
+    Every TOOL_PAGE: / WEB_SEARCH: directive in the reply as
+    (heading, kind, key, fetch), duplicates dropped.
+    """
+    requests, seen = [], set()
+    for toolname in re.findall(r"TOOL_PAGE:\s*([\w.+-]+)", reply):
+        key = ("tool_page", toolname.lower())
+        if key not in seen:
+            seen.add(key)
+            requests.append((f"Tool info for {toolname}", *key,
+                             lambda t=toolname.lower(): download_kali_tool_page(t)))
+    for query in re.findall(r"WEB_SEARCH:\s*(.+)", reply):
+        query = query.strip()
+        key = ("web_search", normalize_query(query))
+        if query and key not in seen:
+            seen.add(key)
+            requests.append((f"Web results for '{query}'", *key, lambda q=query: search_web(q)))
+    return requests
 
 # ─── SESSION SAVE/LOAD ───────────────────────────────────────────────────────
-def save_session():
+def load_session() -> tuple:
     """
-    Write the current chat_history to SESSION_FILE in JSON format.
+    If SESSION_FILE exists, load its chat_history and summary facts;
+    otherwise start fresh with only the system prompt.
+    """
+    if os.path.exists(SESSION_FILE):
+        with open(SESSION_FILE, 'r') as f:
+            data = json.load(f)
+            return (data.get('chat_history',
+                             [{"role": "system", "content": system_prompt}]),
+                    SessionFacts(data.get('facts')))
+    return [{"role": "system", "content": system_prompt}], SessionFacts()
+
+def save_session(chat_history: list, facts: SessionFacts):
+    """
+    Write the current chat_history and summary facts to SESSION_FILE in JSON format.
     """
     with open(SESSION_FILE, 'w') as f:
-        json.dump({"chat_history": chat_history}, f, indent=2)
+        json.dump({"chat_history": chat_history, "facts": facts.to_dict()}, f, indent=2)
 
-# ─── MAIN WORKFLOW ────────────────────────────────────────────────────────────
-COMMAND_FAILURE_PATTERNS = [r"command not found", r"not found"]
+# ─── BACKEND ─────────────────────────────────────────────────────────────────
+class OllamaGenerateBackend(BaseBackend):
+    name = "ollama-generate"
+    stream = STREAM
+    output_token_budget = OUTPUT_TOKEN_BUDGET
+    rewrite_hosts = False  # targets are scanned exactly as the model names them
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 deepseek_shell.py \"task description\"")
-        sys.exit(1)
-    task = " ".join(sys.argv[1:])
-    print(f"🎯 Task: {task}\n")
-    user_msg = f"Task: {task}"
-    empty_retries = 0
-
-    try:
-        while True:
-            # Ask the LLM for the next command (or for special triggers like TOOL_PAGE / WEB_SEARCH)
-            llm_out = chat_with_llm(
-                user_msg
-                + "\nProvide the next bash command in a markdown code block labeled 'bash'."
-            )
-            print("🧠 LLM Response:\n", llm_out, "\n")
-
-            # 1) Check if LLM wants a Kali tool page
-            tool_match = re.search(r"TOOL_PAGE:\s*(\w+)", llm_out)
-            if tool_match:
-                toolname = tool_match.group(1)
-                info = fetch_kali_tool_page(toolname)
-                user_msg = f"Tool info for {toolname}:\n{info}"
-                continue
-
-            # 2) Check if LLM wants a DuckDuckGo search
-            web_match = re.search(r"WEB_SEARCH:\s*(.+)", llm_out)
-            if web_match:
-                query = web_match.group(1)
-                info = fetch_web_results(query)
-                user_msg = f"Web results for '{query}':\n{info}"
-                continue
-
-            # 3) Store any NOTE: lines to NOTES_FILE
-            parse_and_store_notes(llm_out)
-
-            # 4) Extract the bash command from the LLM reply
-            cmd = extract_command(llm_out)
-            if not cmd:
-                empty_retries += 1
-                if empty_retries >= MAX_EMPTY_RETRIES:
-                    user_msg = (
-                        "ERROR: You must output exactly one bash command inside a 'bash' "
-                        "code block with no placeholders."
-                    )
-                    empty_retries = 0
-                    continue
-                else:
-                    # Let LLM try again
-                    continue
-
-            # Reset retry counter if a valid command was extracted
-            empty_retries = 0
-
-            # 5) Execute the command and print live output
-            output = execute_command_stream(cmd)
-            print(f"\n📤 Collected Output:\n{output}\n")
-
-            # 6) If it fails, ask LLM for an alternative
-            if any(re.search(pat, output, re.IGNORECASE) for pat in COMMAND_FAILURE_PATTERNS):
-                user_msg = (
-                    f"WARNING: The last command failed with error:\n{output}\n"
-                    "Propose an alternative valid command without placeholders in a bash code block."
+    def __init__(self):
+        # Ensure notes file exists
+        if not os.path.exists(NOTES_FILE):
+            open(NOTES_FILE, 'w').close()
+        self.chat_history, self.facts = load_session()
+        self.use_chat_api = True
+        try:
+            self.notes = NotesStore(NOTES_DB)
+        except sqlite3.Error as e:
+            print(f"[WARN] Notes index unavailable ({e}); notes only go to {NOTES_FILE}")
+            self.notes = None
+
+    def first_message(self, task):
+        return TASK_PREFIX + task
+
+    def chat(self, message: str, on_token=None):
+        # Earlier findings ride on the new turn, so the cached conversation prefix stays untouched
+        recalled = recall_notes(self.notes, message, self.chat_history)
+        self.chat_history.append({"role": "user", "content": with_recall(recalled, message + STEP_PROMPT)})
+        # Past SESSION_TOKEN_LIMIT, older turns move to SESSION_ARCHIVE and into the facts summary
+        self.chat_history = compact_session(self.chat_history, self.facts, SESSION_ARCHIVE, SESSION_TOKEN_LIMIT)
+        msgs = list(self.chat_history)
+        reply, error = cached_completion(self.name, OLLAMA_MODEL, TEMPERATURE, msgs,
+                                         lambda: self._generate(msgs, on_token), on_token)
+        if error:
+            return None, error
+        self.chat_history.append({"role": "assistant", "content": reply})
+        return reply, None
+
+    def _generate(self, messages, on_token):
+        """
+        Send the conversation to /api/chat. History only ever grows at the end,
+        so every request shares its prefix with the previous one and Ollama
+        only prefills the new turn; after a model reload the first turn simply
+        prefills everything again. Falls back to the old single-prompt
+        /api/generate call on Ollama builds that lack /api/chat.
+        """
+        options = {"temperature": TEMPERATURE, "num_ctx": NUM_CTX}
+        try:
+            if self.use_chat_api:
+                resp = http_transport.post(
+                    OLLAMA_API_URL,
+                    json={"model": OLLAMA_MODEL,
+                          "messages": messages,
+                          "stream": STREAM,
+                          "keep_alive": KEEP_ALIVE,
+                          "options": options},
+                    timeout=120,
+                    stream=STREAM
                 )
-                continue
+                if resp.status_code == 404 and "model" not in resp.text.lower():
+                    print(f"[WARN] {OLLAMA_API_URL} not available, falling back to /api/generate")
+                    self.use_chat_api = False
+                    return self._generate(messages, on_token)
+                extract = lambda d: d.get("message", {}).get("content", "")
+            else:
+                prompt = "".join(f"{m['role']}: {m['content']}\n" for m in messages)
+                resp = http_transport.post(
+                    OLLAMA_GENERATE_URL,
+                    json={"model": OLLAMA_MODEL,
+                          "prompt": prompt,
+                          "stream": STREAM,
+                          "keep_alive": KEEP_ALIVE,
+                          "options": options},
+                    timeout=120,
+                    stream=STREAM
+                )
+                extract = lambda d: d.get("response", "")
+            if resp.status_code != 200:
+                return None, f"Ollama request failed: HTTP {resp.status_code}: {resp.text}"
+            if STREAM:
+                # Stop reading (and let Ollama abort) once the bash block is closed
+                text, _ = stream_reply(iter_ndjson(resp, extract), on_token)
+            else:
+                text = extract(resp.json())
+        except Exception as e:
+            return None, f"Ollama request failed: {e}"
+        return text.strip(), None
+
+    def handle_reply(self, reply):
+        # 1) Kali tool pages and DuckDuckGo searches, all of them at once
+        requests = research_requests(reply)
+        if requests:
+            results = lookup_many([(kind, key, fetch) for _, kind, key, fetch in requests])
+            return "\n\n".join(f"{heading}:\n{text}" for (heading, _, _, _), text in zip(requests, results))
 
-            # 7) If the LLM said TASK COMPLETE, we exit
-            if re.search(r"TASK COMPLETE", llm_out, re.IGNORECASE):
-                print(f"✅ Task complete. Check {NOTES_FILE} for notes. Exiting.")
-                break
+        # 2) Store any NOTE: lines to NOTES_FILE
+        parse_and_store_notes(reply, self.notes)
+        return None
 
-            # 8) Otherwise, give the next context (command + output) back to the LLM
-            user_msg = f"Command: {cmd}\nOutput:\n{output}"
+    def review_output(self, cmd, output):
+        model_output = compact_output(output, self.output_token_budget)
+        # If it fails, ask LLM for an alternative
+        if any(re.search(pat, output, re.IGNORECASE) for pat in COMMAND_FAILURE_PATTERNS):
+            return (
+                f"WARNING: The last command failed with error:\n{model_output}\n"
+                "Propose an alternative valid command without placeholders in a bash code block."
+            )
+        return f"Command: {cmd}\nOutput:\n{model_output}"
 
-    except KeyboardInterrupt:
-        print("\nInterrupted by user. Saving session and exiting.")
-    finally:
-        save_session()
+    def close(self):
+        print(f"Saving session to {SESSION_FILE}. Check {NOTES_FILE} for notes.")
+        save_session(self.chat_history, self.facts)
 
 if __name__ == "__main__":
-    main()
+    from assistant import main
+    sys.exit(main(["ollama-generate"] + sys.argv[1:]))
@@ -0,0 +1,172 @@
+"""
+Concurrent, cached hostname resolution for preprocess_cmd.
+
+All hostname-looking tokens in a command are looked up at the same time,
+each on its own daemon thread, and we wait at most DNS_TIMEOUT seconds for
+the whole batch. Answers are cached for the session (POSITIVE_TTL), and so
+are failures and timeouts (NEGATIVE_TTL), so a name that does not resolve
+only costs us once. Tokens that are obviously local files (nginx.conf,
+./config.yaml, /etc/hosts.allow, anything that exists on disk) are never
+looked up. Names whose last label is both a file extension and a real TLD
+(install.sh, example.pl) are only taken for files where a file goes: after
+a redirect or '=', or as an argument of bash, python, cat, chmod and the
+like; `ping example.pl` is still resolved.
+"""
+import os
+import re
+import socket
+import threading
+import time
+
+DNS_TIMEOUT = 1.5       # seconds for the whole batch of lookups
+POSITIVE_TTL = 300      # seconds a resolved address is reused
+NEGATIVE_TTL = 60       # seconds a failed/timed-out lookup is remembered
+
+HOST_RE = re.compile(r"\b([A-Za-z0-9._-]+\.[A-Za-z]{2,})\b")
+
+# Last labels that are file extensions and not TLDs
+FILE_EXTENSIONS = {
+    "conf", "cfg", "ini", "yaml", "yml", "json", "toml", "xml", "txt", "log",
+    "bash", "js", "ts", "rb", "php", "go", "java",
+    "html", "htm", "css", "csv", "sql", "db", "sqlite", "bak", "old", "tmp", "lock",
+    "tar", "gz", "tgz", "bz2", "xz", "deb", "rpm", "iso", "img", "service",
+    "socket", "timer", "list", "key", "pem", "crt", "csr", "out", "pid",
+}
+# Extensions that are also TLDs (Moldova, Poland, Serbia, ...): files only in a file position
+AMBIGUOUS_EXTENSIONS = {"md", "pl", "pub", "py", "rs", "sh", "so", "zip"}
+# Commands whose arguments are files
+FILE_COMMANDS = {
+    "bash", "sh", "zsh", "source", ".", "python", "python3", "perl", "ruby", "node", "cat", "less", "more",
+    "head", "tail", "vi", "vim", "nano", "chmod", "chown", "cp", "mv", "rm", "touch", "ln", "ls", "stat",
+    "file", "wc", "grep", "sed", "awk", "diff", "tar", "zip", "unzip", "gzip", "git", "cargo", "rustc", "gcc",
+    "ldd", "nm", "strings", "install",
+}
+WRAPPERS = {"sudo", "env", "time", "nohup", "exec", "xargs"}
+
+
+def parse_hosts_file(path):
+    """Read an /etc/hosts style file into {hostname: ip}."""
+    mapping = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                for name in fields[1:]:
+                    mapping.setdefault(name.lower(), fields[0])
+    except OSError:
+        pass
+    return mapping
+
+
+def in_file_position(cmd, start):
+    """True if a token starting at `start` is a redirect target, an option value or a file command's argument."""
+    head = re.split(r"[;&|(]", cmd[:start])[-1]
+    if re.search(r"[<>=]\s*$", head):
+        return True
+    words = [w for w in head.split() if not w.startswith("-")]
+    while words and words[0] in WRAPPERS:
+        words.pop(0)
+    # No command before it: the token is the command (a script) itself
+    return not words or os.path.basename(words[0]) in FILE_COMMANDS
+
+
+def looks_local(cmd, match):
+    """True if the token at `match` is a path or filename rather than a hostname."""
+    token = match.group(1)
+    before = cmd[match.start() - 1] if match.start() > 0 else ""
+    if cmd.endswith("://", 0, match.start()) or before == "@":
+        # http://example.com/..., user@example.com
+        return False
+    if before in ("/", "~", "."):
+        # /etc/nginx/nginx.conf, ~/notes.txt, ./config.yaml
+        return True
+    extension = token.rsplit(".", 1)[-1].lower()
+    if extension in FILE_EXTENSIONS or os.path.exists(token):
+        return True
+    return extension in AMBIGUOUS_EXTENSIONS and in_file_position(cmd, match.start())
+
+
+class Resolver:
+    def __init__(self, lookup=socket.gethostbyname, timeout=DNS_TIMEOUT,
+                 ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL, hosts_file=None):
+        self.lookup = lookup
+        self.timeout = timeout
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.static = parse_hosts_file(hosts_file) if hosts_file else {}
+        self._cache = {}  # host -> (ip or None, expires_at)
+        self._lock = threading.Lock()
+
+    def _cached(self, host, now):
+        entry = self._cache.get(host)
+        if entry and entry[1] > now:
+            return True, entry[0]
+        return False, None
+
+    def _store(self, host, ip):
+        ttl = self.ttl if ip else self.negative_ttl
+        with self._lock:
+            self._cache[host] = (ip, time.monotonic() + ttl)
+
+    def resolve_many(self, hosts):
+        """Return {host: ip or None}, resolving uncached hosts concurrently."""
+        now = time.monotonic()
+        results, pending = {}, []
+        for host in set(hosts):
+            key = host.lower()
+            if key in self.static:
+                results[host] = self.static[key]
+                continue
+            hit, ip = self._cached(key, now)
+            if hit:
+                results[host] = ip
+            else:
+                pending.append(host)
+
+        answers = {}
+
+        def worker(host):
+            try:
+                answers[host] = self.lookup(host)
+            except (OSError, UnicodeError):
+                answers[host] = None
+
+        threads = [threading.Thread(target=worker, args=(h,), daemon=True) for h in pending]
+        for t in threads:
+            t.start()
+        deadline = time.monotonic() + self.timeout
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+        for host in pending:
+            # Anything still running missed the deadline and counts as a miss
+            ip = answers.get(host)
+            self._store(host.lower(), ip)
+            results[host] = ip
+        return results
+
+    def rewrite(self, cmd):
+        """Replace every resolvable hostname token in cmd with its address."""
+        matches = [m for m in HOST_RE.finditer(cmd) if not looks_local(cmd, m)]
+        if not matches:
+            return cmd
+        resolved = self.resolve_many(m.group(1) for m in matches)
+        wanted = {m.start() for m in matches}
+
+        def swap(m):
+            if m.start() in wanted and resolved.get(m.group(1)):
+                return resolved[m.group(1)]
+            return m.group(0)
+
+        return HOST_RE.sub(swap, cmd)
+
+
+_default_resolver = None
+
+
+def rewrite_hostnames(cmd):
+    """Session-wide entry point used by preprocess_cmd."""
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = Resolver()
+    return _default_resolver.rewrite(cmd)
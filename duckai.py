@@ -1,22 +1,21 @@
 #!/usr/bin/env python3
 #code will probably not work.
 #still early beta
-import subprocess
 import sys
-import re
-import socket
-import os
-import json
-import time
-from colorama import init as colorama_init, Fore, Style
-
-colorama_init(autoreset=True)
-
-HISTORY_FILE = os.path.expanduser("~/.shell_history.json")
-MODEL_ID = 1  # default GPT-4o-mini on Duck.ai
-MAX_HISTORY_LENGTH = 10
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+from colorama import Fore
+from agent import STREAM, ChatBackend
+import http_transport
+from llm_stream import StreamError, iter_sse, stream_reply
+from rate_limiter import MAX_BACKOFF, get_limiter
+from response_cache import cached_completion
+
+STATUS_URL = "https://duckduckgo.com/duckchat/v1/status"
+CHAT_URL = "https://duckduckgo.com/duckchat/v1/chat"
+MODEL_NAME = "gpt-4o-mini"  # default GPT-4o-mini on Duck.ai
+TEMPERATURE = 0.2  # not sent (Duck.ai has no knob); only used for the response cache key
+CONTEXT_TOKEN_BUDGET = 4000  # prompt tokens sent per call (newest messages first)
+OUTPUT_TOKEN_BUDGET = 800  # command output sent back to the model is compacted to this
+MAX_RETRIES = 3  # attempts after errors other than 429 (those back off through rate_limiter until MAX_BACKOFF)
 
 system_prompt = (
     "You are a terminal assistant running inside a secure sandbox environment. "
@@ -25,118 +24,101 @@ system_prompt = (
     "After executing, review output and propose next command. Stop when you state 'TASK COMPLETE'."
 )
 
-# Load or initialize conversation history
-def load_history():
-    try:
-        history = json.load(open(HISTORY_FILE))
-    except FileNotFoundError:
-        history = []
-    if not history or history[0].get('role') != 'system':
-        history.insert(0, {"role": "system", "content": system_prompt})
-    return history
-
-chat_history = load_history()
-
-# Save history to file
-def save_history(history):
-    try:
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(history, f, indent=2)
-    except Exception as e:
-        print(Fore.RED + f"[ERROR] Failed to save history: {e}")
-
-# Keep only recent messages plus system prompt
-def trim_history(history):
-    return [history[0]] + history[-MAX_HISTORY_LENGTH:]
-
-# Replace hostnames with IPs in commands
-def preprocess_cmd(cmd):
-    for host in set(re.findall(r"\b([A-Za-z0-9._-]+\.[A-Za-z]{2,})\b", cmd)):
-        try:
-            ip = socket.gethostbyname(host)
-            cmd = cmd.replace(host, ip)
-        except Exception:
-            pass
-    return cmd
-
-# Execute and stream the shell command
-def execute_command_stream(cmd):
-    if cmd.startswith('ping ') and '-c' not in cmd and '-n' not in cmd:
-        cmd += ' -c 4'
-    cmd = preprocess_cmd(cmd)
-    print(Fore.GREEN + f"💻 Executing Command: {cmd}\n")
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    output = []
-    for line in proc.stdout:
-        print(Fore.WHITE + line, end='')
-        output.append(line)
-    proc.wait()
-    return ''.join(output).strip()
-
-# Send a message to Duck.ai and get response via duckchat module
-def chat_with_llm(query):
-    chat_history.append({"role": "user", "content": query})
-    save_history(chat_history)
-
-    simple_query = query.replace("\n", " ")
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            cmd = [
-                sys.executable, "-m", "duckchat",
-                "-y",
-                "-m", str(MODEL_ID),
-                "-q", simple_query
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            reply = result.stdout.strip()
-            if not reply:
-                print(Fore.YELLOW + f"[WARN] Empty response, retrying ({attempt}/{MAX_RETRIES})")
-                time.sleep(RETRY_DELAY)
-                continue
-            chat_history.append({"role": "assistant", "content": reply})
-            save_history(chat_history)
-            return reply
-        except subprocess.TimeoutExpired:
-            print(Fore.RED + f"[ERROR] Request timed out (attempt {attempt})")
-        except Exception as e:
-            print(Fore.RED + f"[ERROR] {e}")
-        time.sleep(RETRY_DELAY)
+def duck_messages(messages):
+    # Duck.ai only accepts user/assistant turns, so the system prompt rides on the first user message
+    system = [m["content"] for m in messages if m["role"] == "system"]
+    out = [{"role": m["role"], "content": m["content"]} for m in messages if m["role"] != "system"]
+    if system and out and out[0]["role"] == "user":
+        out[0]["content"] = "\n\n".join(system + [out[0]["content"]])
+    elif system:
+        out.insert(0, {"role": "user", "content": "\n\n".join(system)})
+    return out
+
+def duck_delta(data):
+    if data.get("action") == "error":
+        raise StreamError(data.get("type") or data.get("status") or "error")
+    return data.get("message")
+
+class DuckAIBackend(ChatBackend):
+    name = "duckai"
+    stream = STREAM
+    output_token_budget = OUTPUT_TOKEN_BUDGET
+
+    def __init__(self):
+        self.open_history(system_prompt, CONTEXT_TOKEN_BUDGET)
+        # Duck.ai hands out a new VQD token with every reply; keeping it saves the status round trip
+        self.vqd = None
+
+    # Send the trimmed conversation to Duck.ai over the shared keep-alive session
+    def chat(self, query, on_token=None):
+        self.chat_history.append({"role": "user", "content": query})
+        self.save_history(self.chat_history[-1])
+
+        # Keyed on the window itself; the Duck.ai shape hides the Task: turn inside the system prompt
+        msgs = self.window()
+        reply, error = cached_completion(self.name, MODEL_NAME, TEMPERATURE, msgs,
+                                         lambda: self._ask(duck_messages(msgs), on_token), on_token)
+        if error:
+            return None, error
+        self.chat_history.append({"role": "assistant", "content": reply})
+        self.save_history(self.chat_history[-1])
+        return reply, None
+
+    def _refresh_vqd(self):
+        resp = http_transport.get(STATUS_URL, headers={"x-vqd-accept": "1", "Cache-Control": "no-store"}, timeout=10)
+        self.vqd = resp.headers.get("x-vqd-4")
+        if not self.vqd:
+            raise StreamError(f"no VQD token (status {resp.status_code})")
+
+    def _ask(self, msgs, on_token):
+        limiter = get_limiter(self.name, MODEL_NAME)
+        attempt = 0
+        while attempt < MAX_RETRIES:
+            attempt += 1
+            limiter.acquire()
+            try:
+                if not self.vqd:
+                    self._refresh_vqd()
+                resp = http_transport.post(
+                    CHAT_URL,
+                    headers={"x-vqd-4": self.vqd, "Accept": "text/event-stream"},
+                    json={"model": MODEL_NAME, "messages": msgs},
+                    timeout=60,
+                    stream=True
+                )
+                self.vqd = resp.headers.get("x-vqd-4") or self.vqd
+                if resp.status_code == 429:
+                    resp.close()
+                    delay = limiter.rate_limited(resp.headers)
+                    if delay is None:
+                        return None, f"Rate limit exceeded. Still limited after {MAX_BACKOFF:.0f}s of backoff."
+                    print(Fore.YELLOW + f"[WARN] Rate limited. Retrying in {delay:.1f}s...")
+                    attempt -= 1  # only errors count against MAX_RETRIES
+                    continue
+                if resp.status_code in (400, 418):
+                    # Stale or rejected VQD token: fetch a fresh one and retry
+                    resp.close()
+                    self.vqd = None
+                    print(Fore.YELLOW + f"[WARN] Session token rejected, renewing ({attempt}/{MAX_RETRIES})")
+                    continue
+                if resp.status_code != 200:
+                    print(Fore.RED + f"[ERROR] HTTP {resp.status_code}: {resp.text[:200]}")
+                    resp.close()
+                else:
+                    reply, _ = stream_reply(iter_sse(resp, duck_delta), on_token if STREAM else None)
+                    reply = reply.strip()
+                    if reply:
+                        limiter.succeeded(resp.headers)
+                        return reply, None
+                    print(Fore.YELLOW + f"[WARN] Empty response, retrying ({attempt}/{MAX_RETRIES})")
+            except StreamError as e:
+                print(Fore.RED + f"[ERROR] Duck.ai: {e}")
+                self.vqd = None
+            except Exception as e:
+                print(Fore.RED + f"[ERROR] {e}")
+
+        return None, "All retries failed."
 
-    print(Fore.CYAN + "[INFO] All retries failed. TASK COMPLETE.")
-    return "TASK COMPLETE"
-
-# Extract the bash command from LLM response
-def extract_command(text):
-    match = re.search(r"```bash\s*(.*?)\s*```", text, re.DOTALL)
-    block = match.group(1) if match else text
-    lines = [l.strip().lstrip('$') for l in block.splitlines() if l.strip()]
-    return ' && '.join(lines)
-
-# Main execution loop
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(Fore.RED + "Usage: python3 duckai.py \"task description\"")
-        sys.exit(1)
-
-    task = " ".join(sys.argv[1:])
-    print(Fore.BLUE + f"🎯 Task: {task}\n")
-    user_msg = task
-
-    while True:
-        llm_response = chat_with_llm(user_msg + " Provide next bash command in a code block.")
-        print(Fore.MAGENTA + f"🧠 LLM Response:\n{llm_response}\n")
-
-        cmd = extract_command(llm_response)
-        if not cmd:
-            print(Fore.RED + "[ERROR] No command extracted. TASK COMPLETE.")
-            break
-
-        out = execute_command_stream(cmd)
-        user_msg = f"Command: {cmd} Output: {out}"
-
-        follow = chat_with_llm(user_msg + " Provide next bash command or 'TASK COMPLETE'.")
-        print(Fore.MAGENTA + f"🤖 Follow-Up:\n{follow}\n")
-
-        if re.search(r"TASK COMPLETE", follow, re.IGNORECASE):
-            print(Fore.GREEN + "✅ Task complete.")
-            break
+    from assistant import main
+    sys.exit(main(["duckai"] + sys.argv[1:]))
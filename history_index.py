@@ -0,0 +1,245 @@
+"""
+BM25 recall of relevant turns from the whole chat history.
+
+Only the newest messages fit the context window, so a fix found sessions
+ago (say, for "Could not get lock /var/lib/dpkg/lock") is normally gone.
+HistoryIndex keeps an FTS5 index of every past turn (a user message, i.e.
+the task or "Command: ... Output: ...", paired with the assistant reply
+that followed it) in <history file>.index.sqlite3. The index is updated
+incrementally: it remembers which segment file (by inode) and byte offset
+it has read up to, follows the file through rotation and only parses new
+lines, so catching up before a step costs a stat and a short read.
+
+Before each model call recall() ranks past turns against the newest user
+message with bm25, skips turns already in the window and returns the best
+few that fit RECALL_TOKEN_BUDGET. The window gives up that many tokens of
+older messages, so prompts do not grow. Search cost is the number of
+postings scored, so query terms are taken rarest first until MAX_POSTINGS
+is reached: the rare words ("dpkg", "frontend") carry the bm25 score, while
+words found in a large part of the history ("command", "output", "sudo")
+would make every turn a candidate and rank nothing; words in more than
+half of all turns are never used (their BM25 idf is negative). This keeps
+a search well under a millisecond on a 100k-message history.
+
+Without FTS5 (very old SQLite builds) recall is off.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+from colorama import Fore
+
+from output_compactor import estimate_tokens
+
+HISTORY_RECALL = True
+RECALL_TOP_K = 3                # past turns injected per step at most
+RECALL_TOKEN_BUDGET = 600       # tokens of past turns per step at most (taken from the window, not added)
+MAX_QUERY_TERMS = 32            # distinct words of the newest message used as the query
+MAX_POSTINGS = 2000             # turns scored per search at most (rarest query terms first)
+USER_CHARS = 900                # stored head of the user message of a turn
+REPLY_CHARS = 500               # stored head of the assistant reply of a turn
+
+TOKEN_RE = re.compile(r"[^\W_]+")  # same split as FTS5's unicode61 tokenizer
+
+
+def query_terms(text):
+    """Distinct lowercase tokens of text in order of appearance."""
+    return list(dict.fromkeys(t.lower() for t in TOKEN_RE.findall(text) if len(t) > 1))
+
+
+def clip(text, limit):
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit] + " ..."
+
+
+def digest(text):
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+
+
+def turn_text(user, reply):
+    return f"{clip(user, USER_CHARS)}\nReply: {clip(reply, REPLY_CHARS)}"
+
+
+class HistoryIndex:
+    def __init__(self, store, path=None):
+        self.store = store
+        self.path = path or store.path + ".index.sqlite3"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS turns (id INTEGER PRIMARY KEY, hash TEXT UNIQUE NOT NULL,"
+                         " text TEXT NOT NULL, user_hash TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5("
+                         "text, content='turns', content_rowid='id')")
+        # Turns per word; fts5vocab counts them by walking the whole posting list, which is slow for common words
+        self._db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, docs INTEGER NOT NULL)"
+                         " WITHOUT ROWID")
+        self._db.commit()
+
+    # ─── INDEXING ────────────────────────────────────────────────────────────
+    def sync(self):
+        """Index the turns appended to the history since the last call; returns how many were added."""
+        self.store.flush()
+        with self._lock:
+            files = []
+            for path in self.store.segments():
+                try:
+                    files.append((path, os.stat(path)))
+                except OSError:
+                    continue
+            if not files:
+                return 0
+            inode, offset = self._meta("inode"), self._meta("offset")
+            first = next((i for i, (_, st) in enumerate(files) if st.st_ino == inode and st.st_size >= offset), None)
+            if first is None:
+                # First run, or the history was compacted: read it all (known turns are skipped by hash)
+                first, offset = 0, 0
+            turns, pending = [], None
+            resume = (files[-1][1].st_ino, files[-1][1].st_size)
+            for i in range(first, len(files)):
+                path, st = files[i]
+                with open(path, "rb") as f:
+                    f.seek(offset if i == first else 0)
+                    pos = f.tell()
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # still being written
+                        start, pos = pos, pos + len(line)
+                        try:
+                            msg = json.loads(line)
+                        except ValueError:
+                            continue
+                        if msg.get("role") == "user":
+                            pending = (msg.get("content") or "", st.st_ino, start)
+                        elif msg.get("role") == "assistant" and pending:
+                            turns.append((pending[0], msg.get("content") or ""))
+                            pending = None
+                    if i == len(files) - 1:
+                        resume = (st.st_ino, pos)
+            if pending and pending[1] == resume[0]:
+                # Its reply is not written yet; read the user message again next time
+                resume = (pending[1], pending[2])
+            if not turns and resume == (inode, offset):
+                return 0
+            added, docs = 0, Counter()
+            with self._db:
+                for user, reply in turns:
+                    added += self._add(user, reply, docs)
+                self._db.executemany("INSERT INTO terms (term, docs) VALUES (?, ?)"
+                                     " ON CONFLICT (term) DO UPDATE SET docs = docs + excluded.docs", docs.items())
+                self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                     [("inode", resume[0]), ("offset", resume[1]),
+                                      ("turns", self._meta("turns") + added)])
+            return added
+
+    def count(self):
+        with self._lock:
+            return self._meta("turns")
+
+    # ─── SEARCH ──────────────────────────────────────────────────────────────
+    def search(self, query, k=RECALL_TOP_K, budget=RECALL_TOKEN_BUDGET, seen=()):
+        """
+        Up to k past turns most relevant to `query` that fit `budget` tokens,
+        best first. Turns whose user message is one of the `seen` texts
+        (already in the window) are skipped.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            common = self._meta("turns") / 2
+            marks = ",".join("?" * len(terms))
+            df = self._db.execute(f"SELECT term, docs FROM terms WHERE term IN ({marks}) ORDER BY docs",
+                                  terms).fetchall()
+            terms, postings = [], 0
+            for term, docs in df:
+                if docs > common or postings + docs > MAX_POSTINGS or len(terms) >= MAX_QUERY_TERMS:
+                    break
+                terms.append(term)
+                postings += docs
+            if not terms:
+                return []
+            match = " OR ".join(f'"{t}"' for t in terms)
+            rows = self._db.execute(
+                "SELECT turns.text, turns.user_hash FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid"
+                " WHERE turns_fts MATCH ? ORDER BY rank LIMIT ?", (match, k * 4)).fetchall()
+        seen = {digest(text) for text in seen}
+        picked, used = [], 0
+        for text, user_hash in rows:
+            if user_hash in seen:
+                continue
+            cost = estimate_tokens(text) + 2
+            if used + cost > budget:
+                continue
+            picked.append(text)
+            used += cost
+            if len(picked) >= k:
+                break
+        return picked
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _add(self, user, reply, docs):
+        text = turn_text(user, reply)
+        cur = self._db.execute("INSERT OR IGNORE INTO turns (hash, text, user_hash) VALUES (?, ?, ?)",
+                               (digest(f"{user}\0{reply}"), text, digest(user)))
+        if not cur.rowcount:
+            return 0
+        self._db.execute("INSERT INTO turns_fts (rowid, text) VALUES (?, ?)", (cur.lastrowid, text))
+        docs.update(query_terms(text))
+        return 1
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+
+def history_recall(store):
+    """
+    recall(query, seen, budget) -> text to put before the newest user
+    message, for ContextWindow; None when recall is off or unavailable.
+    """
+    if not HISTORY_RECALL:
+        return None
+    try:
+        index = HistoryIndex(store)
+    except sqlite3.Error as e:
+        print(Fore.YELLOW + f"[WARN] History recall disabled: {e}")
+        return None
+
+    def recall(query, seen, budget):
+        try:
+            added = index.sync()
+            if added > 1000:
+                print(Fore.CYAN + f"[INFO] Indexed {added} past turns for recall")
+            turns = index.search(query, budget=min(budget, RECALL_TOKEN_BUDGET), seen=seen)
+        except (OSError, sqlite3.Error) as e:
+            print(Fore.YELLOW + f"[WARN] History recall failed: {e}")
+            return ""
+        if not turns:
+            return ""
+        return "Relevant turns from earlier sessions:\n" + "\n---\n".join(turns) + "\n"
+
+    return recall
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from history_store import HistoryStore
+
+    # python3 history_index.py [history.jsonl] "query": rebuild/catch up the index and search it
+    path = sys.argv[1] if len(sys.argv) > 2 else os.path.expanduser("~/.shell_history.jsonl")
+    store = HistoryStore(path)
+    index = HistoryIndex(store)
+    start = time.perf_counter()
+    added = index.sync()
+    print(f"Indexed {added} new turns ({index.count()} total) in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    results = index.search(sys.argv[-1]) if len(sys.argv) > 1 else []
+    print(f"Search took {(time.perf_counter() - start) * 1000:.1f} ms")
+    for text in results:
+        print("---\n" + text)
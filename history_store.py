@@ -0,0 +1,225 @@
+"""
+Append-only JSONL history store shared by the chat backends.
+
+Every message is one JSON line appended to the active segment, so saving a
+turn costs the same no matter how many sessions came before. Writes are
+handed to a background thread, so append() returns at once and the disk
+write overlaps whatever the caller does next; fsync is batched (every
+FSYNC_EVERY appends or FSYNC_INTERVAL seconds, and on exit).
+Startup only reads the last few messages by seeking backwards from the end
+of the file. When the active segment grows past MAX_SEGMENT_BYTES it is
+rotated to <path>.1, <path>.2, ... and the oldest segment is dropped.
+
+Setting ASSISTANT_HISTORY_FILE=path keeps the history (and its recall
+index) in that file instead of the backend's default, so concurrent runs
+(batch mode) don't share one file.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+import tracing
+
+FSYNC_EVERY = 8             # appends between fsyncs
+FSYNC_INTERVAL = 2.0        # seconds between fsyncs
+MAX_SEGMENT_BYTES = 4 << 20 # rotate the active file past 4 MiB
+KEEP_SEGMENTS = 4           # rotated segments kept on disk
+READ_BLOCK = 8192
+HISTORY_PATH = os.environ.get("ASSISTANT_HISTORY_FILE", "")  # used instead of the backend's file when set
+
+
+def history_path(path):
+    """The history file to use: HISTORY_PATH if set, else the backend's default `path`."""
+    return os.path.abspath(os.path.expanduser(HISTORY_PATH)) if HISTORY_PATH else path
+
+
+def tail_lines(path, n, block=READ_BLOCK):
+    """Return the last n non-empty lines of path (bytes) without reading the whole file."""
+    if n <= 0:
+        return []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return []
+    with f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # Need n + 1 newlines so that a partial first line can be dropped
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.split(b"\n")
+    if pos > 0:
+        lines = lines[1:]
+    return [l for l in lines if l.strip()][-n:]
+
+
+class HistoryStore:
+    def __init__(self, path, legacy_path=None, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL, max_bytes=MAX_SEGMENT_BYTES,
+                 keep_segments=KEEP_SEGMENTS, background=True):
+        self.path = history_path(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.keep_segments = keep_segments
+        self.background = background
+        self._queue = queue.Queue()
+        self._writer = None
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        if legacy_path and self.path == path and not os.path.exists(path):
+            self._import_legacy(legacy_path)
+        atexit.register(self.close)
+
+    # ─── WRITING ─────────────────────────────────────────────────────────────
+    def append(self, msg):
+        """Queue one message for the writer thread (or write it now if background=False)."""
+        if not self.background:
+            self._write(msg)
+            return
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._drain, name="history-writer", daemon=True)
+            self._writer.start()
+        self._queue.put(msg)
+
+    def flush(self):
+        """Block until every queued message has been written."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def sync(self):
+        self.flush()
+        self._sync()
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+    def rotate(self):
+        """Move the active file to <path>.1 and shift older segments up by one."""
+        self.flush()
+        self._rotate()
+
+    def compact(self, keep):
+        """Rewrite the store with only the last `keep` messages and drop rotated segments."""
+        tail = self.load_tail(keep)
+        self.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for msg in tail:
+                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        for i in range(1, self.keep_segments + 1):
+            if os.path.exists(self._segment(i)):
+                os.remove(self._segment(i))
+
+    # ─── READING ─────────────────────────────────────────────────────────────
+    def load_tail(self, n):
+        """Return the last n messages, reaching into rotated segments if needed."""
+        self.flush()
+        messages = []
+        for path in [self.path] + [self._segment(i) for i in range(1, self.keep_segments + 1)]:
+            if len(messages) >= n:
+                break
+            chunk = []
+            for line in tail_lines(path, n - len(messages)):
+                try:
+                    chunk.append(json.loads(line))
+                except ValueError:
+                    # Torn write from a crash; skip it
+                    continue
+            messages = chunk + messages
+        return messages[-n:] if n > 0 else []
+
+    def segments(self):
+        """All segment paths that exist, oldest first."""
+        paths = [self._segment(i) for i in range(self.keep_segments, 0, -1)] + [self.path]
+        return [p for p in paths if os.path.exists(p)]
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _segment(self, i):
+        return f"{self.path}.{i}"
+
+    def _drain(self):
+        while True:
+            msg = self._queue.get()
+            try:
+                self._write(msg)
+            except OSError as e:
+                print(f"[ERROR] Failed to save history: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, msg):
+        with tracing.span("history_write"):
+            self._write_line(msg)
+
+    def _write_line(self, msg):
+        # The line reaches the OS immediately, fsync is batched
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(msg, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+            self._sync()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _sync(self):
+        if self._file is not None and self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def _rotate(self):
+        self._close_file()
+        oldest = self._segment(self.keep_segments)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for i in range(self.keep_segments - 1, 0, -1):
+            if os.path.exists(self._segment(i)):
+                os.replace(self._segment(i), self._segment(i + 1))
+        if os.path.exists(self.path) and self.keep_segments > 0:
+            os.replace(self.path, self._segment(1))
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _import_legacy(self, legacy_path):
+        # One-off migration from the old ~/.shell_history.json list format
+        try:
+            with open(legacy_path) as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            return
+        with open(self.path, "w", encoding="utf-8") as f:
+            for msg in history:
+                if isinstance(msg, dict) and msg.get("role") in ("user", "assistant"):
+                    f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    import sys
+    # python3 history_store.py [keep]  ->  compact ~/.shell_history.jsonl to the last `keep` messages
+    keep = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    store = HistoryStore(os.path.expanduser("~/.shell_history.jsonl"))
+    store.compact(keep)
+    print(f"Compacted history to the last {keep} messages.")
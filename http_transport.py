@@ -0,0 +1,143 @@
+"""
+One pooled, keep-alive HTTP transport for every HTTP backend.
+
+openrouter.py, ollama.py and deepseek_shell.py used bare requests.post /
+requests.get, which opens a fresh TCP (and TLS) connection per call. Here
+a single Session per process keeps connections alive per host, asks for
+gzip, and applies a short connect timeout on top of each caller's read
+timeout. Set USE_HTTP2 = True (and pip install 'httpx[http2]') to go
+through an HTTP/2 httpx client instead; the response is wrapped so callers
+see the same status_code / text / json() / iter_lines() / close() API.
+
+Run `python3 http_transport.py URL [N]` to compare N pooled requests with
+N fresh connections against any server (e.g. a local mock).
+"""
+import threading
+
+POOL_CONNECTIONS = 4     # distinct hosts kept in the pool
+POOL_MAXSIZE = 8         # connections kept per host
+CONNECT_TIMEOUT = 5      # seconds; callers' timeout= is the read timeout
+USE_HTTP2 = False
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+    "User-Agent": "AI-integrated-terminal",
+}
+
+_session = None
+_http2_client = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide requests.Session with a tuned connection pool."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                s = requests.Session()
+                # Retry only when a pooled connection turned out to be dead before
+                # the request was sent; never replay a POST that reached the server
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                      pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=Retry(total=1, connect=1, read=0,
+                                                        status=0, redirect=0))
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                s.headers.update(DEFAULT_HEADERS)
+                _session = s
+    return _session
+
+
+def _get_http2_client():
+    global _http2_client
+    if _http2_client is None:
+        with _lock:
+            if _http2_client is None:
+                import httpx
+                limits = httpx.Limits(max_connections=POOL_CONNECTIONS * POOL_MAXSIZE,
+                                      max_keepalive_connections=POOL_MAXSIZE)
+                _http2_client = httpx.Client(http2=True, limits=limits, headers=DEFAULT_HEADERS)
+    return _http2_client
+
+
+def _http2_available():
+    if not USE_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        import httpx  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _timeout(timeout):
+    if timeout is None or isinstance(timeout, tuple):
+        return timeout
+    return (min(CONNECT_TIMEOUT, timeout), timeout)
+
+
+class _Http2Response:
+    """Give an httpx response the subset of the requests API the backends use."""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+
+    @property
+    def text(self):
+        self._resp.read()
+        return self._resp.text
+
+    def json(self):
+        self._resp.read()
+        return self._resp.json()
+
+    def iter_lines(self):
+        return self._resp.iter_lines()
+
+    def close(self):
+        self._resp.close()
+
+
+def request(method, url, timeout=60, stream=False, **kwargs):
+    if _http2_available():
+        import httpx
+        client = _get_http2_client()
+        connect, read = _timeout(timeout) or (None, None)
+        req = client.build_request(method, url, timeout=httpx.Timeout(read, connect=connect), **kwargs)
+        return _Http2Response(client.send(req, stream=stream))
+    return get_session().request(method, url, timeout=_timeout(timeout), stream=stream, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import requests
+
+    url = sys.argv[1]
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    start = time.perf_counter()
+    for _ in range(n):
+        requests.get(url, timeout=10).text
+    fresh = (time.perf_counter() - start) / n
+    get(url, timeout=10).text  # warm the pool
+    start = time.perf_counter()
+    for _ in range(n):
+        get(url, timeout=10).text
+    pooled = (time.perf_counter() - start) / n
+    print(f"fresh connection: {fresh * 1000:.1f} ms/request")
+    print(f"pooled keep-alive: {pooled * 1000:.1f} ms/request")
@@ -0,0 +1,119 @@
+"""
+Shared helpers for streaming LLM replies token by token.
+
+Every backend turns its wire format into a plain iterator of text chunks
+(see iter_sse / iter_ndjson below) and hands it to stream_reply, which echoes
+tokens as they arrive and stops reading as soon as the ```bash block is
+closed. Closing the iterator closes the HTTP response, which makes the
+server cancel the rest of the generation.
+"""
+import json
+import re
+
+# "info" is a 'parallel' word in the fence's info string (```bash parallel), "body" the commands
+CODE_BLOCK_RE = re.compile(r"```bash(?P<info>[ \t]+(?i:parallel)(?=[ \t]*\n))?\s*(?P<body>.*?)\s*```", re.DOTALL)
+
+
+class StreamError(Exception):
+    """Raised when the server reports an error in the middle of a stream."""
+
+
+def token_printer(header, color=""):
+    """
+    Return an on_token callback that prints header before the first token
+    and then echoes every chunk without a newline.
+    """
+    started = False
+
+    def emit(chunk):
+        nonlocal started
+        if not started:
+            print(color + header)
+            started = True
+        print(color + chunk, end="", flush=True)
+
+    return emit
+
+
+def stream_reply(chunks, on_token=None):
+    """
+    Consume text chunks until the stream ends or the first ```bash block is
+    closed. Returns (text, cut_short); text is trimmed right after the
+    closing fence when the generation was cut short.
+    """
+    text = ""
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            start = len(text)
+            text += chunk
+            # Only look for the closing fence when a backtick just arrived
+            m = CODE_BLOCK_RE.search(text) if "`" in chunk else None
+            if m:
+                text = text[:m.end()]
+                if on_token and len(text) > start:
+                    on_token(text[start:])
+                return text, True
+            if on_token:
+                on_token(chunk)
+        return text, False
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def iter_ndjson(resp, extract):
+    """
+    Yield text from an Ollama-style newline-delimited JSON stream.
+    extract(obj) returns the text of one object; the response is closed
+    when the generator is closed.
+    """
+    try:
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise StreamError(data["error"])
+            text = extract(data)
+            if text:
+                yield text
+            if data.get("done"):
+                break
+    finally:
+        resp.close()
+
+
+def openai_delta(data):
+    choices = data.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def iter_sse(resp, extract=openai_delta):
+    """
+    Yield text from a server-sent event stream. extract(obj) returns the text
+    of one event; the default reads OpenAI-compatible deltas (OpenRouter).
+    Comment lines such as ': OPENROUTER PROCESSING' are skipped.
+    """
+    try:
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            if isinstance(line, bytes):
+                line = line.decode("utf-8", "replace")
+            if not line.startswith("data:"):
+                continue
+            body = line[5:].strip()
+            if body == "[DONE]":
+                break
+            data = json.loads(body)
+            if data.get("error"):
+                err = data["error"]
+                raise StreamError(err.get("message", err) if isinstance(err, dict) else err)
+            text = extract(data)
+            if text:
+                yield text
+    finally:
+        resp.close()
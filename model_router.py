@@ -0,0 +1,228 @@
+"""
+Latency-ranked, hedged selection between interchangeable models.
+
+Each model keeps an EWMA of its reply latency and of its error rate, plus
+windows of recent reply latencies and times to first token for p90
+estimates. Every request goes to the model with the lowest expected
+latency (EWMA latency inflated by its error rate). When hedging is on and
+the first model has not started answering within its own p90 time to first
+token (reply latency when not streaming), the next-best model is fired as
+well; whichever starts answering first is kept and the other stream is
+aborted on its next token.
+
+Failing models are put on a cooldown (rate limits, errors) rather than
+being dropped, and come back into rotation once it expires. Only when every
+model is cooling down does a request wait, and only invalid models are
+skipped for good. Stats are saved to STATS_FILE so the next session starts
+with a sensible order. Several processes (batch mode) can save at once, so
+the read-merge-write runs under an flock and the file is replaced
+atomically.
+"""
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+STATS_FILE = os.path.expanduser("~/.shell_cache/model_stats.json")
+EWMA_ALPHA = 0.3            # weight of the newest sample
+DEFAULT_LATENCY = 10.0      # seconds assumed for a model with no samples yet
+LATENCY_WINDOW = 50         # samples kept per model for the p90
+MIN_HEDGE_SAMPLES = 5       # don't hedge on a p90 guessed from fewer samples
+MIN_HEDGE_DELAY = 1.0       # seconds; never hedge sooner than this
+MAX_COOLDOWN_WAIT = 120     # seconds a request waits for a model to come back
+COOLDOWNS = {               # seconds a model sits out after each kind of failure
+    "rate_limit": 60,
+    "invalid_model": float("inf"),
+    "error": 20,
+}
+
+
+class ModelStats:
+    def __init__(self, data=None):
+        data = data or {}
+        self.latency = data.get("latency")          # EWMA seconds, None until measured
+        self.error_rate = data.get("error_rate", 0.0)
+        self.samples = deque(data.get("samples", []), maxlen=LATENCY_WINDOW)
+        self.first_token = data.get("first_token")  # EWMA seconds to the first streamed token
+        self.first_token_samples = deque(data.get("first_token_samples", []), maxlen=LATENCY_WINDOW)
+        self.cooldown_until = 0.0
+
+    def to_dict(self):
+        return {"latency": self.latency, "error_rate": self.error_rate, "samples": list(self.samples),
+                "first_token": self.first_token, "first_token_samples": list(self.first_token_samples)}
+
+    def expected_latency(self):
+        latency = DEFAULT_LATENCY if self.latency is None else self.latency
+        # A model that fails half the time costs about two tries
+        return latency / max(1.0 - self.error_rate, 0.1)
+
+    def p90(self, first_token=False):
+        """p90 reply latency, or time to first token; None until MIN_HEDGE_SAMPLES were taken."""
+        samples = self.first_token_samples if first_token else self.samples
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * 0.9), len(ordered) - 1)]
+
+
+class _Lost(Exception):
+    """Raised inside the losing stream's token callback to abort it."""
+
+
+class ModelRouter:
+    def __init__(self, models, stats_file=STATS_FILE, hedge=True, cooldown_hint=None):
+        self.models = list(models)
+        self.stats_file = stats_file
+        self.hedge = hedge
+        self.cooldown_hint = cooldown_hint  # (model, kind) -> seconds, or None for COOLDOWNS
+        self._lock = threading.Lock()
+        saved = self._load()
+        self.stats = {m: ModelStats(saved.get(m)) for m in self.models}
+
+    # ─── STATS ───────────────────────────────────────────────────────────────
+    def ranked(self):
+        """Models that are not cooling down, best expected latency first (list order breaks ties)."""
+        now = time.monotonic()
+        ready = [m for m in self.models if self.stats[m].cooldown_until <= now]
+        return sorted(ready, key=lambda m: (self.stats[m].expected_latency(), self.models.index(m)))
+
+    def wait_time(self):
+        """Seconds until some model is usable again, or None if none ever will be."""
+        soonest = min(s.cooldown_until for s in self.stats.values())
+        if soonest == float("inf"):
+            return None
+        return max(soonest - time.monotonic(), 0.0)
+
+    def record_success(self, model, latency):
+        with self._lock:
+            s = self.stats[model]
+            s.latency = latency if s.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * s.latency
+            s.error_rate *= 1 - EWMA_ALPHA
+            s.samples.append(round(latency, 3))
+
+    def record_first_token(self, model, seconds):
+        with self._lock:
+            s = self.stats[model]
+            s.first_token = seconds if s.first_token is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * s.first_token
+            s.first_token_samples.append(round(seconds, 3))
+
+    def record_failure(self, model, kind, cooldown=None):
+        with self._lock:
+            s = self.stats[model]
+            s.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * s.error_rate
+            wait = COOLDOWNS.get(kind, COOLDOWNS["error"]) if cooldown is None else cooldown
+            s.cooldown_until = time.monotonic() + wait
+
+    def save(self):
+        if not self.stats_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
+            with open(self.stats_file + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                data = self._load()
+                data.update({m: s.to_dict() for m, s in self.stats.items()})
+                tmp = f"{self.stats_file}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.stats_file)
+        except OSError:
+            pass
+
+    # ─── REQUESTS ────────────────────────────────────────────────────────────
+    def race(self, call, on_token=None, classify=lambda error: "error"):
+        """
+        Run call(model, on_token) -> (reply, error, cached) on the best model,
+        hedging onto the runner-up after the leader's p90: of the time to
+        first token when streaming (the first token decides the race), of
+        the reply latency otherwise. Failures are recorded under
+        classify(error) (a COOLDOWNS key); replies served from a cache
+        (cached true) are not latency samples. Returns (model, reply, error)
+        for the attempt that won, or for the last one that failed.
+        """
+        ranked = self.ranked()
+        if not ranked:
+            return None, None, "no_model"
+        candidates = ranked[:2] if self.hedge else ranked[:1]
+        results = queue.Queue()
+        winner = []
+        claim = threading.Lock()
+
+        def take(model):
+            # First attempt to produce output (or finish) wins; the others stop
+            with claim:
+                if not winner:
+                    winner.append(model)
+                return winner[0] == model
+
+        def forward(model, start, first):
+            if on_token is None:
+                return None
+
+            def emit(token):
+                if not first:
+                    first.append(time.monotonic() - start)
+                if not take(model):
+                    raise _Lost()
+                on_token(token)
+            return emit
+
+        def attempt(model):
+            start, first = time.monotonic(), []
+            try:
+                reply, error, cached = call(model, forward(model, start, first))
+            except Exception as e:
+                reply, error, cached = None, f"error: {e}", False
+            if first and not cached:
+                # Recorded for the losing stream too: it got as far as its first token
+                self.record_first_token(model, first[0])
+            if reply is not None and not error and not take(model):
+                error = "lost"
+            if winner and winner[0] != model and error:
+                error = "lost"  # aborted on purpose, not the model's fault
+            if not error:
+                if not cached:
+                    self.record_success(model, time.monotonic() - start)
+            elif error != "lost":
+                kind = classify(error)
+                self.record_failure(model, kind, self.cooldown_hint(model, kind) if self.cooldown_hint else None)
+            results.put((model, reply, error))
+
+        threading.Thread(target=attempt, args=(candidates[0],), daemon=True).start()
+        pending = 1
+        delay = self.stats[candidates[0]].p90(first_token=on_token is not None) if len(candidates) > 1 else None
+        if delay is not None:
+            try:
+                result = results.get(timeout=max(delay, MIN_HEDGE_DELAY))
+            except queue.Empty:
+                result = None
+                if not winner:
+                    print(f"[INFO] {candidates[0]} is slower than its p90, also trying {candidates[1]}")
+                    threading.Thread(target=attempt, args=(candidates[1],), daemon=True).start()
+                    pending += 1
+        else:
+            result = None
+
+        last = None
+        while pending:
+            model, reply, error = result if result is not None else results.get()
+            result = None
+            pending -= 1
+            if not error:
+                return model, reply, None
+            if error != "lost":
+                last = (model, None, error)
+        return last or (None, None, "lost")
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _load(self):
+        if not self.stats_file:
+            return {}
+        try:
+            with open(self.stats_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
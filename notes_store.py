@@ -0,0 +1,160 @@
+"""
+Indexed store for the NOTE: lines deepseek_shell.py's model writes down.
+
+Notes live in SQLite with an FTS5 index. All notes from one reply are
+written in a single transaction. A note whose words nearly match an
+existing note (Jaccard >= DUPLICATE_SIMILARITY) is dropped. Each note is
+tagged with the hosts and ports mentioned in its text. Before every model
+call, relevant() picks the top-k notes for the last command and its
+output: bm25 rank, boosted when a note's hosts or ports show up in the
+query, and cut to a small token budget. Long sessions thus recall earlier
+findings without carrying the whole transcript.
+
+Without FTS5 (very old SQLite builds) the ranking falls back to word overlap.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+from output_compactor import estimate_tokens
+from session_memory import IPV4_RE
+
+NOTES_TOP_K = 5                 # notes injected per turn at most
+NOTES_TOKEN_BUDGET = 300        # tokens of notes injected per turn at most
+DUPLICATE_SIMILARITY = 0.8      # word-set Jaccard above which a note counts as a repeat
+MAX_QUERY_TERMS = 48            # distinct words of the command/output used as the search query
+TAG_BOOST = 2.0                 # score bonus per host/port shared between note and query
+
+WORD_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*[A-Za-z0-9]|[A-Za-z0-9]")
+PORT_RE = re.compile(r"\b(\d{1,5})/(?:tcp|udp)\b|\bports?\s+(\d{1,5})\b|(?:\d{1,3}(?:\.\d{1,3}){3}|(?<![\d.])):(\d{2,5})\b",
+                     re.IGNORECASE)
+
+
+def words(text):
+    return {w.lower() for w in WORD_RE.findall(text)}
+
+
+def query_terms(text):
+    """Distinct search words of text in order of appearance, at most MAX_QUERY_TERMS."""
+    terms = dict.fromkeys(w.lower() for w in WORD_RE.findall(text) if len(w) > 2 or w.isdigit())
+    return list(terms)[:MAX_QUERY_TERMS]
+
+
+def note_tags(text):
+    """(hosts, ports) mentioned in a note, as sorted lists of strings."""
+    hosts = sorted(set(IPV4_RE.findall(text)))
+    ports = sorted({next(g for g in m.groups() if g) for m in PORT_RE.finditer(text)
+                    if 0 < int(next(g for g in m.groups() if g)) < 65536}, key=int)
+    return hosts, ports
+
+
+def normalize(note):
+    note = re.sub(r"^\s*NOTE:\s*", "", note, flags=re.IGNORECASE)
+    return re.sub(r"\s+", " ", note).strip()
+
+
+def similarity(a, b):
+    a, b = words(a), words(b)
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class NotesStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS notes ("
+            " id INTEGER PRIMARY KEY, text TEXT NOT NULL, hosts TEXT NOT NULL, ports TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        try:
+            self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+                             "text, tags, content='notes', content_rowid='id')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self._db.commit()
+
+    # ─── WRITING ─────────────────────────────────────────────────────────────
+    def add_many(self, notes):
+        """Store new notes in one transaction; returns the ones that were not duplicates."""
+        added = []
+        with self._lock, self._db:
+            for note in notes:
+                text = normalize(note)
+                if not text or self._duplicate(text, added):
+                    continue
+                hosts, ports = note_tags(text)
+                cur = self._db.execute("INSERT INTO notes (text, hosts, ports, created) VALUES (?, ?, ?, ?)",
+                                       (text, " ".join(hosts), " ".join(ports), time.time()))
+                if self.fts:
+                    self._db.execute("INSERT INTO notes_fts (rowid, text, tags) VALUES (?, ?, ?)",
+                                     (cur.lastrowid, text, " ".join(hosts + ports)))
+                added.append(text)
+        return added
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    # ─── READING ─────────────────────────────────────────────────────────────
+    def relevant(self, query, k=NOTES_TOP_K, budget=NOTES_TOKEN_BUDGET, seen=""):
+        """
+        Up to k notes most relevant to `query` that fit `budget` tokens,
+        best first. Notes already quoted in `seen` (the live context) are skipped.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        q_hosts, q_ports = note_tags(query)
+        rows = self._candidates(terms, k * 4)
+        scored = []
+        for text, hosts, ports, score in rows:
+            shared = len(set(hosts.split()) & set(q_hosts)) + len(set(ports.split()) & set(q_ports))
+            scored.append((score + TAG_BOOST * shared, text))
+        scored.sort(key=lambda item: -item[0])
+        picked, used = [], 0
+        for _, text in scored:
+            if text in seen:
+                continue
+            cost = estimate_tokens(text) + 2
+            if used + cost > budget:
+                continue
+            picked.append(text)
+            used += cost
+            if len(picked) >= k:
+                break
+        return picked
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _candidates(self, terms, limit):
+        # (text, hosts, ports, score) with higher scores more relevant
+        with self._lock:
+            if self.fts:
+                match = " OR ".join(f'"{t}"' for t in terms)
+                rows = self._db.execute(
+                    "SELECT notes.text, notes.hosts, notes.ports, bm25(notes_fts) FROM notes_fts"
+                    " JOIN notes ON notes.id = notes_fts.rowid WHERE notes_fts MATCH ?"
+                    " ORDER BY bm25(notes_fts) LIMIT ?", (match, limit)).fetchall()
+                # bm25() is lower-is-better and negative
+                return [(t, h, p, -score) for t, h, p, score in rows]
+            rows = self._db.execute("SELECT text, hosts, ports FROM notes").fetchall()
+        wanted = set(terms)
+        scored = [(t, h, p, len(words(t) & wanted)) for t, h, p in rows]
+        return sorted([r for r in scored if r[3]], key=lambda r: -r[3])[:limit]
+
+    def _duplicate(self, text, pending):
+        if any(similarity(text, other) >= DUPLICATE_SIMILARITY for other in pending):
+            return True
+        terms = query_terms(text)
+        if not terms:
+            return False
+        if self.fts:
+            match = " OR ".join(f'"{t}"' for t in terms)
+            rows = self._db.execute("SELECT notes.text FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid"
+                                    " WHERE notes_fts MATCH ? ORDER BY bm25(notes_fts) LIMIT 5", (match,))
+        else:
+            rows = self._db.execute("SELECT text FROM notes")
+        return any(similarity(text, row[0]) >= DUPLICATE_SIMILARITY for row in rows)
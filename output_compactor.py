@@ -0,0 +1,144 @@
+"""
+Shrink command output to a token budget before it is sent back to the model.
+
+The terminal still shows everything live; only the copy that goes into the
+next prompt is compacted. Carriage-return spinners and progress bars are
+reduced to their final state, runs of repeated lines are collapsed, and if
+the result is still over budget we keep the head, the tail and any error
+lines from the middle. Whenever something is dropped the full output is
+written to OUTPUT_LOG_DIR and the path is mentioned to the model.
+"""
+import itertools
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+OUTPUT_LOG_DIR = os.path.expanduser("~/.shell_outputs")
+DEFAULT_TOKEN_BUDGET = 1000
+CHARS_PER_TOKEN = 4      # rough estimate, good enough for budgeting
+HEAD_SHARE = 0.25        # share of the budget for the first lines
+ERROR_SHARE = 0.25       # share for error lines from the middle
+MAX_LINE_CHARS = 400     # long lines (minified JSON, base64) are cut
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+PROGRESS_RE = re.compile(
+    r"^\s*\d{1,3}(\.\d+)?%"               # "42%" / "42.5% ..."
+    r"|\d{1,3}(\.\d+)?%\s*\[?[#=>.\- ]*\]?\s*$"
+    r"|\[[#=>.\- ]{5,}\]"                # [=====>    ]
+    r"|\d+(\.\d+)?\s*[kKMG]i?B/s"        # transfer rates
+    r"|^\s*[|/\\-]\s*$"                  # bare spinner frames
+)
+ERROR_RE = re.compile(
+    r"\b(error|errors|failed|failure|fatal|denied|not found|no such|cannot|can't|unable|"
+    r"refused|timed out|traceback|exception|segmentation fault|unmet|conflict)\b"
+    r"|^(E|W):\s",
+    re.IGNORECASE,
+)
+
+_log_counter = itertools.count(1)
+_log_writer = None  # started on the first save; its thread is joined at exit
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def clean_lines(text):
+    """
+    Resolve carriage returns, strip colour codes, keep only the last frame of
+    a progress bar run and collapse repeated lines.
+    """
+    out = []
+    repeats = 0
+    in_progress = False
+    # Trailing blank lines would otherwise come back as a "repeated" marker
+    for raw in ANSI_RE.sub("", text).rstrip().split("\n"):
+        # What the terminal finally shows is whatever followed the last \r
+        line = raw.rstrip("\r").rsplit("\r", 1)[-1].rstrip()
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + f" …[{len(line) - MAX_LINE_CHARS} chars cut]"
+        is_progress = bool(PROGRESS_RE.search(line))
+        if is_progress and in_progress and out:
+            out[-1] = line
+            continue
+        in_progress = is_progress
+        if out and line == out[-1]:
+            repeats += 1
+            continue
+        if repeats:
+            out.append(f"[previous line repeated {repeats} more times]")
+            repeats = 0
+        out.append(line)
+    if repeats:
+        out.append(f"[previous line repeated {repeats} more times]")
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+def _take(lines, budget_chars):
+    taken, used = [], 0
+    for line in lines:
+        used += len(line) + 1
+        if used > budget_chars:
+            break
+        taken.append(line)
+    return taken
+
+
+def _write_log(path, text):
+    try:
+        with open(path, "w", encoding="utf-8", errors="replace") as f:
+            f.write(text)
+    except OSError:
+        pass
+
+
+def save_full_output(text, log_dir=OUTPUT_LOG_DIR):
+    """
+    Return the path the untouched output is saved to (None if log_dir is
+    unusable). The write itself runs on a background thread so it overlaps
+    the next LLM request.
+    """
+    global _log_writer
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+    except OSError:
+        return None
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_log_counter)}.log"
+    path = os.path.join(log_dir, name)
+    if _log_writer is None:
+        _log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output-log")
+    _log_writer.submit(_write_log, path, text)
+    return path
+
+
+def compact_output(text, token_budget=DEFAULT_TOKEN_BUDGET, log_dir=OUTPUT_LOG_DIR):
+    """Return `text` reduced to roughly `token_budget` tokens for the next prompt."""
+    lines = clean_lines(text)
+    cleaned = "\n".join(lines).strip()
+    if estimate_tokens(cleaned) <= token_budget:
+        return cleaned
+
+    budget = token_budget * CHARS_PER_TOKEN
+    head = _take(lines, int(budget * HEAD_SHARE))
+    rest = lines[len(head):]
+    errors_budget = int(budget * ERROR_SHARE)
+    tail_budget = budget - sum(len(l) + 1 for l in head) - errors_budget
+    tail = list(reversed(_take(reversed(rest), tail_budget)))
+    middle = rest[:len(rest) - len(tail)]
+    errors = _take([l for l in middle if ERROR_RE.search(l)], errors_budget)
+    omitted = len(middle) - len(errors)
+
+    path = save_full_output(text, log_dir)
+    parts = head
+    if errors:
+        parts += [f"... [{omitted} lines omitted; error lines from them follow] ..."] + errors + ["..."]
+    else:
+        parts += [f"... [{omitted} lines omitted] ..."]
+    parts += tail
+    where = f"; full output saved to {path}" if path else ""
+    parts.append(f"[output compacted from {len(lines)} lines (~{estimate_tokens(text)} tokens){where}]")
+    return "\n".join(parts).strip()
@@ -0,0 +1,168 @@
+"""
+Result cache for read-only probe commands.
+
+Models re-run the same discovery commands over and over (uname -a,
+cat /etc/os-release, which nginx, dpkg -l | grep ..., ip a). Commands that
+fully match a READ_ONLY_COMMANDS pattern (optionally piped through grep,
+head, tail, wc, sort or cut) are answered from this cache instead of being
+executed again, keyed by host, the shell's context (working directory,
+PATH, VIRTUAL_ENV and CONDA_PREFIX, see ShellWorker.context()) and the
+normalized command, so `which python` after activating a virtualenv is not
+answered with the system python. Entries live in SQLite next to the
+response cache, so a probe stays cached across tasks on the same host for
+PROBE_TTL seconds. Probes of runtime state (systemctl status, is-active)
+are not cached at all: a unit can crash or start at any time.
+
+Any command that can change what a probe would print (package managers,
+systemctl, rm/mv/cp, writes under /etc, sudo with anything that is not a
+probe, and shell builtins that change the environment such as cd, source,
+export or conda activate) clears the cache for this host. Cached output is labelled as
+such when it is handed to the model.
+"""
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+
+PROBE_CACHE = True
+PROBE_CACHE_FILE = os.path.expanduser("~/.shell_cache/probes.sqlite3")
+PROBE_TTL = 3600            # seconds a probe result stays valid (changes made outside the agent)
+
+# Whole-command patterns of read-only probes whose output only changes when the system is changed
+READ_ONLY_COMMANDS = [
+    r"uname(\s+-[a-z]+)*",
+    r"cat\s+/etc/(os-release|lsb-release|debian_version|redhat-release|issue|hostname|passwd|group|hosts|resolv\.conf)",
+    r"cat\s+/proc/(cpuinfo|version|meminfo)",
+    r"lsb_release(\s+-[a-z]+)*",
+    r"hostnamectl(\s+status)?",
+    r"hostname(\s+-[a-zA-Z]+)*",
+    r"(which|whereis|type)(\s+-[a-z]+)*(\s+[\w.+-]+)+",
+    r"command\s+-v(\s+[\w.+-]+)+",
+    r"whoami|id(\s+[\w.-]+)?|groups(\s+[\w.-]+)?|arch|nproc|lscpu|getconf\s+\w+",
+    r"dpkg\s+(-l|--list|-s|--status|-L)(\s+[\w.+:*-]+)*",
+    r"dpkg-query\s+(-W|-l|-s)(\s+[\w.+:*=${}'\"-]+)*",
+    r"apt\s+(list\s+--installed|policy|show)(\s+[\w.+-]+)*",
+    r"rpm\s+-q[a-z]*(\s+[\w.+-]+)*",
+    r"(pip3?|python3?\s+-m\s+pip)\s+(list|show|freeze)(\s+[\w.+-]+)*",
+    r"ip(\s+-[a-z0-9]+)*\s+(a|addr|address|r|route|l|link)(\s+show)?(\s+[\w.-]+)*",
+    r"ifconfig(\s+-a)?(\s+[\w.-]+)?",
+    r"systemctl\s+(is-enabled|list-unit-files)(\s+[\w.@-]+)*(\s+--no-pager)?",
+    r"[\w.-]+\s+(--version|-V)",
+]
+# Filters a probe may be piped through
+PIPE_FILTER = r"\s*\|\s*(grep|egrep|fgrep|head|tail|wc|sort|uniq|cut|awk)(\s+(-[\w-]+|'[^']*'|\"[^\"]*\"|[\w./:=,^$*+-]+))*"
+# Commands that can change what a probe prints; running one clears the host's probes
+_CMD_START = r"(?:^|[;&|(]\s*|\bsudo\s+(?:-\S+\s+)*|\bxargs\s+)"
+MUTATING_RE = re.compile(
+    _CMD_START + r"(?:(?:apt|apt-get|aptitude)\s+(?:\S+\s+)*(?:install|reinstall|remove|purge|upgrade|"
+    r"dist-upgrade|full-upgrade|autoremove|update)|dpkg\s+(?:-i|--install|-r|--remove|-P|--purge|--configure)|"
+    r"dpkg-reconfigure|yum|dnf|zypper|pacman|snap|rpm\s+-[iUeF]|(?:pip3?|python3?\s+-m\s+pip)\s+(?:install|uninstall)|"
+    r"npm\s+(?:i|install|uninstall)|systemctl\s+(?:\S+\s+)*(?:start|stop|restart|reload|enable|disable|mask|"
+    r"unmask|daemon-reload)|service|rm|rmdir|mv|cp|ln|install|chmod|chown|useradd|userdel|usermod|groupadd|"
+    r"groupdel|passwd|hostnamectl\s+set-\S+|hostname\s+(?!-)\S+|update-alternatives|"
+    r"ip\s+(?:\S+\s+)*(?:add|del|delete|set|flush|replace)|ifup|ifdown|nmcli|mount|umount|reboot|shutdown|"
+    r"make\s+install|tee|sed\s+-i|"
+    # Builtins and tools that change the shell's environment (which python, pip list, node --version, ...)
+    r"cd|pushd|popd|source|export|unset|alias|hash|deactivate|nvm\s+(?:use|install|alias)|"
+    r"conda\s+(?:activate|deactivate|install)|pyenv\s+(?:shell|local|global))\b"
+    r"|" + _CMD_START + r"\.\s+\S"
+    r"|>>?\s*/(?:etc|usr|opt|var|lib|bin|sbin|boot)/"
+)
+
+_SAFE = [re.compile(rf"(sudo\s+)?({p})({PIPE_FILTER})*") for p in READ_ONLY_COMMANDS]
+_SHELL_META = re.compile(r"[;&`<>]|\$\(|\|\|")
+
+
+def normalize(cmd):
+    return re.sub(r"\s+", " ", cmd.strip())
+
+
+def is_probe(cmd):
+    cmd = normalize(cmd)
+    if _SHELL_META.search(cmd) or MUTATING_RE.search(cmd):
+        return False
+    return any(p.fullmatch(cmd) for p in _SAFE)
+
+
+def is_mutating(cmd):
+    cmd = normalize(cmd)
+    if is_probe(cmd):
+        return False
+    # sudo with anything that is not a probe is presumed to change the system
+    return bool(MUTATING_RE.search(cmd) or re.search(r"(^|[;&|(]\s*)sudo\b", cmd))
+
+
+class ProbeCache:
+    def __init__(self, path=PROBE_CACHE_FILE, ttl=PROBE_TTL, host=None):
+        self.ttl = ttl
+        self.host = host or socket.gethostname()
+        self.hits = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("DROP TABLE IF EXISTS probes")  # old layout, keyed without the shell's context
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS probe_results ("
+            " host TEXT NOT NULL, context TEXT NOT NULL, cmd TEXT NOT NULL, output TEXT NOT NULL,"
+            " created REAL NOT NULL, PRIMARY KEY (host, context, cmd))"
+        )
+
+    def get(self, cmd, context=""):
+        """(output, age in seconds) of a probe cached in the same shell context, or None."""
+        if not is_probe(cmd):
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT output, created FROM probe_results WHERE host = ? AND context = ?"
+                                   " AND cmd = ?", (self.host, context, normalize(cmd))).fetchone()
+            if not row or row[1] + self.ttl <= now:
+                return None
+            self.hits += 1
+            return row[0], now - row[1]
+
+    def record(self, cmd, output, exit_code, limit=None, context=""):
+        """Remember a successful probe, or clear the host's probes after a mutating command."""
+        if is_probe(cmd):
+            if exit_code == 0 and not limit:
+                with self._lock:
+                    self._db.execute("INSERT OR REPLACE INTO probe_results (host, context, cmd, output, created)"
+                                     " VALUES (?, ?, ?, ?, ?)", (self.host, context, normalize(cmd), output, time.time()))
+        elif is_mutating(cmd):
+            self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._db.execute("DELETE FROM probe_results WHERE host = ?", (self.host,))
+
+
+_cache = None
+
+
+def get_probe_cache():
+    """The process-wide probe cache, or None when it is off or unusable."""
+    global _cache
+    if not PROBE_CACHE:
+        return None
+    if _cache is None:
+        try:
+            _cache = ProbeCache()
+        except (OSError, sqlite3.Error):
+            return None
+    return _cache
+
+
+def report_stats():
+    """Print how many commands this session answered from the cache, if any."""
+    if _cache is not None and _cache.hits:
+        print(f"[INFO] Probe cache: {_cache.hits} hits (commands answered without running them)")
+
+
+def label(output, age):
+    minutes = int(age // 60)
+    when = f"{minutes} min ago" if minutes else "moments ago"
+    return (f"[Cached result: this exact read-only command already ran in this directory on this host {when} "
+            f"and nothing has changed since. Use this output instead of running it again.]\n{output}")
@@ -0,0 +1,195 @@
+"""
+Client-side rate limiting shared by every backend.
+
+Each (backend, model) pair gets a token bucket sized from RATE_LIMITS
+(requests per minute) and corrected from the server's x-ratelimit-*
+headers once we see them: a lower request limit slows the bucket down (a
+limit never speeds it up, since the headers don't say whether it is per
+minute or per day) and an exhausted quota blocks until its reset. acquire() blocks until the bucket has room, so
+requests queue instead of tripping the quota. When the server still says
+429, rate_limited() honours its Retry-After (or reset) header and otherwise
+backs off exponentially with full jitter; the next acquire() waits it out.
+"""
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import tracing
+
+# Requests per minute per (backend, model); None means no limit (local models)
+RATE_LIMITS = {
+    "openai": 500,
+    "openrouter": 20,   # free-tier models
+    "duckai": 20,
+    "ollama-chat": None,
+    "ollama-generate": None,
+}
+DEFAULT_RPM = 60
+BURST = 1                   # requests that may go out back to back (above 1 can trip sliding windows)
+HEADROOM = 0.95             # run at this share of a quota learned from headers
+BACKOFF_BASE = 1.0          # seconds, doubled per consecutive 429
+BACKOFF_CAP = 60.0          # longest single backoff
+MAX_BACKOFF = 600.0         # consecutive backoff after which a request gives up
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_delay(value, now=None):
+    """
+    Seconds to wait from a Retry-After / x-ratelimit-reset value: plain
+    seconds, "1m30s"/"250ms" durations, epoch timestamps (s or ms) or an
+    HTTP date. None if it can't be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    now = time.time() if now is None else now
+    try:
+        number = float(value)
+    except ValueError:
+        parts = DURATION_RE.findall(value)
+        if parts and "".join(n + u for n, u in parts) == value.replace(" ", ""):
+            return sum(float(n) * DURATION_UNITS[u] for n, u in parts)
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - now, 0.0)
+        except (TypeError, ValueError):
+            return None
+    if number > 1e12:       # epoch milliseconds (OpenRouter)
+        return max(number / 1000 - now, 0.0)
+    if number > 1e9:        # epoch seconds
+        return max(number - now, 0.0)
+    return max(number, 0.0)
+
+
+def _header(headers, *names):
+    if not headers:
+        return None
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class RateLimiter:
+    def __init__(self, rpm=DEFAULT_RPM, burst=BURST, name=""):
+        self.name = name
+        self.unlimited = rpm is None
+        self.rate = (rpm or DEFAULT_RPM) / 60.0   # tokens per second
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self.failures = 0           # consecutive 429s
+        self.backoff_total = 0.0    # seconds of backoff since the last success
+        self.waited = 0.0           # total seconds spent queued, for reporting
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Block until a request may go out; returns the seconds waited."""
+        if self.unlimited and not self.blocked_until:
+            return 0.0
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.unlimited or self.tokens >= 1:
+                        if not self.unlimited:
+                            self.tokens -= 1
+                        break
+                    wait = (1 - self.tokens) / self.rate
+                self._cond.wait(wait)
+        waited = time.monotonic() - start
+        self.waited += waited
+        if waited > 0.001:
+            tracing.record("backoff", waited, limiter=self.name)
+        return waited
+
+    def succeeded(self, headers=None):
+        """Reset the backoff and learn the quota from x-ratelimit-* headers."""
+        with self._cond:
+            self.failures = 0
+            self.backoff_total = 0.0
+            self._learn(headers)
+
+    def rate_limited(self, headers=None):
+        """
+        Record a 429. Returns the delay before the next attempt, or None once
+        MAX_BACKOFF seconds of consecutive backoff have gone by (give up).
+        """
+        with self._cond:
+            delay = parse_delay(_header(headers, "retry-after", "Retry-After"))
+            if delay is None:
+                delay = parse_delay(_header(headers, "x-ratelimit-reset-requests", "X-RateLimit-Reset",
+                                            "x-ratelimit-reset"))
+            if delay is None:
+                # Full jitter: spread retries so queued callers don't stampede together
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** self.failures))
+            self.failures += 1
+            self.backoff_total += delay
+            if self.backoff_total > MAX_BACKOFF:
+                return None
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self._learn(headers)
+            self._cond.notify_all()
+            return delay
+
+    def wait_time(self):
+        """Seconds until the next request may go out."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(self.blocked_until - now, 0.0)
+            if not self.unlimited and self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            return wait
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _learn(self, headers):
+        limit = _header(headers, "x-ratelimit-limit-requests", "X-RateLimit-Limit", "x-ratelimit-limit")
+        remaining = _header(headers, "x-ratelimit-remaining-requests", "X-RateLimit-Remaining",
+                            "x-ratelimit-remaining")
+        reset = parse_delay(_header(headers, "x-ratelimit-reset-requests", "X-RateLimit-Reset",
+                                    "x-ratelimit-reset"))
+        try:
+            if limit is not None:
+                # Read as per minute, which is the shortest window providers use; a per-day
+                # limit then comes out faster than RATE_LIMITS and is ignored
+                self.rate = min(self.rate, float(limit) / 60.0 * HEADROOM)
+                self.unlimited = False
+            if remaining is not None and float(remaining) < 1 and reset:
+                self.tokens = 0.0
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            elif remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+        except ValueError:
+            pass
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(backend, model=None):
+    """The shared limiter for (backend, model), created from RATE_LIMITS on first use."""
+    key = (backend, model)
+    with _registry_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(RATE_LIMITS.get(backend, DEFAULT_RPM), name=f"{backend}/{model}")
+        return _limiters[key]
+
+
+def total_wait():
+    """Seconds every limiter has spent holding requests back this session."""
+    return sum(l.waited for l in _limiters.values())
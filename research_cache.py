@@ -0,0 +1,124 @@
+"""
+On-disk cache for the research lookups of deepseek_shell.py (TOOL_PAGE:
+and WEB_SEARCH: directives).
+
+Results are stored in SQLite keyed by (kind, tool name or normalized
+query) and reused for the kind's TTL, so asking for the same tool page or
+search again is instant. When a refresh fails (no network, rate limited)
+the last stored result is served instead, marked as stale. Empty results
+are never stored: a search that finds nothing is often a transient
+failure, and caching it would hide the real results for a whole TTL. lookup_many()
+resolves every directive of one reply concurrently.
+
+Tool pages can also come from TOOL_PAGES_DIR, a local copy of
+kali.org/tools (e.g. `wget -r -np https://www.kali.org/tools/`), read
+before the network is tried: <dir>/<tool>.txt, <dir>/<tool>.html or
+<dir>/<tool>/index.html.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RESEARCH_CACHE_FILE = os.path.expanduser("~/.shell_cache/research.sqlite3")
+TOOL_PAGES_DIR = os.path.expanduser("~/.shell_cache/kali_tools")  # offline tool pages, optional
+TTL = {
+    "tool_page": 30 * 24 * 3600,    # tool documentation barely changes
+    "web_search": 24 * 3600,
+}
+RESEARCH_WORKERS = 4                # lookups of one reply fetched at the same time
+NO_RESULTS = "No results found."    # shown for an empty result (which is not cached)
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query.strip().strip("\"'`.").lower())
+
+
+def local_tool_page(toolname, directory=TOOL_PAGES_DIR):
+    """(path, text) of an offline copy of the tool's page, or None."""
+    for rel in (f"{toolname}.txt", f"{toolname}.html", os.path.join(toolname, "index.html")):
+        path = os.path.join(directory, rel)
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                return path, f.read()
+    return None
+
+
+class ResearchCache:
+    def __init__(self, path=RESEARCH_CACHE_FILE):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS research ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, text TEXT NOT NULL, created REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+
+    def get(self, kind, key):
+        """(text, age in seconds) or None."""
+        with self._lock:
+            row = self._db.execute("SELECT text, created FROM research WHERE kind = ? AND key = ?",
+                                   (kind, key)).fetchone()
+        return (row[0], time.time() - row[1]) if row else None
+
+    def put(self, kind, key, text):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO research (kind, key, text, created) VALUES (?, ?, ?, ?)",
+                             (kind, key, text, time.time()))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_research_cache():
+    """The process-wide cache, or None if its file can't be opened."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ResearchCache()
+            except (OSError, sqlite3.Error):
+                return None
+        return _cache
+
+
+def lookup(kind, key, fetch):
+    """
+    fetch() -> text, through the cache. A fresh entry is returned as is; a
+    failed or empty fetch falls back to a stale entry, or to an error
+    message / NO_RESULTS.
+    """
+    cache = get_research_cache()
+    hit = cache.get(kind, key) if cache else None
+    if hit and hit[1] < TTL.get(kind, 0):
+        print(f"[INFO] Research cache hit: {kind} {key}")
+        return hit[0]
+    try:
+        text = fetch()
+    except Exception as e:
+        if hit:
+            print(f"[WARN] {kind} {key}: {e}; using the copy from {hit[1] / 3600:.0f}h ago")
+            return f"{hit[0]}\n(stale: cached {hit[1] / 3600:.0f}h ago, refresh failed)"
+        return f"Lookup failed: {e}"
+    if not text or not text.strip():
+        if hit:
+            print(f"[WARN] {kind} {key}: nothing found; using the copy from {hit[1] / 3600:.0f}h ago")
+            return f"{hit[0]}\n(stale: cached {hit[1] / 3600:.0f}h ago, refresh found nothing)"
+        return NO_RESULTS
+    if cache:
+        cache.put(kind, key, text)
+    return text
+
+
+def lookup_many(requests):
+    """[(kind, key, fetch), ...] -> texts in the same order, fetched concurrently."""
+    if len(requests) == 1:
+        return [lookup(*requests[0])]
+    with ThreadPoolExecutor(max_workers=RESEARCH_WORKERS) as pool:
+        return list(pool.map(lambda request: lookup(*request), requests))
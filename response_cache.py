@@ -0,0 +1,190 @@
+"""
+Optional on-disk cache of LLM replies, shared by every backend.
+
+Replies are keyed by (backend, model, temperature, hash of the
+task-local conversation) and stored in SQLite. The task-local conversation
+is the system prompt plus the messages since the newest "Task: " turn,
+without the text recalled in front of user turns: the window also carries
+the tail of earlier sessions and turns recalled from the whole history,
+which differ every time a task is replayed. Entries expire after TTL seconds
+and the least recently used ones are evicted once the cache grows past
+MAX_BYTES. Only low-temperature calls are cached (TEMPERATURE <=
+MAX_TEMPERATURE) since those replies are close to deterministic anyway;
+replaying a known task then costs a lookup per step instead of a model call.
+
+Bypass with `python3 -m assistant --no-cache ...` or ASSISTANT_NO_CACHE=1.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import tracing
+from context_window import TASK_PREFIX, message_tokens, strip_recall
+from output_compactor import estimate_tokens
+
+CACHE_FILE = os.path.expanduser("~/.shell_cache/responses.sqlite3")
+ENABLED = True
+MAX_TEMPERATURE = 0.2
+TTL = 7 * 24 * 3600        # seconds an entry stays valid
+MAX_BYTES = 50 << 20       # total reply bytes kept before LRU eviction
+BYPASS = bool(os.environ.get("ASSISTANT_NO_CACHE"))
+
+
+def task_messages(messages):
+    """The system prompt plus the messages since the newest Task: turn, recalled text removed."""
+    messages = [{**m, "content": strip_recall(m.get("content") or "")} if m.get("role") == "user" else m
+                for m in messages]
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user" and messages[i]["content"].startswith(TASK_PREFIX):
+            system = [messages[0]] if i > 0 and messages[0].get("role") == "system" else []
+            return system + messages[i:]
+    # The task turn has left the window (or the session summary replaced it)
+    return messages
+
+
+def cache_key(backend, model, temperature, messages):
+    payload = json.dumps([backend, model, temperature, task_messages(messages)], sort_keys=True,
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, ttl=TTL, max_bytes=MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, reply TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT reply, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and row[1] + self.ttl > now:
+                self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                self._count("hits")
+                return row[0]
+            if row:
+                self._delete(key)
+            self.misses += 1
+            self._count("misses")
+            return None
+
+    def put(self, key, reply):
+        now = time.time()
+        size = len(reply.encode("utf-8"))
+        with self._lock:
+            self._delete(key)
+            self._db.execute(
+                "INSERT INTO responses (key, reply, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, reply, size, now, now),
+            )
+            self._total += size
+            self._evict()
+
+    def counters(self):
+        """Lifetime hit/miss counts across sessions."""
+        with self._lock:
+            return dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._total = 0
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _count(self, name):
+        self._db.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+        )
+
+    def _delete(self, key):
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total -= row[0]
+
+    def _evict(self):
+        # Oldest-used first until we are back under the cap
+        if self._total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if self._total <= self.max_bytes:
+                break
+            victims.append((key,))
+            self._total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+
+_cache = None
+
+
+def get_cache():
+    """The process-wide cache, or None when caching is off or bypassed."""
+    global _cache
+    if not ENABLED or BYPASS:
+        return None
+    if _cache is None:
+        try:
+            _cache = ResponseCache()
+        except (OSError, sqlite3.Error):
+            return None
+    return _cache
+
+
+def cached_completion(backend, model, temperature, messages, call, on_token=None):
+    """
+    Return call()'s (reply, error) through the cache. On a hit the cached
+    reply is echoed through on_token in one piece and call() is skipped.
+    Every call is traced as an "llm_call" span with estimated token counts.
+    """
+    with tracing.span("llm_call", backend=backend, model=model, cached=False) as sp:
+        sp["prompt_tokens"] = sum(message_tokens(m) for m in messages if isinstance(m, dict))
+        reply, error = _cached(backend, model, temperature, messages, call, on_token, sp)
+        sp["completion_tokens"] = estimate_tokens(reply or "")
+        if error:
+            sp["error"] = str(error)[:200]
+        return reply, error
+
+
+def _cached(backend, model, temperature, messages, call, on_token, sp):
+    cache = get_cache() if temperature <= MAX_TEMPERATURE else None
+    if cache is None:
+        return call()
+    key = cache_key(backend, model, temperature, messages)
+    reply = cache.get(key)
+    if reply is not None:
+        sp["cached"] = True
+        if on_token:
+            on_token(reply)
+        return reply, None
+    reply, error = call()
+    if reply and not error:
+        cache.put(key, reply)
+    return reply, error
+
+
+def report_stats():
+    """Print this session's hit/miss counts if the cache was used at all."""
+    if _cache is not None and (_cache.hits or _cache.misses):
+        print(f"[INFO] Response cache: {_cache.hits} hits, {_cache.misses} misses")
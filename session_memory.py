@@ -0,0 +1,212 @@
+"""
+Rolling compaction of a long-running session (used by deepseek_shell.py).
+
+Once the session passes its token limit, the oldest turns are appended
+verbatim to an archive file and folded into a structured summary message
+that sits right after the system prompt. The summary is built from the
+turns themselves, not by asking the model, so nothing in it is invented:
+
+  - hosts and IPs that commands were pointed at
+  - open ports as nmap-style "22/tcp open ssh ..." lines
+  - whether credentials were found, with the lines that said so
+  - NOTE: lines, verbatim
+  - the most recent commands and how they ended
+
+Every list is capped (MAX_SUMMARY_*): past the cap the oldest entries are
+dropped and only counted, like commands, since the archive has them all.
+The rendered summary is also cut to SUMMARY_TOKEN_BUDGET, so a scan of a
+whole subnet cannot make it grow with the session.
+
+Compaction goes down to half the limit, so the conversation prefix stays
+stable (and cacheable by Ollama) for many turns between compactions.
+"""
+import json
+import re
+import time
+
+from context_window import message_tokens
+from dns_resolver import HOST_RE, looks_local
+from output_compactor import estimate_tokens
+
+SESSION_TOKEN_LIMIT = 6000   # compact once the session is bigger than this
+KEEP_RECENT_SHARE = 0.5      # share of the limit kept as raw recent turns
+MIN_RECENT = 4               # never fold the last few messages
+MAX_SUMMARY_COMMANDS = 30    # older commands are only counted; the archive has them
+MAX_SUMMARY_HOSTS = 40       # the same goes for hosts,
+MAX_SUMMARY_PORTS = 60       # open-port lines,
+MAX_SUMMARY_CREDENTIALS = 20 # credential lines
+MAX_SUMMARY_NOTES = 40       # and NOTE: lines
+MAX_FACT_CHARS = 200         # one summary line at most
+SUMMARY_TOKEN_BUDGET = 1500  # the rendered summary is cut to this, oldest entries first
+SUMMARY_HEADER = "SESSION SUMMARY (older turns were archived; these facts are verbatim):"
+
+IPV4_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}(?:/\d{1,2})?\b")
+PORT_RE = re.compile(r"^\s*(\d{1,5})/(tcp|udp)\s+open\s+.*$", re.MULTILINE)
+CRED_RE = re.compile(
+    r"^.*(login:\s*\S+\s+password:\s*\S+"            # hydra / medusa hits
+    r"|valid credentials|login successful|credentials? found|password found"
+    r"|\[\+\].*(password|credential)).*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+class SessionFacts:
+    LIMITS = {"hosts": MAX_SUMMARY_HOSTS, "ports": MAX_SUMMARY_PORTS, "credentials": MAX_SUMMARY_CREDENTIALS,
+              "notes": MAX_SUMMARY_NOTES, "commands": MAX_SUMMARY_COMMANDS}
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.hosts = list(data.get("hosts", []))
+        self.ports = dict(data.get("ports", {}))     # "host 22/tcp" -> nmap line
+        self.credentials = list(data.get("credentials", []))
+        self.notes = list(data.get("notes", []))
+        self.commands = list(data.get("commands", []))
+        # Entries dropped per list; sessions saved before the other caps only counted commands
+        self.omitted = dict.fromkeys(self.LIMITS, 0)
+        self.omitted.update(data.get("omitted", {}))
+        self.omitted["commands"] += data.get("commands_omitted", 0)
+        self.archived = data.get("archived", 0)
+        for name in self.LIMITS:
+            self._cap(name)
+
+    @property
+    def credentials_found(self):
+        return bool(self.credentials)
+
+    def to_dict(self):
+        return {"hosts": self.hosts, "ports": self.ports, "credentials": self.credentials,
+                "notes": self.notes, "commands": self.commands,
+                "omitted": self.omitted, "archived": self.archived}
+
+    def absorb(self, msg):
+        """Pull facts out of one message that is about to be archived."""
+        text = msg.get("content", "")
+        self.archived += 1
+        if msg.get("role") == "assistant":
+            for line in text.splitlines():
+                if line.strip().upper().startswith("NOTE:"):
+                    self._add(self.notes, line.strip())
+            self._cap("notes")
+            return
+        cmd = text.split("\n", 1)[0][len("Command: "):] if text.startswith("Command: ") else ""
+        hosts = self._hosts(cmd) if cmd else []
+        for host in hosts:
+            self._add(self.hosts, host)
+        if cmd:
+            status = "failed" if re.search(r"\(exit code \d+\)|Command killed", text) else "ok"
+            self.commands.append(f"{cmd}  [{status}]")
+        target = hosts[-1] if hosts else "?"
+        for m in PORT_RE.finditer(text):
+            self.ports.setdefault(f"{target} {m.group(1)}/{m.group(2)}", m.group(0).strip())
+        for m in CRED_RE.finditer(text):
+            self._add(self.credentials, m.group(0).strip())
+        for name in ("hosts", "commands", "ports", "credentials"):
+            self._cap(name)
+
+    @property
+    def commands_omitted(self):
+        return self.omitted["commands"]
+
+    def render(self, budget=SUMMARY_TOKEN_BUDGET):
+        """The summary message, cut to `budget` tokens by leaving out the oldest entries."""
+        items = {
+            "hosts": list(self.hosts),
+            "ports": [f"  {key.split(' ', 1)[0]}: {line}" for key, line in self.ports.items()],
+            "credentials": [f"  {line}" for line in self.credentials],
+            "notes": [f"  {note}" for note in self.notes],
+            "commands": [f"  {c}" for c in self.commands],
+        }
+        items = {name: [clip(line) for line in lines] for name, lines in items.items()}
+        shown = {name: 0 for name in items}
+        text = self._render(items, shown)
+        # Commands go first, then the biggest of the other lists; the archive keeps everything
+        while estimate_tokens(text) > budget:
+            name = "commands" if items["commands"] else max(items, key=lambda n: len(items[n]))
+            if not items[name]:
+                break
+            items[name].pop(0)
+            shown[name] += 1
+            text = self._render(items, shown)
+        return text
+
+    def _render(self, items, cut):
+        def earlier(name):
+            n = self.omitted[name] + cut[name]
+            return f" ({n} earlier ones omitted)" if n else ""
+
+        lines = [SUMMARY_HEADER]
+        lines.append("Hosts" + earlier("hosts") + ": " + (", ".join(items["hosts"]) or "none yet"))
+        if items["ports"]:
+            lines.append(f"Open ports{earlier('ports')}:")
+            lines += items["ports"]
+        lines.append(f"Credentials found: {'YES' if self.credentials_found else 'no'}{earlier('credentials')}")
+        lines += items["credentials"]
+        if items["notes"]:
+            lines.append(f"Notes{earlier('notes')}:")
+            lines += items["notes"]
+        if items["commands"]:
+            lines.append(f"Commands already run{earlier('commands')}:")
+            lines += items["commands"]
+        return "\n".join(lines)
+
+    # ─── HELPERS ─────────────────────────────────────────────────────────────
+    def _cap(self, name):
+        items = getattr(self, name)
+        while len(items) > self.LIMITS[name]:
+            if isinstance(items, dict):
+                del items[next(iter(items))]
+            else:
+                items.pop(0)
+            self.omitted[name] += 1
+
+    @staticmethod
+    def _add(items, value):
+        if value not in items:
+            items.append(value)
+
+    @staticmethod
+    def _hosts(cmd):
+        found = IPV4_RE.findall(cmd)
+        found += [m.group(1) for m in HOST_RE.finditer(cmd)
+                  if not IPV4_RE.fullmatch(m.group(1)) and not looks_local(cmd, m)]
+        return found
+
+
+def clip(line, limit=MAX_FACT_CHARS):
+    return line if len(line) <= limit else line[:limit] + " ..."
+
+
+def is_summary(msg):
+    return msg.get("role") == "system" and msg.get("content", "").startswith(SUMMARY_HEADER)
+
+
+def compact_session(history, facts, archive_path, limit=SESSION_TOKEN_LIMIT):
+    """
+    Return history unchanged while it fits `limit` tokens. Otherwise archive
+    the oldest turns to archive_path (JSONL), fold them into `facts` and
+    return [system, summary, recent turns...] at about half the limit.
+    """
+    if sum(message_tokens(m) for m in history) <= limit:
+        return history
+    head = history[:1]
+    body = [m for m in history[1:] if not is_summary(m)]
+
+    keep_budget = int(limit * KEEP_RECENT_SHARE)
+    cut, used = len(body), 0
+    while cut > 0:
+        cost = message_tokens(body[cut - 1])
+        if len(body) - cut >= MIN_RECENT and used + cost > keep_budget:
+            break
+        used += cost
+        cut -= 1
+    old, recent = body[:cut], body[cut:]
+    if not old:
+        return history
+
+    with open(archive_path, "a", encoding="utf-8") as f:
+        stamp = time.time()
+        for msg in old:
+            f.write(json.dumps({"ts": stamp, **msg}, ensure_ascii=False) + "\n")
+    for msg in old:
+        facts.absorb(msg)
+    return head + [{"role": "system", "content": facts.render()}] + recent
@@ -0,0 +1,226 @@
+"""
+One long-lived bash process that runs every command of a session.
+
+Commands are written to bash's stdin and wrapped so that, when they finish,
+bash prints a per-command sentinel line carrying the exit code, working
+directory and the variables that decide which programs run (STATE_VARIABLES). Reading stops at the sentinel, so no process is forked per step
+and `cd`, exported variables and activated virtualenvs carry over from one
+command to the next.
+
+If a command runs past its deadline, goes quiet for too long or prints too
+much, the whole worker (bash and everything it started, via killpg) is killed
+and a fresh one is started in the last known working directory; the caller is
+told which limit fired.
+"""
+import asyncio
+import atexit
+import codecs
+import hashlib
+import os
+import shlex
+import signal
+import subprocess
+import time
+import uuid
+
+SHELL = ["bash", "--noprofile", "--norc"]
+HANG_TIMEOUT = 600   # default wall-clock deadline in seconds
+READ_SIZE = 65536
+STATE_VARIABLES = ("PATH", "VIRTUAL_ENV", "CONDA_PREFIX")  # reported with every sentinel
+FIELD_SEP = "\x1f"
+
+
+class ShellWorker:
+    def __init__(self, shell=SHELL, cwd=None, env=None):
+        self.shell = shell
+        self.cwd = cwd or os.getcwd()
+        self.env = env  # None: inherit ours
+        self.state = {}
+        self._proc = None
+        self._reset_state()
+
+    def start(self):
+        # Own session, so a hung command and all of its children die with the worker
+        self._proc = subprocess.Popen(
+            self.shell,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=self.cwd if os.path.isdir(self.cwd) else None,
+            env=self.env,
+            start_new_session=True,
+        )
+        self._reset_state()
+
+    def context(self):
+        """
+        Short hash of the working directory and STATE_VARIABLES as of the
+        last command, i.e. what `which python` or `pip list` would depend on.
+        """
+        text = FIELD_SEP.join([self.cwd] + [self.state.get(name, "") for name in STATE_VARIABLES])
+        return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()[:16]
+
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def close(self):
+        if self._proc is None:
+            return
+        if self._proc.poll() is None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self._proc.wait()
+        for stream in (self._proc.stdin, self._proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self._proc = None
+
+    def _reset_state(self):
+        # A fresh shell has the variables it was started with
+        env = os.environ if self.env is None else self.env
+        self.state = {name: env.get(name, "") for name in STATE_VARIABLES}
+
+    async def environment(self):
+        """The shell's exported variables as a dict, or None if they can't be read."""
+        out, code, _ = await self.run_async("env -0", timeout=5)
+        if code != 0:
+            return None
+        env = {}
+        for entry in out.split("\0"):
+            name, sep, value = entry.partition("=")
+            if sep and name:
+                env[name] = value
+        return env
+
+    def run(self, cmd, on_output=None, timeout=HANG_TIMEOUT, idle_timeout=None, max_bytes=None):
+        """Blocking wrapper around run_async() for callers without an event loop."""
+        return asyncio.run(self.run_async(cmd, on_output, timeout, idle_timeout, max_bytes))
+
+    async def run_async(self, cmd, on_output=None, timeout=HANG_TIMEOUT, idle_timeout=None, max_bytes=None):
+        """
+        Run cmd in the worker and return (output, exit_code, limit).
+
+        timeout is the wall-clock deadline, idle_timeout the longest stretch
+        without any output and max_bytes the most output kept. When one of
+        them is hit the worker's whole process group is killed, a fresh shell
+        is started in the last known directory, exit_code is None and limit
+        says which one fired; otherwise limit is None. on_output receives
+        output text as it arrives. Output is read through the event loop, so
+        other tasks keep running while the command does.
+        """
+        if not self.alive():
+            self.start()
+        token = f"__SHELL_WORKER_{uuid.uuid4().hex}__"
+        # eval keeps a syntax error in cmd from swallowing the sentinel; stdin
+        # is /dev/null so a command can never read the next command as input
+        script = (f"eval {shlex.quote(cmd)} < /dev/null\n"
+                  f"printf '%s %d' {token} \"$?\"; printf '\\037%s' \"$PWD\""
+                  + "".join(f" \"${{{name}-}}\"" for name in STATE_VARIABLES) + "; echo\n")
+        try:
+            self._proc.stdin.write(script.encode())
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            self.restart()
+            self._proc.stdin.write(script.encode())
+            self._proc.stdin.flush()
+
+        out = []
+        kept = 0
+
+        def emit(text):
+            nonlocal kept
+            if max_bytes is not None:
+                text = text.encode()[:max(max_bytes - kept, 0)].decode(errors="ignore")
+            if text:
+                out.append(text)
+                kept += len(text.encode())
+                if on_output:
+                    on_output(text)
+
+        def kill(limit):
+            emit(buf)
+            loop.remove_reader(fd)
+            self.restart()
+            return "".join(out), None, limit
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        fd = self._proc.stdout.fileno()
+        loop.add_reader(fd, lambda: chunks.put_nowait(os.read(fd, READ_SIZE)))
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        now = time.monotonic()
+        deadline = now + timeout if timeout else None
+        idle_deadline = now + idle_timeout if idle_timeout else None
+        seen = 0
+        buf = ""
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    return kill(f"ran longer than {timeout:g}s")
+                if idle_deadline is not None and now >= idle_deadline:
+                    return kill(f"printed nothing for {idle_timeout:g}s")
+                waits = [d - now for d in (deadline, idle_deadline) if d is not None]
+                try:
+                    data = await asyncio.wait_for(chunks.get(), min(waits) if waits else None)
+                except asyncio.TimeoutError:
+                    continue
+                if not data:
+                    # The command ended the shell itself (e.g. `exit`)
+                    emit(buf + decoder.decode(b"", final=True))
+                    code = self._proc.wait()
+                    loop.remove_reader(fd)
+                    self.restart()
+                    return "".join(out), code, None
+                if idle_timeout:
+                    idle_deadline = time.monotonic() + idle_timeout
+                seen += len(data)
+                buf += decoder.decode(data)
+
+                i = buf.find(token)
+                if i < 0:
+                    if max_bytes is not None and seen > max_bytes + len(token):
+                        return kill(f"printed more than {max_bytes} bytes")
+                    # Hold back enough to catch a sentinel split across reads
+                    keep = len(token)
+                    if len(buf) > keep:
+                        emit(buf[:-keep])
+                        buf = buf[-keep:]
+                    continue
+                emit(buf[:i])
+                status = buf[i + len(token):]
+                if "\n" not in status:
+                    buf = buf[i:]
+                    continue
+                code, *fields = status.split("\n", 1)[0].strip(" \r").split(FIELD_SEP)
+                if len(fields) == 1 + len(STATE_VARIABLES):
+                    self.cwd = fields[0] or self.cwd
+                    self.state = dict(zip(STATE_VARIABLES, fields[1:]))
+                return "".join(out), int(code), None
+        except asyncio.CancelledError:
+            # Interrupted mid-command: don't leave it running in the shared shell
+            loop.remove_reader(fd)
+            self.close()
+            raise
+        finally:
+            loop.remove_reader(fd)
+
+
+_worker = None
+
+
+def get_worker():
+    """The session's worker, started on first use and killed at exit."""
+    global _worker
+    if _worker is None:
+        _worker = ShellWorker()
+        atexit.register(_worker.close)
+    return _worker
@@ -0,0 +1,57 @@
+import os
+import subprocess
+
+import batch
+from batch import BatchTask, parse_tasks
+
+
+class FakeProcess:
+    def __init__(self, args, cwd, env, stdout, **kwargs):
+        FakeProcess.last = (args, cwd, env)
+        self.pid = os.getpid()
+        stdout.write("Executing Command: ls\n")
+
+    def wait(self, timeout=None):
+        return 0
+
+    def poll(self):
+        return 0
+
+
+def test_parse_tasks():
+    lines = ["# comment", "", "duckai: scan the lan", "install nginx", "nope: keep this"]
+    assert parse_tasks(lines, "openai", {"openai", "duckai"}) == [
+        ("duckai", "scan the lan"), ("openai", "install nginx"), ("openai", "nope: keep this")]
+
+
+def test_task_history_lives_in_its_workdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(subprocess, "Popen", FakeProcess)
+    tasks = [BatchTask(1, "openai", "install nginx", str(tmp_path / "run1")),
+             BatchTask(1, "openai", "install nginx", str(tmp_path / "run2"))]
+    paths = []
+    for task in tasks:
+        task.run()
+        args, cwd, env = FakeProcess.last
+        assert cwd == task.workdir and task.status == "ok" and task.commands == 1
+        assert os.path.dirname(env["ASSISTANT_HISTORY_FILE"]) == task.workdir
+        paths.append(env["ASSISTANT_HISTORY_FILE"])
+    # Same task and index in two runs: separate histories (and recall indexes)
+    assert paths[0] != paths[1]
+    assert str(tmp_path) in paths[0] and batch.REPO_DIR in env["PYTHONPATH"]
+
+
+def test_cancelled_task_stays_interrupted(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    real_popen = subprocess.Popen
+    monkeypatch.setattr(subprocess, "Popen", lambda args, **kwargs: real_popen(["sleep", "30"], **kwargs))
+    task = BatchTask(1, "openai", "long task", str(tmp_path / "run"))
+    thread = threading.Thread(target=task.run)
+    thread.start()
+    while task.proc is None:
+        time.sleep(0.01)
+    task.cancel()
+    thread.join(timeout=5)
+    # The killed child exits non-zero; that must not turn into "failed"
+    assert task.status == "interrupted" and task.proc.returncode != 0
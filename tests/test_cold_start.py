@@ -0,0 +1,43 @@
+"""Starting the tool must not pay for any backend's client library."""
+import os
+import subprocess
+import sys
+import time
+
+from conftest import REPO_DIR
+
+HEAVY_MODULES = ("openai", "bs4", "duckduckgo_search", "requests")
+IMPORT_BUDGET_US = 50_000   # imports done by `assistant --list` itself, after interpreter startup
+WALL_BUDGET = 2.0           # seconds for the whole process, generous for slow CI machines
+
+
+def import_times(args):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m", "assistant", *args], cwd=REPO_DIR, env=env,
+                          capture_output=True, text=True, timeout=30)
+    wall = time.perf_counter() - start
+    assert proc.returncode == 0, proc.stderr
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.rstrip(), int(cumulative)))
+    return rows, wall
+
+
+def test_list_imports_no_backend_libraries():
+    rows, _ = import_times(["--list"])
+    imported = {name.strip().split(".")[0] for name, _ in rows}
+    assert not imported & set(HEAVY_MODULES)
+
+
+def test_list_cold_start_is_small():
+    rows, wall = import_times(["--list"])
+    top_level = [(name.strip(), us) for name, us in rows if not name.startswith("  ")]
+    names = [name for name, _ in top_level]
+    # Everything up to and including `site` is the interpreter's own startup
+    after_site = top_level[names.index("site") + 1:] if "site" in names else top_level
+    assert sum(us for _, us in after_site) < IMPORT_BUDGET_US
+    assert wall < WALL_BUDGET
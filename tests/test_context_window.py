@@ -0,0 +1,44 @@
+from context_window import ContextWindow, message_tokens
+
+
+def msg(role, words):
+    return {"role": role, "content": " ".join(["word"] * words)}
+
+
+def total(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+def test_window_is_newest_messages_within_budget():
+    window = ContextWindow("system prompt", budget=200)
+    history = [msg("user" if i % 2 == 0 else "assistant", 20) for i in range(30)]
+    for m in history:
+        window.append(m)
+    sent = window.messages()
+    assert sent[0]["role"] == "system"
+    assert sent[1:] == history[-len(sent) + 1:]
+    assert total(sent) <= 200
+    # One more message would not have fit
+    assert total(sent) + message_tokens(history[-len(sent)]) > 200
+    assert window.window_tokens == total(sent)
+
+
+def test_oversized_newest_message_is_still_sent():
+    window = ContextWindow("system prompt", budget=50, messages=[msg("user", 10), msg("user", 500)])
+    assert window.messages()[1:] == [msg("user", 500)]
+
+
+def test_set_budget_grows_and_shrinks():
+    history = [msg("user", 20) for _ in range(20)]
+    window = ContextWindow("system prompt", budget=100, messages=history)
+    small = len(window.messages())
+    window.set_budget(1000)
+    assert len(window.messages()) > small
+    window.set_budget(100)
+    assert len(window.messages()) == small
+
+
+def test_list_like_access():
+    history = [msg("user", 1), msg("assistant", 2)]
+    window = ContextWindow("s", messages=history)
+    assert len(window) == 2 and window[-1] == history[-1] and list(window) == history
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from dns_resolver import Resolver
+
+
+class StubLookup:
+    """Stands in for socket.gethostbyname: fixed answers, optional delay, call log."""
+
+    def __init__(self, answers, delay=0.0):
+        self.answers = answers
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, host):
+        with self._lock:
+            self.calls.append(host)
+        time.sleep(self.delay)
+        if host not in self.answers:
+            raise OSError("Name or service not known")
+        return self.answers[host]
+
+
+def test_rewrites_hostnames_and_skips_files():
+    stub = StubLookup({"example.com": "93.184.216.34"})
+    resolver = Resolver(lookup=stub)
+    out = resolver.rewrite("curl http://example.com/x && cat /etc/nginx/nginx.conf notes.txt")
+    assert out == "curl http://93.184.216.34/x && cat /etc/nginx/nginx.conf notes.txt"
+    assert stub.calls == ["example.com"]
+
+
+def test_answers_and_failures_are_cached():
+    stub = StubLookup({"example.com": "93.184.216.34"})
+    resolver = Resolver(lookup=stub)
+    for _ in range(3):
+        resolver.rewrite("ping -c1 example.com missing.invalid")
+    assert sorted(stub.calls) == ["example.com", "missing.invalid"]
+    assert resolver.rewrite("ping missing.invalid") == "ping missing.invalid"
+
+
+def test_lookups_run_concurrently_within_timeout():
+    stub = StubLookup({f"h{i}.example.com": f"10.0.0.{i}" for i in range(8)}, delay=0.3)
+    resolver = Resolver(lookup=stub, timeout=1.0)
+    start = time.monotonic()
+    result = resolver.resolve_many(f"h{i}.example.com" for i in range(8))
+    assert time.monotonic() - start < 1.0
+    assert result["h7.example.com"] == "10.0.0.7"
+
+
+def test_slow_lookup_gives_up_at_timeout():
+    resolver = Resolver(lookup=StubLookup({"slow.example.com": "10.0.0.1"}, delay=2.0), timeout=0.2)
+    start = time.monotonic()
+    assert resolver.resolve_many(["slow.example.com"]) == {"slow.example.com": None}
+    assert time.monotonic() - start < 1.0
+
+
+def test_hosts_file_fixture_wins_without_lookups(tmp_path):
+    hosts = tmp_path / "hosts"
+    hosts.write_text("127.0.0.1 localhost\n10.10.10.5 target.htb www.target.htb  # lab box\n")
+    stub = StubLookup({})
+    resolver = Resolver(lookup=stub, hosts_file=str(hosts))
+    assert resolver.rewrite("nmap -sV www.target.htb") == "nmap -sV 10.10.10.5"
+    assert stub.calls == []
+
+
+def test_tld_like_extensions_depend_on_position(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "notes.md").write_text("x")
+    answers = {"example.pl": "192.0.2.1", "foo.sh": "192.0.2.2", "notes.md": "192.0.2.3", "setup.py": "192.0.2.4"}
+    stub = StubLookup(answers)
+    resolver = Resolver(lookup=stub)
+    # Real ccTLDs in host positions are resolved
+    assert resolver.rewrite("ping -c 1 example.pl") == "ping -c 1 192.0.2.1"
+    assert resolver.rewrite("curl -sI foo.sh") == "curl -sI 192.0.2.2"
+    # Files: on disk, arguments of file commands, redirects and option values
+    for cmd in ("nmap example.com -oN notes.md", "bash foo.sh", "sudo python3 setup.py install",
+                "chmod +x foo.sh && ./foo.sh", "echo hi > foo.sh", "tool --script=foo.sh", "foo.sh --help"):
+        assert resolver.rewrite(cmd) == cmd
+    assert "notes.md" not in stub.calls and "setup.py" not in stub.calls
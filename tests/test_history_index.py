@@ -0,0 +1,73 @@
+from context_window import ContextWindow
+from history_index import HistoryIndex, history_recall
+from history_store import HistoryStore
+
+APT_LOCK = {"role": "user", "content": "Command: sudo apt install -y nmap\n"
+                                       "Output: E: Could not get lock /var/lib/dpkg/lock-frontend. It is held by process 42"}
+APT_FIX = {"role": "assistant", "content": "Another apt holds the lock, wait for it.\n"
+                                           "```bash\nwhile sudo fuser /var/lib/dpkg/lock-frontend; do sleep 5; done\n```"}
+
+
+def filler(i):
+    return [{"role": "user", "content": f"Command: echo {i}\nOutput: {i} " + "filler words here " * 20},
+            {"role": "assistant", "content": f"ok {i}"}]
+
+
+def test_sync_is_incremental_across_rotation(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"), background=False, max_bytes=2000, keep_segments=3)
+    index = HistoryIndex(store)
+    messages = [APT_LOCK, APT_FIX] + [m for i in range(40) for m in filler(i)]
+    added = 0
+    for n, msg in enumerate(messages):
+        store.append(msg)
+        if n % 7 == 0:
+            added += index.sync()   # often between a user message and its reply
+    added += index.sync()
+    assert added == index.count() == 41
+    assert len(store.segments()) == 4
+    assert index.sync() == 0
+    # Turns outlive the segment they were written to
+    assert not any("nmap" in open(p).read() for p in store.segments())
+    assert "fuser" in index.search("Could not get lock /var/lib/dpkg/lock-frontend")[0]
+
+
+def test_compaction_does_not_duplicate_turns(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"), background=False)
+    index = HistoryIndex(store)
+    for i in range(20):
+        for msg in filler(i):
+            store.append(msg)
+    index.sync()
+    store.compact(10)
+    assert index.sync() == 0 and index.count() == 20
+
+
+def test_search_skips_seen_turns_and_unrelated_ones(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"), background=False)
+    for msg in [APT_LOCK, APT_FIX] + [m for i in range(10) for m in filler(i)]:
+        store.append(msg)
+    index = HistoryIndex(store)
+    index.sync()
+    query = "Command: sudo apt-get install gobuster\nOutput: E: Could not get lock /var/lib/dpkg/lock-frontend"
+    assert len(index.search(query)) == 1
+    assert index.search(query, seen=[APT_LOCK["content"]]) == []
+    assert index.search("Command: uptime\nOutput: nothing in common") == []
+
+
+def test_context_window_recall_takes_tokens_from_the_window(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"), background=False)
+    old = [APT_LOCK, APT_FIX] + [m for i in range(40) for m in filler(i)]
+    for msg in old:
+        store.append(msg)
+    plain = ContextWindow("system", 2000, store.load_tail(50))
+    window = ContextWindow("system", 2000, store.load_tail(50), recall=history_recall(store))
+    new = {"role": "user", "content": "Command: sudo apt-get install gobuster\n"
+                                      "Output: E: Could not get lock /var/lib/dpkg/lock-frontend"}
+    for w in (plain, window):
+        w.append(new)
+    sent = window.messages()
+    assert sent[-1]["content"].startswith("Relevant turns from earlier sessions:")
+    assert "fuser" in sent[-1]["content"] and sent[-1]["content"].endswith(new["content"])
+    assert new["content"] == window[-1]["content"]          # history itself is untouched
+    assert len(sent) < len(plain.messages())
+    assert sum(len(m["content"]) for m in sent) <= sum(len(m["content"]) for m in plain.messages()) + 200
@@ -0,0 +1,79 @@
+import json
+
+import history_store
+from history_store import HistoryStore, tail_lines
+
+
+def msg(i):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+
+
+def test_tail_reads_last_messages(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"), background=False)
+    for i in range(100):
+        store.append(msg(i))
+    assert store.load_tail(3) == [msg(97), msg(98), msg(99)]
+    assert store.load_tail(0) == []
+    assert len(store.load_tail(1000)) == 100
+
+
+def test_background_writes_are_visible_after_flush(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"))
+    for i in range(20):
+        store.append(msg(i))
+    store.flush()
+    assert store.load_tail(20) == [msg(i) for i in range(20)]
+
+
+def test_rotation_keeps_segments_and_tail_spans_them(tmp_path):
+    path = str(tmp_path / "h.jsonl")
+    store = HistoryStore(path, background=False, max_bytes=500, keep_segments=2)
+    for i in range(200):
+        store.append(msg(i))
+    segments = store.segments()
+    assert segments[-1] == path and len(segments) == 3
+    assert not (tmp_path / "h.jsonl.3").exists()
+    # The tail reaches back into rotated segments, in order
+    tail = store.load_tail(30)
+    assert tail == [msg(i) for i in range(170, 200)]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / "h.jsonl"
+    path.write_text(json.dumps(msg(0)) + "\n" + json.dumps(msg(1)) + "\n" + '{"role": "us')
+    store = HistoryStore(str(path), background=False)
+    assert store.load_tail(5) == [msg(0), msg(1)]
+
+
+def test_tail_lines_small_blocks(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(b"".join(b"line %d\n" % i for i in range(50)))
+    assert tail_lines(str(path), 2, block=7) == [b"line 48", b"line 49"]
+
+
+def test_compact_keeps_last_messages(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.jsonl"), background=False, max_bytes=500, keep_segments=2)
+    for i in range(100):
+        store.append(msg(i))
+    store.compact(10)
+    assert store.segments() == [store.path]
+    assert store.load_tail(100) == [msg(i) for i in range(90, 100)]
+
+
+def test_legacy_json_is_imported_once(tmp_path):
+    legacy = tmp_path / "old.json"
+    legacy.write_text(json.dumps([msg(0), {"role": "system", "content": "x"}, msg(1)]))
+    store = HistoryStore(str(tmp_path / "h.jsonl"), legacy_path=str(legacy), background=False)
+    assert store.load_tail(10) == [msg(0), msg(1)]
+
+
+def test_history_file_override(tmp_path, monkeypatch):
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text(json.dumps([msg(0)]))
+    monkeypatch.setattr(history_store, "HISTORY_PATH", str(tmp_path / "task" / "history.jsonl"))
+    (tmp_path / "task").mkdir()
+    store = HistoryStore(str(tmp_path / "default.jsonl"), legacy_path=str(legacy), background=False)
+    store.append(msg(1))
+    assert store.path == str(tmp_path / "task" / "history.jsonl")
+    assert store.load_tail(10) == [msg(1)]  # the default history's legacy file is not imported
+    assert not (tmp_path / "default.jsonl").exists()
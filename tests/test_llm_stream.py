@@ -0,0 +1,117 @@
+import json
+
+import pytest
+import requests
+
+from llm_stream import StreamError, iter_ndjson, iter_sse, openai_delta, stream_reply
+
+
+class Pieces:
+    """A raw HTTP body that arrives in the given pieces; counts how many were read."""
+
+    def __init__(self, pieces):
+        self.pieces = [p.encode() if isinstance(p, str) else p for p in pieces]
+        self.read_count = 0
+        self.closed = False
+
+    def read(self, n=-1, **kwargs):
+        if self.read_count >= len(self.pieces):
+            return b""
+        self.read_count += 1
+        return self.pieces[self.read_count - 1]
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        pass
+
+
+def response(*pieces):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.raw = Pieces(pieces)
+    return resp
+
+
+class Chunks:
+    """An upstream iterator of text chunks that records whether it was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_closing_fence_split_across_chunks():
+    chunks = Chunks(["Next:\n```bash\nls -la\n`", "`", "`\nand more", " text"])
+    tokens = []
+    text, cut = stream_reply(chunks, tokens.append)
+    assert (text, cut) == ("Next:\n```bash\nls -la\n```", True)
+    assert "".join(tokens) == text
+    assert chunks.closed and next(chunks, None) == " text"   # the rest was never read
+
+
+def test_opener_arriving_in_pieces():
+    text, cut = stream_reply(Chunks(["``", "`ba", "sh\nwhoami", "\n``", "`", " trailing"]))
+    assert (text, cut) == ("```bash\nwhoami\n```", True)
+
+
+def test_no_bash_block():
+    chunks = Chunks(["The task ", "is done. ", "`inline` code only. TASK COMPLETE"])
+    tokens = []
+    text, cut = stream_reply(chunks, tokens.append)
+    assert (text, cut) == ("The task is done. `inline` code only. TASK COMPLETE", False)
+    assert "".join(tokens) == text and chunks.closed
+
+
+def test_closing_the_stream_closes_the_response():
+    body = [f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n"
+            for word in ["```bash\n", "id\n", "```", " never", " sent"]]
+    resp = response(*body)
+    text, cut = stream_reply(iter_sse(resp))
+    assert (text, cut) == ("```bash\nid\n```", True)
+    assert resp.raw.closed and resp.raw.read_count < len(body)
+
+
+def test_sse_lines_split_across_reads():
+    event = json.dumps({"choices": [{"delta": {"content": "héllo "}}]}, ensure_ascii=False).encode()
+    encoded = "data: ".encode() + event + b"\n\n: OPENROUTER PROCESSING\n\n"
+    # Split mid-keyword, mid-JSON and inside a multi-byte character
+    cut = encoded.index(b"\xc3") + 1
+    resp = response(encoded[:3], encoded[3:cut], encoded[cut:], b'data: {"choices": [{"delta": {"content": "world"}}]}',
+                    b"\n\ndata: [DONE]\n\n", b'data: {"choices": [{"delta": {"content": "late"}}]}\n\n')
+    assert list(iter_sse(resp, openai_delta)) == ["héllo ", "world"]
+
+
+def test_sse_error_event():
+    resp = response('data: {"error": {"message": "quota exceeded"}}\n\n')
+    with pytest.raises(StreamError, match="quota exceeded"):
+        list(iter_sse(resp))
+    assert resp.raw.closed
+
+
+def test_ndjson_lines_split_across_reads():
+    lines = "".join(json.dumps(obj) + "\n" for obj in [
+        {"message": {"content": "a"}, "done": False},
+        {"message": {"content": "b"}, "done": False},
+        {"message": {"content": ""}, "done": True},
+        {"message": {"content": "after done"}, "done": False},
+    ])
+    pieces = [lines[i:i + 7] for i in range(0, len(lines), 7)]
+    extract = lambda d: d.get("message", {}).get("content", "")
+    assert list(iter_ndjson(response(*pieces), extract)) == ["a", "b"]
+
+
+def test_ndjson_error():
+    resp = response('{"error": "model not found"}\n')
+    with pytest.raises(StreamError, match="model not found"):
+        list(iter_ndjson(resp, lambda d: d.get("response")))
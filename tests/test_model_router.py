@@ -0,0 +1,86 @@
+import os
+import time
+
+import model_router
+from model_router import ModelRouter
+
+
+def router(**kwargs):
+    return ModelRouter(["fast", "slow"], stats_file=None, **kwargs)
+
+
+def test_success_is_a_latency_sample():
+    r = router(hedge=False)
+    model, reply, error = r.race(lambda model, emit: ("ok", None, False))
+    assert (model, reply, error) == ("fast", "ok", None)
+    assert len(r.stats["fast"].samples) == 1
+
+
+def test_cache_hits_are_not_latency_samples():
+    r = router(hedge=False)
+    for _ in range(10):
+        assert r.race(lambda model, emit: ("cached", None, True))[1] == "cached"
+    assert r.stats["fast"].latency is None and not r.stats["fast"].samples
+
+
+def test_failure_puts_model_on_cooldown():
+    r = router(hedge=False)
+    model, reply, error = r.race(lambda model, emit: (None, "429", False), classify=lambda e: "rate_limit")
+    assert (model, error) == ("fast", "429")
+    assert r.ranked() == ["slow"]
+
+
+def streaming(delays, reply="ok"):
+    """call() that waits delays[model] before its first token, then finishes at once."""
+    def call(model, emit):
+        time.sleep(delays[model])
+        emit(reply)
+        return reply, None, False
+    return call
+
+
+def test_first_token_time_is_recorded():
+    r = router(hedge=False)
+    r.race(streaming({"fast": 0.05}), on_token=lambda token: None)
+    s = r.stats["fast"]
+    assert len(s.first_token_samples) == 1 and 0.04 <= s.first_token < 0.5
+    r.race(lambda model, emit: (emit("cached") or "cached", None, True), on_token=lambda token: None)
+    assert len(s.first_token_samples) == 1
+
+
+def test_streaming_hedges_on_time_to_first_token(monkeypatch):
+    monkeypatch.setattr(model_router, "MIN_HEDGE_DELAY", 0.05)
+    r = router()
+    s = r.stats["fast"]
+    s.latency = 0.1
+    s.first_token_samples.extend([0.05] * 10)   # usually starts within 50 ms
+    s.samples.extend([30.0] * 10)               # but long replies take 30 s in full
+    tokens = []
+    start = time.monotonic()
+    model, reply, error = r.race(streaming({"fast": 1.0, "slow": 0.0}), on_token=tokens.append)
+    assert (model, reply, error) == ("slow", "ok", None)
+    assert tokens == ["ok"] and time.monotonic() - start < 0.9
+
+
+def save_models(path, models, rounds):
+    for i in range(rounds):
+        r = ModelRouter(models, stats_file=path)
+        r.record_success(models[0], 1.0 + i)
+        r.save()
+
+
+def test_concurrent_saves_keep_every_model(tmp_path):
+    import json
+    import multiprocessing
+
+    path = str(tmp_path / "stats" / "model_stats.json")
+    procs = [multiprocessing.Process(target=save_models, args=(path, [f"model-{i}"], 20)) for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    with open(path) as f:
+        data = json.load(f)
+    assert sorted(data) == [f"model-{i}" for i in range(4)]
+    assert all(len(stats["samples"]) == 20 for stats in data.values())
+    assert not [name for name in os.listdir(tmp_path / "stats") if name.endswith(".tmp")]
@@ -0,0 +1,39 @@
+from notes_store import NotesStore, note_tags, similarity
+
+
+def test_tags_hosts_and_ports():
+    assert note_tags("10.0.0.5 has 22/tcp and port 8080 open, web on 10.0.0.5:443") == (["10.0.0.5"], ["22", "443", "8080"])
+
+
+def test_duplicates_are_dropped(tmp_path):
+    store = NotesStore(str(tmp_path / "n.sqlite3"))
+    added = store.add_many(["NOTE: 10.0.0.5 runs OpenSSH 8.2 on port 22",
+                            "NOTE: 10.0.0.5 runs OpenSSH 8.2 on port 22.",
+                            "NOTE: admin password found in /var/www/config.php"])
+    assert len(added) == 2
+    assert store.add_many(["10.0.0.5 runs OpenSSH 8.2 on port 22"]) == []
+    assert store.count() == 2
+
+
+def test_relevant_ranks_matching_notes_first(tmp_path):
+    store = NotesStore(str(tmp_path / "n.sqlite3"))
+    store.add_many(["10.0.0.5 runs OpenSSH 8.2 on port 22",
+                    "admin password found in /var/www/config.php",
+                    "10.0.0.9 serves nginx on port 80",
+                    "smb share backups is readable anonymously on 10.0.0.7"])
+    picked = store.relevant("Command: hydra -l admin ssh://10.0.0.5\nOutput: [22][ssh] host: 10.0.0.5", k=2)
+    assert picked[0] == "10.0.0.5 runs OpenSSH 8.2 on port 22"
+    assert len(picked) <= 2
+
+
+def test_relevant_respects_budget_and_seen(tmp_path):
+    store = NotesStore(str(tmp_path / "n.sqlite3"))
+    long_note = "nginx " + "details " * 200
+    store.add_many([long_note, "nginx 1.18 on 10.0.0.9 port 80"])
+    assert store.relevant("nginx", budget=50) == ["nginx 1.18 on 10.0.0.9 port 80"]
+    assert store.relevant("nginx", budget=50, seen="we know nginx 1.18 on 10.0.0.9 port 80") == []
+
+
+def test_similarity():
+    assert similarity("a b c", "a b c") == 1.0
+    assert similarity("a b", "c d") == 0.0
@@ -0,0 +1,27 @@
+from output_compactor import clean_lines, compact_output, estimate_tokens
+
+
+def test_short_output_is_returned_cleaned(tmp_path):
+    text = "\x1b[32mok\x1b[0m\nsecond line\n\n"
+    assert compact_output(text, 100, log_dir=str(tmp_path)) == "ok\nsecond line"
+
+
+def test_progress_bars_and_repeats_collapse():
+    text = "start\n" + "".join(f"\r{i}% [#####]" for i in range(0, 101, 10)) + "\n" + "same\n" * 5 + "end"
+    assert clean_lines(text) == ["start", "100% [#####]", "same", "[previous line repeated 4 more times]", "end"]
+
+
+def test_long_output_fits_budget_and_keeps_head_tail_and_errors(tmp_path):
+    lines = [f"line {i} of boring output" for i in range(5000)]
+    lines[2500] = "E: Unable to locate package nginx-full"
+    out = compact_output("\n".join(lines), 500, log_dir=str(tmp_path))
+    assert estimate_tokens(out) <= 500 + 50
+    assert out.startswith("line 0 of boring output")
+    assert "line 4999 of boring output" in out
+    assert "E: Unable to locate package nginx-full" in out
+    assert "lines omitted" in out and "full output saved to" in out
+
+
+def test_long_lines_are_cut():
+    line = clean_lines("x" * 5000)[0]
+    assert len(line) < 500 and "chars cut" in line
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+import agent
+import probe_cache
+import tracing
+from shell_worker import ShellWorker
+
+
+@pytest.fixture
+def persistent_shell(tmp_path, monkeypatch):
+    worker = ShellWorker(cwd=str(tmp_path))
+    monkeypatch.setattr(agent, "get_worker", lambda: worker)
+    monkeypatch.setattr(agent, "PERSISTENT_SHELL", True)
+    monkeypatch.setattr(probe_cache, "PROBE_CACHE", False)
+    monkeypatch.setattr(tracing, "TRACE", False)
+    yield worker
+    worker.close()
+
+
+def test_parallel_lines_see_exported_variables(persistent_shell):
+    persistent_shell.run("export TARGET=10.0.0.5")
+    env = asyncio.run(agent.shell_environment())
+    cmds = ["echo a $TARGET", "echo b ${TARGET}"]
+    assert agent.missing_variables(cmds, env) == []
+    out = asyncio.run(agent.execute_parallel_async(cmds, rewrite_hosts=False, env=env))
+    assert "a 10.0.0.5" in out and "b 10.0.0.5" in out
+
+
+def test_unexported_variables_are_reported(persistent_shell):
+    persistent_shell.run("export TARGET=10.0.0.5; LOCAL=secret")
+    env = asyncio.run(agent.shell_environment())
+    assert agent.missing_variables(["curl $TARGET/a", "curl $LOCAL/b"], env) == ["LOCAL"]
+    # Bash's own variables and single-quoted text don't count
+    assert agent.missing_variables(["echo $RANDOM $HOME", "awk '{print $NF}' f"], env) == []
+
+
+def test_environment_round_trips_odd_values(persistent_shell):
+    persistent_shell.run("export MULTI=$'line one\\nline two' EQ='a=b'")
+    env = asyncio.run(persistent_shell.environment())
+    assert env["MULTI"] == "line one\nline two" and env["EQ"] == "a=b"
+
+
+def test_parallel_block_detection():
+    block = "```bash\n# parallel\ncurl -s $TARGET/a\ncurl -s $TARGET/b\n```"
+    assert agent.parallel_commands(block) == ["curl -s $TARGET/a", "curl -s $TARGET/b"]
+    assert agent.parallel_commands("```bash\n# parallel\ncd /tmp\nls\n```") is None
+    assert agent.parallel_commands("```bash\nping -c1 a.example\nping -c1 b.example\n```") is not None
+    assert agent.parallel_commands("```bash\nping -c1 a.example\nrm -rf x\n```") is None
+
+
+def test_parallel_marker_comes_from_the_fence_or_a_comment():
+    assert agent.parallel_commands("```bash parallel\necho a\necho b\n```") == ["echo a", "echo b"]
+    assert agent.parallel_commands("```bash\n# Parallel\necho a\necho b\n```") == ["echo a", "echo b"]
+    # A bare `parallel` line is GNU parallel, not a marker
+    block = "```bash\nparallel\necho done\n```"
+    assert agent.command_lines(block) == (["parallel", "echo done"], False)
+    assert agent.extract_command(block) == "parallel && echo done"
+    assert agent.extract_command("```bash ls -la```") == "ls -la"
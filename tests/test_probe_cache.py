@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+import probe_cache
+from probe_cache import ProbeCache, is_mutating, is_probe
+
+
+@pytest.mark.parametrize("cmd", [
+    "uname -a",
+    "cat /etc/os-release",
+    "which nginx",
+    "dpkg -l | grep nginx",
+    "dpkg-query -W -f='${Version}' nginx",
+    "ip a",
+    "sudo systemctl is-enabled nginx --no-pager",
+    "python3 --version",
+    "hostname -I",
+])
+def test_probes(cmd):
+    assert is_probe(cmd)
+    assert not is_mutating(cmd)
+
+
+@pytest.mark.parametrize("cmd", [
+    "uname -a; rm -rf /tmp/x",
+    "cat /etc/os-release > /tmp/x",
+    "which nginx && apt install -y nginx",
+    "ls -la",
+    "cat $(echo /etc/passwd)",
+    "hostname newname",
+    "systemctl status nginx",
+    "systemctl is-active nginx",
+])
+def test_not_probes(cmd):
+    assert not is_probe(cmd)
+
+
+@pytest.mark.parametrize("cmd", [
+    "sudo apt-get install -y nginx",
+    "apt -y remove nginx",
+    "systemctl restart nginx",
+    "pip install requests",
+    "echo x | sudo tee /etc/hosts",
+    "echo 127.0.0.1 x >> /etc/hosts",
+    "hostname newname",
+    "sudo ./setup.sh",
+    "cd /tmp && rm old.txt",
+    "source venv/bin/activate",
+    ". venv/bin/activate",
+    "export PATH=$HOME/.local/bin:$PATH",
+    "cd project",
+    "nvm use 18",
+    "conda activate ml",
+    "deactivate",
+])
+def test_mutating(cmd):
+    assert is_mutating(cmd)
+
+
+@pytest.mark.parametrize("cmd", ["ls -la", "grep -r apt notes.txt", "cat install.log", "nmap -sV 10.0.0.1"])
+def test_neutral(cmd):
+    assert not is_mutating(cmd)
+
+
+def test_cache_round_trip_and_invalidation(tmp_path):
+    cache = ProbeCache(str(tmp_path / "p.sqlite3"), host="box")
+    cache.record("uname  -a", "Linux box", 0)
+    assert cache.get("uname -a")[0] == "Linux box"
+    assert cache.hits == 1
+    cache.record("ls", "a b", 0)                    # neither probe nor mutating: no effect
+    assert cache.get("uname -a") is not None
+    cache.record("sudo apt-get install -y nginx", "", 0)
+    assert cache.get("uname -a") is None
+
+
+def test_failed_or_cut_probes_are_not_cached(tmp_path):
+    cache = ProbeCache(str(tmp_path / "p.sqlite3"), host="box")
+    cache.record("which nginx", "", 1)
+    cache.record("dpkg -l", "partial", 0, limit="ran longer than 60s")
+    assert cache.get("which nginx") is None and cache.get("dpkg -l") is None
+
+
+def test_entries_expire(tmp_path):
+    cache = ProbeCache(str(tmp_path / "p.sqlite3"), ttl=0, host="box")
+    cache.record("uname -a", "Linux box", 0)
+    assert cache.get("uname -a") is None
+
+
+def test_hosts_are_separate(tmp_path):
+    path = str(tmp_path / "p.sqlite3")
+    ProbeCache(path, host="a").record("uname -a", "Linux a", 0)
+    assert ProbeCache(path, host="b").get("uname -a") is None
+
+
+def test_report_stats(tmp_path, monkeypatch, capsys):
+    cache = ProbeCache(str(tmp_path / "p.sqlite3"), host="box")
+    monkeypatch.setattr(probe_cache, "_cache", cache)
+    probe_cache.report_stats()
+    assert capsys.readouterr().out == ""
+    cache.record("uname -a", "Linux box", 0)
+    cache.get("uname -a")
+    probe_cache.report_stats()
+    assert "Probe cache: 1 hits" in capsys.readouterr().out
+
+
+def test_probes_are_keyed_by_shell_context(tmp_path):
+    cache = ProbeCache(str(tmp_path / "p.sqlite3"), host="box")
+    cache.record("which python", "/usr/bin/python", 0, context="system")
+    assert cache.get("which python", "venv") is None
+    assert cache.get("which python", "system")[0] == "/usr/bin/python"
+
+
+def test_activating_a_virtualenv_changes_the_answer(tmp_path, monkeypatch):
+    import asyncio
+
+    import agent
+    from shell_worker import ShellWorker
+
+    system, venv = tmp_path / "bin", tmp_path / "venv" / "bin"
+    for directory in (system, venv):
+        directory.mkdir(parents=True)
+        (directory / "tool").write_text("#!/bin/sh\n")
+        (directory / "tool").chmod(0o755)
+    (venv / "activate").write_text(f"export VIRTUAL_ENV={tmp_path / 'venv'}\nexport PATH={venv}:$PATH\n")
+    worker = ShellWorker(cwd=str(tmp_path), env=dict(os.environ, PATH=f"{system}:{os.environ['PATH']}"))
+    monkeypatch.setattr(agent, "get_worker", lambda: worker)
+    monkeypatch.setattr(agent, "PERSISTENT_SHELL", True)
+    monkeypatch.setattr(probe_cache, "_cache", ProbeCache(str(tmp_path / "p.sqlite3"), host="box"))
+    try:
+        run = lambda cmd: asyncio.run(agent.run_command(cmd, rewrite_hosts=False, echo=False))[0]
+        assert run("command -v tool") == str(system / "tool")
+        assert "Cached result" in run("command -v tool")
+        run("source venv/bin/activate")
+        assert run("command -v tool") == str(venv / "tool")
+    finally:
+        worker.close()
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+from email.utils import formatdate
+
+import pytest
+
+import rate_limiter
+from conftest import REPO_DIR
+from rate_limiter import RateLimiter, parse_delay
+
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("7", 7.0),
+    ("0.25", 0.25),
+    ("1m30s", 90.0),
+    ("250ms", 0.25),
+    ("2h", 7200.0),
+    ("-3", 0.0),
+    ("soon", None),
+    (None, None),
+])
+def test_parse_delay(value, expected):
+    assert parse_delay(value) == expected
+
+
+def test_parse_delay_timestamps():
+    now = 1_700_000_000.0
+    assert parse_delay(str(int((now + 12) * 1000)), now=now) == pytest.approx(12)   # OpenRouter reset, epoch ms
+    assert parse_delay(str(int(now + 30)), now=now) == pytest.approx(30)             # epoch seconds
+    assert parse_delay(formatdate(now + 60, usegmt=True), now=now) == pytest.approx(60)
+
+
+def test_retry_after_is_honoured(monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda a, b: pytest.fail("jitter used"))
+    limiter = RateLimiter(rpm=None)
+    assert limiter.rate_limited({"retry-after": "0.2"}) == pytest.approx(0.2)
+    assert limiter.rate_limited({"x-ratelimit-reset-requests": "1m"}) == pytest.approx(60)
+    start = time.monotonic()
+    limiter.blocked_until = time.monotonic() + 0.1
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_full_jitter_bounds():
+    limiter = RateLimiter(rpm=None)
+    for failures in range(12):
+        limiter.failures, limiter.backoff_total = failures, 0.0
+        delay = limiter.rate_limited()
+        assert 0 <= delay <= min(rate_limiter.BACKOFF_CAP, rate_limiter.BACKOFF_BASE * 2 ** failures)
+
+
+def test_gives_up_after_max_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "MAX_BACKOFF", 10.0)
+    limiter = RateLimiter(rpm=None)
+    assert limiter.rate_limited({"retry-after": "6"}) == 6
+    assert limiter.rate_limited({"retry-after": "6"}) is None
+    limiter.succeeded()
+    assert limiter.rate_limited({"retry-after": "6"}) == 6
+
+
+def test_bucket_paces_requests():
+    limiter = RateLimiter(rpm=600)          # one request per 0.1 s
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert 0.18 <= time.monotonic() - start < 1.0
+
+
+def test_learned_limit_never_speeds_up():
+    limiter = RateLimiter(rpm=20)
+    limiter.succeeded({"x-ratelimit-limit-requests": "1000"})     # a per-day quota must not mean 1000/min
+    assert limiter.rate == pytest.approx(20 / 60)
+    limiter.succeeded({"x-ratelimit-limit-requests": "10"})
+    assert limiter.rate == pytest.approx(10 / 60 * rate_limiter.HEADROOM)
+
+
+def test_exhausted_quota_blocks_until_reset():
+    limiter = RateLimiter(rpm=None)
+    limiter.succeeded({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "30s"})
+    assert limiter.wait_time() == pytest.approx(30, abs=1)
+
+
+def test_duckai_retries_injected_429s(tmp_path, monkeypatch):
+    import duckai
+    import history_store
+    from mock_llm import start_server
+
+    server, state = start_server(0)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        state.reset(replies=["first", "second", "third"], latency=0, token_rate=0, rate_limit_every=2,
+                    retry_after="0.1")
+        monkeypatch.setattr(duckai, "STATUS_URL", f"{base}/duckchat/v1/status")
+        monkeypatch.setattr(duckai, "CHAT_URL", f"{base}/duckchat/v1/chat")
+        monkeypatch.setattr(duckai, "STREAM", False)
+        monkeypatch.setattr(history_store, "HISTORY_PATH", str(tmp_path / "history.jsonl"))
+        monkeypatch.setitem(rate_limiter.RATE_LIMITS, "duckai", None)
+        monkeypatch.setattr(rate_limiter, "_limiters", {})
+        backend = duckai.DuckAIBackend()
+        msgs = [{"role": "user", "content": "hi"}]
+        start = time.monotonic()
+        replies = [backend._ask(msgs, None) for _ in range(3)]
+        assert replies == [("first", None), ("second", None), ("third", None)]
+        # Every other request got a 429 with Retry-After: 0.1, waited out instead of failing
+        assert state.stats()["rate_limited"] == 2
+        assert time.monotonic() - start >= 0.2
+        limiter = rate_limiter.get_limiter("duckai", duckai.MODEL_NAME)
+        assert limiter.failures == 0 and limiter.backoff_total == 0
+    finally:
+        server.shutdown()
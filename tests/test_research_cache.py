@@ -0,0 +1,50 @@
+import pytest
+
+import research_cache
+from research_cache import NO_RESULTS, ResearchCache, lookup, normalize_query
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    cache = ResearchCache(str(tmp_path / "research.sqlite3"))
+    monkeypatch.setattr(research_cache, "_cache", cache)
+    return cache
+
+
+def counting(*texts):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return texts[min(len(calls), len(texts)) - 1]
+    return fetch, calls
+
+
+def test_results_are_cached():
+    fetch, calls = counting("- nmap (https://nmap.org)")
+    assert lookup("web_search", "nmap", fetch) == "- nmap (https://nmap.org)"
+    assert lookup("web_search", "nmap", fetch) == "- nmap (https://nmap.org)"
+    assert len(calls) == 1
+
+
+def test_empty_results_are_not_cached(cache):
+    fetch, calls = counting("", "- found it (https://example.com)")
+    assert lookup("web_search", "rare error", fetch) == NO_RESULTS
+    assert cache.get("web_search", "rare error") is None
+    assert lookup("web_search", "rare error", fetch) == "- found it (https://example.com)"
+    assert len(calls) == 2
+
+
+def test_stale_copy_when_refresh_fails_or_finds_nothing(cache, monkeypatch):
+    cache.put("web_search", "q", "- old (https://example.com)")
+    monkeypatch.setitem(research_cache.TTL, "web_search", 0)
+
+    def broken():
+        raise OSError("offline")
+    assert lookup("web_search", "q", broken).startswith("- old (https://example.com)\n(stale")
+    assert lookup("web_search", "q", lambda: "").startswith("- old (https://example.com)\n(stale")
+    assert lookup("web_search", "other", broken) == "Lookup failed: offline"
+
+
+def test_normalize_query():
+    assert normalize_query('  "Nmap   SCRIPTS." ') == "nmap scripts"
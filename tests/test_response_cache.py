@@ -0,0 +1,65 @@
+import agent
+import chatgpt
+import probe_cache
+import response_cache
+import tracing
+from context_window import with_recall
+from history_store import HistoryStore
+from response_cache import ResponseCache, cache_key, task_messages
+
+REPLIES = ["Starting.\n```bash\necho hello from the task\n```", "Success. TASK COMPLETE"]
+
+
+def test_task_messages_drop_earlier_sessions_and_recalled_text():
+    system = {"role": "system", "content": "sys"}
+    earlier = [{"role": "user", "content": "Task: old job"}, {"role": "assistant", "content": "done"}]
+    task = [{"role": "user", "content": with_recall("Relevant turns from earlier sessions:\nx\n", "Task: new job")},
+            {"role": "assistant", "content": "```bash\nls\n```"},
+            {"role": "user", "content": with_recall("notes\n", "Command: ls\nOutput: a")}]
+    assert task_messages([system] + earlier + task) == [
+        system,
+        {"role": "user", "content": "Task: new job"},
+        {"role": "assistant", "content": "```bash\nls\n```"},
+        {"role": "user", "content": "Command: ls\nOutput: a"},
+    ]
+    assert cache_key("b", "m", 0, [system] + task) == cache_key("b", "m", 0, [system] + earlier * 3 + task)
+    assert cache_key("b", "m", 0, [system] + task) != cache_key("b", "m", 0, [system] + task[:1])
+
+
+def test_without_a_task_turn_the_whole_window_is_the_key():
+    msgs = [{"role": "system", "content": "sys"}, {"role": "user", "content": "Command: ls\nOutput: a"}]
+    assert task_messages(msgs) == msgs
+
+
+def test_replayed_task_hits_the_cache_despite_earlier_history(tmp_path, monkeypatch):
+    history = str(tmp_path / "history.jsonl")
+    store = HistoryStore(history, background=False)
+    for i in range(30):
+        store.append({"role": "user", "content": f"Task: earlier job {i}" + agent.FIRST_STEP_PROMPT})
+        store.append({"role": "assistant", "content": f"```bash\necho hello {i}\n```"})
+    store.close()
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    monkeypatch.setattr(response_cache, "BYPASS", False)
+    monkeypatch.setattr(probe_cache, "PROBE_CACHE", False)
+    monkeypatch.setattr(tracing, "TRACE", False)
+    monkeypatch.setattr(agent, "HISTORY_FILE", history)
+    monkeypatch.setattr(agent, "LEGACY_HISTORY_FILE", str(tmp_path / "none.json"))
+    monkeypatch.setattr(chatgpt, "STREAM", False)
+    monkeypatch.chdir(tmp_path)
+
+    calls = []
+
+    def fake_complete(self, msgs, on_token):
+        calls.append(msgs)
+        return REPLIES[(len(calls) - 1) % len(REPLIES)], None
+
+    monkeypatch.setattr(chatgpt.ChatGPTBackend, "_complete", fake_complete)
+    monkeypatch.setattr(chatgpt.ChatGPTBackend, "stream", False)
+
+    assert agent.run_task(chatgpt.ChatGPTBackend(), "say hello")
+    assert len(calls) == 2 and cache.misses == 2
+    # The second run preloads the first one's messages and may recall its turns
+    assert agent.run_task(chatgpt.ChatGPTBackend(), "say hello")
+    assert len(calls) == 2
+    assert cache.hits == 2
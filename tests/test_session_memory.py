@@ -0,0 +1,51 @@
+from context_window import message_tokens
+from output_compactor import estimate_tokens
+from session_memory import (SUMMARY_TOKEN_BUDGET, SessionFacts, compact_session, is_summary,
+                            MAX_SUMMARY_PORTS)
+
+
+def nmap_turn(i):
+    host = f"10.0.{i // 250}.{i % 250 + 1}"
+    ports = "\n".join(f"{p}/tcp open  service-{p}  Some Server {p}.{i}" for p in range(20, 40))
+    extra = f"\n[22][ssh] host: {host}   login: admin   password: pass{i}" if i % 7 == 0 else ""
+    return [{"role": "user", "content": f"Command: nmap -sV {host}\nOutput:\n{ports}{extra}"},
+            {"role": "assistant", "content": f"Success.\nNOTE: {host} runs 20 services, check {i}\n"
+                                             f"```bash\nnmap -sV 10.0.{(i + 1) // 250}.{(i + 1) % 250 + 1}\n```"}]
+
+
+def test_summary_size_plateaus_over_a_long_session(tmp_path):
+    archive = str(tmp_path / "archive.jsonl")
+    history, facts = [{"role": "system", "content": "system prompt"}], SessionFacts()
+    summary_sizes, prompt_sizes = [], []
+    for i in range(600):
+        history = compact_session(history + nmap_turn(i), facts, archive, limit=6000)
+        summary = [m for m in history if is_summary(m)]
+        if summary:
+            summary_sizes.append(estimate_tokens(summary[0]["content"]))
+        prompt_sizes.append(sum(message_tokens(m) for m in history))
+    assert max(summary_sizes) <= SUMMARY_TOKEN_BUDGET
+    # Flat once the caps are reached: the last half is no bigger than the first half
+    half = len(summary_sizes) // 2
+    assert max(summary_sizes[half:]) <= max(summary_sizes[:half])
+    assert max(prompt_sizes) <= 6000 + message_tokens(nmap_turn(0)[0]) * 2
+    assert len(facts.ports) <= MAX_SUMMARY_PORTS
+    assert facts.omitted["ports"] > 0 and facts.omitted["notes"] > 0
+    text = summary[0]["content"]
+    assert "earlier ones omitted" in text and "Credentials found: YES" in text
+
+
+def test_render_keeps_to_budget_and_counts_what_it_leaves_out():
+    facts = SessionFacts()
+    for i in range(40):
+        for msg in nmap_turn(i):
+            facts.absorb(msg)
+    text = facts.render(budget=300)
+    assert estimate_tokens(text) <= 300
+    assert "Commands already run" not in text or "omitted" in text
+
+
+def test_old_sessions_load_and_round_trip():
+    facts = SessionFacts({"hosts": ["10.0.0.1"], "commands": ["ls  [ok]"], "commands_omitted": 5})
+    assert facts.commands_omitted == 5
+    again = SessionFacts(facts.to_dict())
+    assert again.to_dict() == facts.to_dict()
@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+
+from shell_worker import ShellWorker
+
+
+@pytest.fixture
+def worker(tmp_path):
+    w = ShellWorker(cwd=str(tmp_path))
+    yield w
+    w.close()
+
+
+def test_state_carries_over_between_commands(worker, tmp_path):
+    (tmp_path / "sub").mkdir()
+    assert worker.run("cd sub && export STAGE=two")[1] == 0
+    out, code, limit = worker.run("echo $STAGE; pwd")
+    assert (out, code, limit) == (f"two\n{tmp_path / 'sub'}\n", 0, None)
+    assert worker.cwd == str(tmp_path / "sub")
+
+
+def test_exit_codes_and_syntax_errors(worker):
+    assert worker.run("false")[1] == 1
+    assert worker.run("sh -c 'exit 7'")[1] == 7
+    out, code, _ = worker.run("if then")
+    assert code != 0 and "syntax error" in out
+    assert worker.run("echo still here") == ("still here\n", 0, None)
+
+
+def test_large_output_without_trailing_newline(worker):
+    out, code, _ = worker.run("head -c 300000 /dev/zero | tr '\\0' x; printf tail")
+    assert code == 0 and len(out) == 300004 and out.endswith("xtail")
+
+
+def test_exit_restarts_the_shell(worker):
+    out, code, limit = worker.run("echo bye; exit 3")
+    assert (out, code, limit) == ("bye\n", 3, None)
+    assert worker.run("echo back") == ("back\n", 0, None)
+
+
+def test_stdin_is_not_the_command_stream(worker):
+    assert worker.run("cat") == ("", 0, None)
+
+
+def test_wall_clock_limit_kills_and_restarts_in_same_directory(worker, tmp_path):
+    out, code, limit = worker.run("echo started; sleep 30", timeout=0.5)
+    assert code is None and "ran longer than" in limit and out == "started\n"
+    assert worker.run("pwd") == (f"{tmp_path}\n", 0, None)
+
+
+def test_idle_limit(worker):
+    out, code, limit = worker.run("echo a; sleep 0.2; echo b; sleep 30", timeout=10, idle_timeout=0.5)
+    assert code is None and "printed nothing" in limit and out == "a\nb\n"
+
+
+def test_output_cap(worker):
+    out, code, limit = worker.run("yes", timeout=10, max_bytes=10000)
+    assert code is None and "more than 10000 bytes" in limit
+    assert len(out.encode()) <= 10000
+    assert worker.run("echo ok") == ("ok\n", 0, None)
+
+
+def test_limit_kills_background_children(worker, tmp_path):
+    marker = tmp_path / "survived"
+    worker.run(f"(sleep 1; touch {marker}) & sleep 30", timeout=0.3)
+    time.sleep(1.3)
+    assert not marker.exists()
+
+
+def test_sudo_runs_non_interactively():
+    import agent
+
+    assert agent.noninteractive_sudo("sudo apt-get install -y nginx") == "sudo -n apt-get install -y nginx"
+    assert agent.noninteractive_sudo("cd /tmp && sudo -u www-data ls") == "cd /tmp && sudo -n -u www-data ls"
+    assert agent.noninteractive_sudo("find . | xargs sudo rm") == "find . | xargs sudo -n rm"
+    for cmd in ("sudo -n true", "echo pw | sudo -S ls", "sudo -A ls", "grep sudo /var/log/auth.log", "visudo"):
+        assert agent.noninteractive_sudo(cmd) == cmd
+
+
+def test_sudo_check_warns_when_a_password_is_needed(tmp_path, monkeypatch, capsys):
+    import agent
+
+    fake = tmp_path / "sudo"
+    fake.write_text("#!/bin/sh\necho 'sudo: a password is required' >&2\nexit 1\n")
+    fake.chmod(0o755)
+    monkeypatch.setattr(agent.os, "geteuid", lambda: 1000)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    assert not agent.check_sudo()
+    assert "passwordless sudo" in capsys.readouterr().out
+    fake.write_text("#!/bin/sh\nexit 0\n")
+    assert agent.check_sudo()
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE", False)
+    monkeypatch.setattr(tracing, "TRACE_DIR", str(tmp_path))
+    monkeypatch.setattr(tracing, "_keep_spans", False)
+    monkeypatch.setattr(tracing, "_spans", [])
+    monkeypatch.setattr(tracing, "_buffer", [])
+    monkeypatch.setattr(tracing, "_file", None)
+    yield tmp_path
+    if tracing._file is not None:
+        tracing._file.close()
+
+
+def test_off_by_default_writes_nothing(fresh):
+    with tracing.span("exec"):
+        pass
+    tracing.flush()
+    assert list(fresh.iterdir()) == [] and tracing._spans == []
+
+
+def test_writes_are_buffered_and_spans_only_kept_for_stats(fresh, monkeypatch):
+    monkeypatch.setattr(tracing, "FLUSH_EVERY", 10)
+    tracing.enable()
+    for _ in range(9):
+        tracing.record("exec", 0.01)
+    assert list(fresh.iterdir()) == []
+    tracing.record("exec", 0.01)
+    assert len(tracing.load(tracing.trace_path())) == 10
+    assert tracing._spans == []
+    tracing.enable(keep_spans=True)
+    tracing.record("llm", 0.5, prompt_tokens=10)
+    tracing.flush()
+    assert [s["name"] for s in tracing._spans] == ["llm"]
+    assert "llm" in tracing.summarize()
+
+
+def test_old_traces_are_pruned(fresh):
+    for i in range(60):
+        (fresh / f"20240101-0000{i:02d}-1.jsonl").write_text(json.dumps({"name": "x"}) + "\n")
+    tracing.enable()
+    tracing.record("exec", 0.01)
+    tracing.flush()
+    files = sorted(p.name for p in fresh.iterdir())
+    assert len(files) == tracing.KEEP_TRACES
+    assert files[-1] == f"{tracing._run_id}.jsonl"
@@ -0,0 +1,161 @@
+"""
+Per-step tracing: where does the time of a run go?
+
+Every phase of every step (LLM call, time to first token, DNS, command
+execution, history writes, rate-limit backoff, ...) is recorded as a span
+and appended to one JSONL file per run under TRACE_DIR:
+
+    {"run": "...", "step": 3, "name": "exec", "start": 1718000000.1, "ms": 812.4, "bytes": 5120, ...}
+
+Tracing is off unless the run asks for it: `python3 -m assistant --stats ...`
+turns it on and prints a summary when the task ends, and ASSISTANT_TRACE=1
+only writes the trace. Spans are buffered and written FLUSH_EVERY at a time
+(and at exit), only --stats keeps them in memory, and only the newest
+KEEP_TRACES trace files are kept. `python3 tracing.py <trace.jsonl>`
+summarizes an old run: p50/p95 per phase, total tokens and total time spent
+backing off.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE = bool(os.environ.get("ASSISTANT_TRACE"))  # also switched on by --stats
+TRACE_DIR = os.path.expanduser("~/.shell_traces")
+KEEP_TRACES = 50        # newest trace files kept; older ones are deleted when a new run starts writing
+FLUSH_EVERY = 64        # spans buffered before they are written
+
+_run_id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+_spans = []             # only filled with keep_spans (for summarize())
+_keep_spans = False
+_buffer = []
+_lock = threading.Lock()
+_file = None
+_step = 0
+
+
+def enable(keep_spans=False):
+    """Trace this run; keep_spans also keeps every span in memory for summarize()."""
+    global TRACE, _keep_spans
+    TRACE = True
+    _keep_spans = _keep_spans or keep_spans
+
+
+def set_step(step):
+    global _step
+    _step = step
+
+
+def trace_path():
+    return os.path.join(TRACE_DIR, f"{_run_id}.jsonl")
+
+
+def record(name, seconds, **attrs):
+    """Record a span measured elsewhere (e.g. a sleep that already happened)."""
+    if not TRACE:
+        return
+    span = {"run": _run_id, "step": _step, "name": name,
+            "start": round(time.time() - seconds, 3), "ms": round(seconds * 1000, 1)}
+    span.update(attrs)
+    with _lock:
+        if _keep_spans:
+            _spans.append(span)
+        _buffer.append(span)
+        if len(_buffer) >= FLUSH_EVERY:
+            _flush()
+
+
+def flush():
+    """Write the buffered spans to this run's trace file."""
+    with _lock:
+        _flush()
+
+
+def prune(directory=TRACE_DIR, keep=KEEP_TRACES):
+    """Delete all but the newest `keep` trace files."""
+    try:
+        runs = sorted(f for f in os.listdir(directory) if f.endswith(".jsonl"))
+    except OSError:
+        return
+    for name in runs[:max(len(runs) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def _flush():
+    global _file
+    if not _buffer:
+        return
+    try:
+        if _file is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            prune(TRACE_DIR, KEEP_TRACES - 1)
+            _file = open(trace_path(), "a", encoding="utf-8")
+        _file.write("".join(json.dumps(span, default=str) + "\n" for span in _buffer))
+        _file.flush()
+    except OSError:
+        pass
+    _buffer.clear()
+
+
+atexit.register(flush)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the block as one span. The yielded dict is recorded with the span,
+    so the block can attach counts (tokens, bytes, exit code) as it learns them.
+    """
+    start = time.monotonic()
+    try:
+        yield attrs
+    finally:
+        record(name, time.monotonic() - start, **attrs)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+def summarize(spans=None):
+    """Text report: p50/p95/total per phase, total tokens and backoff time."""
+    spans = _spans if spans is None else spans
+    phases = {}
+    for s in spans:
+        phases.setdefault(s["name"], []).append(s["ms"])
+    lines = [f"{'phase':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}"]
+    for name, ms in sorted(phases.items(), key=lambda kv: -sum(kv[1])):
+        lines.append(f"{name:<14}{len(ms):>7}{percentile(ms, 0.5):>10.1f}{percentile(ms, 0.95):>10.1f}{sum(ms) / 1000:>10.2f}")
+    prompt = sum(s.get("prompt_tokens", 0) for s in spans)
+    completion = sum(s.get("completion_tokens", 0) for s in spans)
+    backoff = sum(s["ms"] for s in spans if s["name"] == "backoff") / 1000
+    steps = len({s["step"] for s in spans if s["step"]})
+    lines.append(f"steps: {steps}  tokens: {prompt} prompt + {completion} completion (estimated)  backoff: {backoff:.2f}s")
+    return "\n".join(lines)
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    import sys
+    # python3 tracing.py [trace.jsonl]  ->  summary of that run (default: the newest one)
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        runs = sorted(os.listdir(TRACE_DIR)) if os.path.isdir(TRACE_DIR) else []
+        if not runs:
+            sys.exit(f"No traces in {TRACE_DIR}")
+        path = os.path.join(TRACE_DIR, runs[-1])
+    print(path)
+    print(summarize(load(path)))